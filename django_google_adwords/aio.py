@@ -0,0 +1,127 @@
+"""
+asyncio counterparts of ReportFile.objects.request and helper.paged_request.
+
+This module requires Python 3.6+ (it uses async generators), it can't be imported on the older
+Pythons the rest of the package supports and isn't installed on them (see setup.py).
+
+The blocking googleads calls run on a thread pool executor, at most
+GOOGLEADWORDS_ASYNC_CONCURRENCY at a time per event loop, so one process can drive many
+concurrent downloads from an event loop;
+
+    async def download(accounts, report_definition):
+        return await asyncio.gather(*[arequest(report_definition, account.account_id) for account in accounts])
+
+Rate limiting (a ThrottledError, RateExceededError or PagedRequestCheckpoint) is waited out
+with asyncio.sleep rather than by blocking a thread.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from weakref import WeakKeyDictionary
+import asyncio
+import logging
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .errors import PagedRequestCheckpoint, RateExceededError, ThrottledError
+from .helper import paged_request
+from .models import ReportFile
+
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_semaphores = WeakKeyDictionary()
+
+
+def get_executor():
+    """
+    Return the executor the blocking googleads calls are run on.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.GOOGLEADWORDS_ASYNC_CONCURRENCY)
+    return _executor
+
+
+def get_semaphore(loop):
+    """
+    Return the semaphore limiting the concurrent googleads calls made from loop.
+    """
+    if loop not in _semaphores:
+        _semaphores[loop] = asyncio.Semaphore(settings.GOOGLEADWORDS_ASYNC_CONCURRENCY)
+    return _semaphores[loop]
+
+
+def call(func, *args, **kwargs):
+    """
+    Call func in an executor thread.
+
+    The executor threads aren't handling requests so Django won't close their database
+    connections, do as a request would so connections that have errored or exceeded
+    CONN_MAX_AGE aren't reused.
+    """
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run(func, *args, **kwargs):
+    """
+    Run the blocking func on the executor once the semaphore allows it.
+    """
+    loop = asyncio.get_event_loop()
+    async with get_semaphore(loop):
+        return await loop.run_in_executor(get_executor(), partial(call, func, *args, **kwargs))
+
+
+async def arequest(report_definition, client_customer_id, retries=3):
+    """
+    Async ReportFile.objects.request, see it for the arguments.
+
+    :param retries: The number of times a RateExceededError from the API is retried, waiting on
+                    the rate limiter (ThrottledError) isn't counted.
+    :return: ReportFile
+    """
+    while True:
+        try:
+            return await run(ReportFile.objects.request,
+                             report_definition=report_definition,
+                             client_customer_id=client_customer_id)
+        except ThrottledError as exc:
+            await asyncio.sleep(exc.retry_after_seconds)
+        except RateExceededError as exc:
+            if retries <= 0:
+                raise
+            retries -= 1
+            logger.info("Caught RateExceededError for client customer id '%s' - retrying in '%s' seconds.", client_customer_id, exc.retry_after_seconds)
+            await asyncio.sleep(exc.retry_after_seconds)
+
+
+async def apaged_request(service, selector=None, number_results=100, start_index=0, number_pages=False):
+    """
+    Async paged_request, see it for the arguments.
+
+        async for (data, selector) in apaged_request('TargetingIdeaService', selector):
+            ...
+    """
+    selector = {} if selector is None else selector
+    while True:
+        pages = paged_request(service, selector,
+                              number_results=number_results,
+                              start_index=start_index,
+                              number_pages=number_pages,
+                              checkpoint=True)
+        try:
+            while True:
+                page = await run(next, pages, None)
+                if page is None:
+                    return
+                yield page
+        except PagedRequestCheckpoint as exc:
+            # Continue from the page that wasn't retrieved, with the pages that are left, once the
+            # rate limit has passed
+            selector, start_index, number_pages = exc.selector, exc.start_index, exc.number_pages
+            await asyncio.sleep(exc.retry_after_seconds)
@@ -8,6 +8,31 @@ class RateExceededError(Exception):
         Exception.__init__(self, retry_after_seconds)
 
 
+class ThrottledError(RateExceededError):
+    """
+    Raised instead of making an API call when the rate limiter has no tokens available.
+    """
+    pass
+
+
+class PagedRequestCheckpoint(RateExceededError):
+    """
+    Raised by paged_request(checkpoint=True) instead of waiting when it's rate limited.
+
+    Call paged_request again with selector, start_index and number_pages after
+    retry_after_seconds (ie.. with a Celery retry countdown) to continue from the page that
+    wasn't retrieved. number_pages is what's left of the request's number_pages (including that
+    page), or False if it wasn't limited.
+    """
+
+    def __init__(self, retry_after_seconds, selector, start_index, number_pages=False):
+        self.retry_after_seconds = retry_after_seconds
+        self.selector = selector
+        self.start_index = start_index
+        self.number_pages = number_pages
+        Exception.__init__(self, retry_after_seconds, selector, start_index, number_pages)
+
+
 class InterceptedGoogleAdsError(Exception):
 
     def __init__(self, google_ads_error, account_id):
@@ -42,4 +67,22 @@ class NoAccountCurrencyCodeError(Exception):
 
 
 class AdwordsDataInconsistencyError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+
+class LeaseLostError(Exception):
+    """
+    Raised when an ImportLease has expired (or been taken by another worker) before it was renewed.
+    """
+    pass
+
+
+class LeaseBusyError(Exception):
+    """
+    Raised when an ImportLease is held by another import, retry after retry_after_seconds.
+    """
+
+    def __init__(self, key, retry_after_seconds):
+        self.key = key
+        self.retry_after_seconds = retry_after_seconds
+        Exception.__init__(self, key, retry_after_seconds)
@@ -2,35 +2,240 @@ from googleads.adwords import AdWordsClient
 from googleads.oauth2 import GoogleRefreshTokenClient
 from googleads.errors import GoogleAdsError
 from django.conf import settings
-from time import sleep
+from django.core.cache import caches
+from django.db.models import Count, Max
+from django.utils import six
+from django_google_adwords.errors import PagedRequestCheckpoint
+from django_google_adwords.lock import get_lock_backend
+from django_google_adwords.ratelimit import api_rate_limiter
+from datetime import datetime, timedelta
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from time import time
+import copy
+import hashlib
 import logging
+import threading
+import zlib
 
 logger = logging.getLogger(__name__)
 
 
+class ClientPool(object):
+    """
+    A process level cache of clients, each client is evicted ttl seconds after it was created.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {}
+
+    def get(self, key, factory, ttl):
+        """
+        Return the client for key, calling factory to create it if it's missing or has expired.
+        """
+        now = time()
+        with self.lock:
+            client, expires = self.clients.get(key, (None, 0))
+            if expires <= now:
+                # Evict every expired client while we're here
+                for expired_key in [k for k, (_, e) in self.clients.items() if e <= now]:
+                    del self.clients[expired_key]
+                client = factory()
+                self.clients[key] = (client, now + ttl)
+            return client
+
+    def clear(self):
+        with self.lock:
+            self.clients.clear()
+
+
+class SharedRefreshTokenClient(GoogleRefreshTokenClient):
+    """
+    A GoogleRefreshTokenClient that shares its access token with every process using the same
+    credentials through the GOOGLEADWORDS_TOKEN_CACHE cache.
+
+    Refreshes are single flight - one process refreshes the token while the others wait on the
+    lock backend and then use the token it stored.
+    """
+
+    def token_cache_key(self):
+        credentials = self.oauth2credentials
+        identity = '%s:%s' % (credentials.client_id, credentials.refresh_token)
+        return 'googleadwords-token-%s' % hashlib.md5(identity.encode('utf-8')).hexdigest()
+
+    def load_shared_token(self):
+        """
+        Use the shared access token if it isn't due to be refreshed, returning whether it was used.
+        """
+        shared = caches[settings.GOOGLEADWORDS_TOKEN_CACHE].get(self.token_cache_key())
+        if shared is None:
+            return False
+        access_token, token_expiry = shared
+        if token_expiry - datetime.utcnow() < timedelta(seconds=settings.GOOGLEADWORDS_TOKEN_REFRESH_MARGIN):
+            return False
+        self.oauth2credentials.access_token = access_token
+        self.oauth2credentials.token_expiry = token_expiry
+        return True
+
+    def store_shared_token(self):
+        credentials = self.oauth2credentials
+        if credentials.token_expiry is None:
+            return
+        # Expire the shared token once it's due to be refreshed
+        timeout = (credentials.token_expiry - datetime.utcnow()).total_seconds() - settings.GOOGLEADWORDS_TOKEN_REFRESH_MARGIN
+        if timeout > 0:
+            caches[settings.GOOGLEADWORDS_TOKEN_CACHE].set(self.token_cache_key(), (credentials.access_token, credentials.token_expiry), int(timeout))
+
+    def refresh_token(self):
+        """
+        Retrieve a new access token from Google.
+        """
+        GoogleRefreshTokenClient.Refresh(self)
+
+    def Refresh(self):
+        if self.load_shared_token():
+            return
+
+        backend = get_lock_backend()
+        lock_id = '%s-refresh' % self.token_cache_key()
+        token = backend.acquire(lock_id, settings.GOOGLEADWORDS_TOKEN_REFRESH_LOCK_TIMEOUT)
+        try:
+            # The token may have been refreshed while we were waiting
+            if not self.load_shared_token():
+                self.refresh_token()
+                self.store_shared_token()
+        finally:
+            backend.release(lock_id, token)
+
+
+oauth2_clients = ClientPool()
+adwords_clients = ClientPool()
+
+
+def refresh_access_token(oauth2_client, margin=None):
+    """
+    Refresh the access token of a GoogleRefreshTokenClient if it expires within margin seconds
+    (GOOGLEADWORDS_TOKEN_REFRESH_MARGIN) rather than waiting until a request finds it expiring.
+    """
+    if margin is None:
+        margin = settings.GOOGLEADWORDS_TOKEN_REFRESH_MARGIN
+    credentials = oauth2_client.oauth2credentials
+    if credentials.token_expiry is None or credentials.token_expiry - datetime.utcnow() < timedelta(seconds=margin):
+        oauth2_client.Refresh()
+
+
 def adwords_service(client_customer_id=None):
     """
     Get an instance of GoogleRefreshTokenClient with configuration as per defined settings
     and use that to create an instance of AdwordsClient.
+
+    Both clients are pooled for GOOGLEADWORDS_CLIENT_POOL_TTL seconds, the GoogleRefreshTokenClient
+    per set of credentials and the AdwordsClient per client_customer_id.
     """
     if not client_customer_id:
         client_customer_id = settings.GOOGLEADWORDS_CLIENT_CUSTOMER_ID
 
-    oauth2_client = GoogleRefreshTokenClient(
+    credentials = (settings.GOOGLEADWORDS_CLIENT_ID,
+                   settings.GOOGLEADWORDS_CLIENT_SECRET,
+                   settings.GOOGLEADWORDS_REFRESH_TOKEN)
+
+    oauth2_client = oauth2_clients.get(credentials, lambda: SharedRefreshTokenClient(
         client_id=settings.GOOGLEADWORDS_CLIENT_ID,
         client_secret=settings.GOOGLEADWORDS_CLIENT_SECRET,
         refresh_token=settings.GOOGLEADWORDS_REFRESH_TOKEN
-    )
+    ), settings.GOOGLEADWORDS_CLIENT_POOL_TTL)
 
-    return AdWordsClient(
+    client = adwords_clients.get(credentials + (settings.GOOGLEADWORDS_DEVELOPER_TOKEN, client_customer_id), lambda: AdWordsClient(
         developer_token=settings.GOOGLEADWORDS_DEVELOPER_TOKEN,
         oauth2_client=oauth2_client,
         user_agent=settings.GOOGLEADWORDS_USER_AGENT,
         client_customer_id=client_customer_id
-    )
+    ), settings.GOOGLEADWORDS_CLIENT_POOL_TTL)
 
+    refresh_access_token(client.oauth2_client)
+    return client
 
-def paged_request(service, selector={}, number_results=100, start_index=0, retry=True, number_pages=False):
+
+def chunked(iterable, size):
+    """
+    Yield lists of at most size items from iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def date_windows(start, finish, days):
+    """
+    Yield (start, finish) tuples of consecutive date ranges of at most days days covering start to finish (inclusive).
+    """
+    while start <= finish:
+        window_finish = min(start + timedelta(days=days - 1), finish)
+        yield start, window_finish
+        start = window_finish + timedelta(days=1)
+
+
+def gunzip_lines(stream, tee=None, chunk_size=64 * 1024):
+    """
+    Yield the lines of a gzipped file like object as bytes, decompressing as it's read.
+
+    @param stream: A file like object of gzipped bytes, ie.. a report download response.
+    @param tee: An optional file like object that the compressed bytes are also written to.
+    @param chunk_size: The number of bytes read at a time.
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)  # expect a gzip header
+    pending = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if tee is not None:
+            tee.write(chunk)
+        lines = (pending + decompressor.decompress(chunk)).split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+
+    for line in (pending + decompressor.flush()).splitlines(True):
+        yield line
+
+
+def retry_after_seconds(e):
+    """
+    Return the number of seconds a GoogleAdsError says to wait due to RateExceededErrors, 0 if there are none.
+    """
+    if not hasattr(e, 'fault') or not hasattr(e.fault, 'detail') or not hasattr(e.fault.detail, 'ApiExceptionFault') or not hasattr(e.fault.detail.ApiExceptionFault, 'errors'):
+        return 0
+    return sum([int(fault.retryAfterSeconds) for fault in e.fault.detail.ApiExceptionFault.errors if getattr(fault, 'ApiError.Type') == 'RateExceededError'])
+
+
+def delete_duplicates(queryset, fields, dry_run=False):
+    """
+    Delete all but the most recently created row (highest id) for each combination of fields.
+
+    @param queryset: The rows to deduplicate.
+    @param fields: The names of the fields that should be unique together.
+    @param dry_run: If True only count the duplicate rows.
+    @return: The number of duplicate rows.
+    """
+    duplicates = queryset.values(*fields) \
+        .annotate(dga_count=Count('id'), dga_max_id=Max('id')) \
+        .filter(dga_count__gt=1)
+
+    deleted = 0
+    for duplicate in list(duplicates):
+        deleted += duplicate.pop('dga_count') - 1
+        keep = duplicate.pop('dga_max_id')
+        if not dry_run:
+            queryset.filter(**duplicate).exclude(id=keep).delete()
+    return deleted
+
+
+def paged_request(service, selector={}, number_results=100, start_index=0, retry=True, number_pages=False, checkpoint=False, concurrency=1):
     """
     Yields paged data as retrieved from the Adwords API.
 
@@ -83,14 +288,39 @@ def paged_request(service, selector={}, number_results=100, start_index=0, retry
 
     }}}
 
+    To resume after being rate limited without blocking the worker use checkpoint=True and
+    continue from the PagedRequestCheckpoint that's raised;
+
+    try:
+        for (data, selector) in paged_request('TargetingIdeaService', selector, start_index=start_index,
+                                              number_pages=number_pages, checkpoint=True):
+            ...
+    except PagedRequestCheckpoint as exc:
+        raise task.retry(args=[exc.selector, exc.start_index, exc.number_pages], countdown=exc.retry_after_seconds)
+
     @param service: A string representing the client service class, ie.. GetTargetingIdeaService
+                    (or the service itself).
     @param selector: A dict of values used to specify the request to the API.
     @param number_results: Results per page.
     @param start_index: Offset to start results at.
+    @param checkpoint: Raise a PagedRequestCheckpoint rather than waiting when rate limited.
+    @param number_pages: The maximum number of pages to retrieve (including the first).
+    @param concurrency: The number of pages to retrieve at once, once the first page has been
+                        retrieved the rest are fetched by a pool of this many threads (each with
+                        its own service) and yielded in order. suds services aren't thread safe
+                        so this requires service to be the name of the service, the pages of a
+                        service object are retrieved one at a time. Not supported with checkpoint.
     @yield data, selector
     """
-    client = adwords_service()
-    service = client.GetService(service, settings.GOOGLEADWORDS_CLIENT_VERSION)
+    if concurrency > 1 and not checkpoint and isinstance(service, six.string_types):
+        for page in _concurrent_paged_request(service, selector, number_results, start_index, retry, number_pages, concurrency):
+            yield page
+        return
+
+    if isinstance(service, six.string_types):
+        client = adwords_service()
+        service = client.GetService(service, settings.GOOGLEADWORDS_CLIENT_VERSION)
+    rate_limiter = api_rate_limiter()
 
     if 'paging' not in selector:
         selector['paging'] = {}
@@ -102,30 +332,88 @@ def paged_request(service, selector={}, number_results=100, start_index=0, retry
     more_pages = True
     page_number = 1
 
+    def remaining_pages():
+        # The page budget left for a resumed request, including the page not yet retrieved
+        return number_pages and number_pages - page_number + 1
+
     while more_pages:
         try:
+            if checkpoint:
+                seconds = rate_limiter.take()
+                if seconds:
+                    raise PagedRequestCheckpoint(seconds, selector, start_index, remaining_pages())
+            else:
+                rate_limiter.wait()
             response = service.get(selector)
             yield response.entries, selector
 
             # Now, get the next set of results
             start_index += number_results
             selector['paging']['startIndex'] = str(start_index)
-            if number_pages:
-                if number_pages >= page_number:
-                    more_pages = False
-            else:
-                more_pages = start_index < int(response.totalNumEntries)
+            more_pages = start_index < int(response.totalNumEntries)
+            if number_pages and page_number >= number_pages:
+                more_pages = False
 
             page_number += 1
 
         except GoogleAdsError as e:
-            if not retry or not hasattr(e, 'fault') or not hasattr(e.fault, 'detail') or not hasattr(e.fault.detail, 'ApiExceptionFault') or not hasattr(e.fault.detail.ApiExceptionFault, 'errors'):
+            if not retry:
                 raise
-            retryAfterSeconds = sum([int(fault.retryAfterSeconds) for fault in e.fault.detail.ApiExceptionFault.errors if getattr(fault, 'ApiError.Type') == 'RateExceededError'])
+            retryAfterSeconds = retry_after_seconds(e)
             if retryAfterSeconds > 0:
-                # We've hit a RateExceededError, sleep for some period of time
-                logger.info("Sleeping due to 'RateExceededError' for '%s' seconds." % retryAfterSeconds)
-                sleep(retryAfterSeconds)
+                # We've hit a RateExceededError, pause the rate limiter so every process backs off,
+                # the next page then waits for it
+                rate_limiter.pause(retryAfterSeconds)
+                if checkpoint:
+                    raise PagedRequestCheckpoint(retryAfterSeconds, selector, start_index, remaining_pages())
             else:
                 # We haven't hit an error we care about, raise it.
                 raise
+
+
+
+def _concurrent_paged_request(service, selector, number_results, start_index, retry, number_pages, concurrency):
+    """
+    paged_request retrieving every page after the first with a pool of concurrency threads, each
+    with its own instance of the service named service.
+    """
+    rate_limiter = api_rate_limiter()
+    local = threading.local()
+    selector.setdefault('paging', {})['numberResults'] = str(number_results)
+
+    def get_service():
+        if not hasattr(local, 'service'):
+            local.service = adwords_service().GetService(service, settings.GOOGLEADWORDS_CLIENT_VERSION)
+        return local.service
+
+    def get(index):
+        page_selector = copy.deepcopy(selector)
+        page_selector['paging']['startIndex'] = str(index)
+        while True:
+            rate_limiter.wait()
+            try:
+                return get_service().get(page_selector), page_selector
+            except GoogleAdsError as e:
+                retryAfterSeconds = retry_after_seconds(e) if retry else 0
+                if not retryAfterSeconds:
+                    raise
+                rate_limiter.pause(retryAfterSeconds)
+
+    def fetch(index):
+        response, page_selector = get(index)
+        return response.entries, page_selector
+
+    # The first page says how many pages there are
+    response, page_selector = get(start_index)
+    yield response.entries, page_selector
+
+    indexes = list(range(start_index + number_results, int(response.totalNumEntries), number_results))
+    if number_pages:
+        indexes = indexes[:number_pages - 1]
+
+    pool = ThreadPool(concurrency)
+    try:
+        for page in pool.imap(fetch, indexes):
+            yield page
+    finally:
+        pool.terminate()
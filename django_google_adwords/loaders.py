@@ -0,0 +1,164 @@
+from io import BytesIO, StringIO
+
+from django.db import connections, models, transaction
+from django.utils import six, timezone
+
+if six.PY2:
+    from django_toolkit.csv.unicode import UnicodeWriter as csv_writer
+else:
+    from csv import writer as csv_writer
+
+
+NULL = u'\\N'
+
+
+class PostgresCopyLoader(object):
+    """
+    Write rows to a Daily*Metrics table with PostgreSQL's COPY FROM STDIN.
+
+    Rows are copied into a temporary staging table which is then merged into the table in a
+    single transaction - rows matching an existing natural key are updated and the remainder
+    are inserted. When the natural key is unique the merge is one INSERT ... ON CONFLICT.
+    Existing rows with the same fingerprint as the copied row are left untouched.
+    """
+    _defaults = {}
+
+    def __init__(self, model_cls, using='default'):
+        self.model_cls = model_cls
+        self.using = using
+        self.connection = connections[using]
+        self.fields = [field for field in model_cls._meta.concrete_fields if not field.primary_key]
+
+    def defaults(self):
+        """
+        The value of each field for rows that don't supply one, evaluated once per model.
+        """
+        if self.model_cls not in self._defaults:
+            self._defaults[self.model_cls] = dict((field.attname, field.get_default() if field.has_default() else None)
+                                                  for field in self.fields)
+        return self._defaults[self.model_cls]
+
+    def rows(self, items, plan_for):
+        """
+        Yield each item as a list of text values in the order of self.fields.
+
+        :param items: An iterable of (data, kwargs) tuples as accepted by _bulk_populate.
+        :param plan_for: A callable returning the RowPlan for data.
+        """
+        meta = self.model_cls._meta
+        defaults = self.defaults()
+        now = timezone.now()
+
+        for data, kwargs in items:
+            values = dict(defaults)
+            for name, value in kwargs.items():
+                field = meta.get_field(name)
+                if isinstance(value, models.Model):
+                    value = value.pk
+                values[field.attname] = field.to_python(value)
+            values.update(plan_for(data).values(data))
+
+            row = []
+            for field in self.fields:
+                if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                    value = now
+                else:
+                    value = values[field.attname]
+                value = field.get_db_prep_save(value, connection=self.connection)
+                row.append(NULL if value is None else six.text_type(value))
+            yield row
+
+    def upsert(self, key_columns):
+        """
+        Whether the merge can be a single INSERT ... ON CONFLICT DO UPDATE, which requires
+        PostgreSQL 9.5 and a unique constraint on the natural key.
+        """
+        meta = self.model_cls._meta
+        unique_columns = [set(meta.get_field(name).column for name in fields) for fields in meta.unique_together]
+        return self.connection.pg_version >= 90500 and set(key_columns) in unique_columns
+
+    def load(self, items, plan_for):
+        """
+        Copy and merge items into the table.
+
+        :return: tuple of the number of rows (created, updated, skipped)
+        """
+        items = list(items)
+        if not items:
+            return 0, 0, 0
+
+        meta = self.model_cls._meta
+        qn = self.connection.ops.quote_name
+        table = qn(meta.db_table)
+        # Schema qualified so a table of the same name in the search_path is never dropped
+        staging = 'pg_temp.%s' % qn('%s_staging' % meta.db_table)
+        columns = [field.column for field in self.fields]
+        key_columns = [meta.get_field(name).column for name in sorted(items[0][1])]
+        # Only the fields populated from the report are updated (as with the ORM)
+        plan = plan_for(items[0][0])
+        populated = set(plan.values(items[0][0]))
+        update_columns = [field.column for field in self.fields
+                          if field.column not in key_columns and (field.name in populated or getattr(field, 'auto_now', False))]
+        column_list = ', '.join(qn(column) for column in columns)
+        match = ' AND '.join('t.%s = s.%s' % (qn(column), qn(column)) for column in key_columns)
+        # Rows whose fingerprint hasn't changed are not updated
+        changed = upsert_changed = ''
+        if plan.fingerprinted:
+            fingerprint = qn(meta.get_field(plan.fingerprint_field).column)
+            changed = ' AND t.%s IS DISTINCT FROM s.%s' % (fingerprint, fingerprint)
+            upsert_changed = ' WHERE t.%s IS DISTINCT FROM EXCLUDED.%s' % (fingerprint, fingerprint)
+
+        buf = BytesIO() if six.PY2 else StringIO()
+        writer = csv_writer(buf)
+        for row in self.rows(items, plan_for):
+            writer.writerow(row)
+        buf.seek(0)
+
+        with transaction.atomic(using=self.using):
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute('DROP TABLE IF EXISTS %s' % staging)
+                cursor.execute('CREATE TEMPORARY TABLE %s ON COMMIT DROP AS SELECT %s FROM %s WITH NO DATA' % (staging, column_list, table))
+                cursor.execute('ALTER TABLE %s ADD COLUMN dga_row serial' % staging)
+                cursor.copy_expert("COPY %s (%s) FROM STDIN WITH CSV NULL '%s'" % (staging, column_list, NULL), buf)
+
+                # Only the last row copied for each natural key is merged
+                cursor.execute('DELETE FROM %s t USING %s s WHERE %s AND t.dga_row < s.dga_row' % (staging, staging, match))
+                cursor.execute('SELECT COUNT(*) FROM %s' % staging)
+                staged = cursor.fetchone()[0]
+
+                if self.upsert(key_columns):
+                    cursor.execute('WITH merged AS ('
+                                   'INSERT INTO %s AS t (%s) SELECT %s FROM %s s ON CONFLICT (%s) DO UPDATE SET %s%s '
+                                   'RETURNING (xmax = 0) AS created) '
+                                   'SELECT COALESCE(SUM(CASE WHEN created THEN 1 ELSE 0 END), 0), '
+                                   'COALESCE(SUM(CASE WHEN created THEN 0 ELSE 1 END), 0) FROM merged' % (
+                                       table,
+                                       column_list,
+                                       ', '.join('s.%s' % qn(column) for column in columns),
+                                       staging,
+                                       ', '.join(qn(column) for column in key_columns),
+                                       ', '.join('%s = EXCLUDED.%s' % (qn(column), qn(column)) for column in update_columns),
+                                       upsert_changed))
+                    created, updated = [int(count) for count in cursor.fetchone()]
+                else:
+                    cursor.execute('UPDATE %s t SET %s FROM %s s WHERE %s%s' % (
+                        table,
+                        ', '.join('%s = s.%s' % (qn(column), qn(column)) for column in update_columns),
+                        staging,
+                        match,
+                        changed))
+                    updated = cursor.rowcount
+
+                    cursor.execute('INSERT INTO %s (%s) SELECT %s FROM %s s WHERE NOT EXISTS (SELECT 1 FROM %s t WHERE %s)' % (
+                        table,
+                        column_list,
+                        ', '.join('s.%s' % qn(column) for column in columns),
+                        staging,
+                        table,
+                        match))
+                    created = cursor.rowcount
+            finally:
+                cursor.close()
+
+        return created, updated, staged - created - updated
@@ -1,6 +1,21 @@
+from contextlib import contextmanager
+from uuid import uuid4
+import hashlib
+import logging
+import struct
+import threading
+import time
+
 from django.core.cache import cache
 from django.conf import settings
+from django.db import connections
 from django.template.defaultfilters import slugify
+from django.utils.module_loading import import_string
+
+from .errors import LeaseBusyError, LeaseLostError
+
+
+locking_logger = logging.getLogger('django_google_adwords.models.locker')
 
 
 def get_googleadwords_lock_id(model, identifier):
@@ -17,3 +32,317 @@ def release_googleadwords_lock(model, idenitier):
     # memcache delete is very slow, but we have to use it to take
     # advantage of using add() for atomic locking
     return cache.delete(get_googleadwords_lock_id(model, idenitier))
+
+
+class BaseLockBackend(object):
+    """
+    Interface for the backends that hold row locks and import leases.
+
+    acquire returns a token identifying the holder (or None if the lock wasn't acquired
+    without blocking) which must be passed to renew and release.
+    """
+
+    def acquire(self, key, timeout, blocking=True):
+        raise NotImplementedError()
+
+    def renew(self, key, token, timeout):
+        raise NotImplementedError()
+
+    def release(self, key, token):
+        raise NotImplementedError()
+
+
+class CacheLockBackend(BaseLockBackend):
+    """
+    Locks using cache.add, waiters poll every GOOGLEADWORDS_LOCK_WAIT seconds.
+
+    Django's cache API has no compare-and-set so renew and release check the token and then
+    set or delete the key in two steps. If the lock expires between the two (and is acquired by
+    another holder) that holder's lock is extended or deleted, so timeouts should leave plenty
+    of slack. Use the RedisLockBackend where that isn't acceptable.
+    """
+
+    def acquire(self, key, timeout, blocking=True):
+        token = uuid4().hex
+        # cache.add fails if if the key already exists
+        while not cache.add(key, token, timeout):
+            if not blocking:
+                return None
+            time.sleep(settings.GOOGLEADWORDS_LOCK_WAIT)
+        return token
+
+    def renew(self, key, token, timeout):
+        if cache.get(key) != token:
+            return False
+        cache.set(key, token, timeout)
+        return True
+
+    def release(self, key, token):
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+class RedisLockBackend(BaseLockBackend):
+    """
+    Locks in Redis (GOOGLEADWORDS_LOCK_REDIS_URL), requires the redis package.
+
+    Waiters count themselves and block on a wakeup list with BLPOP, releasing a lock pushes
+    one wakeup per waiter so they all retry as soon as the lock is released rather than after
+    sleeping (one of them acquires it, the rest wait again).
+    """
+    RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            redis.call('del', KEYS[1])
+            local waiters = tonumber(redis.call('get', KEYS[3]) or '0')
+            for i = 1, math.max(waiters, 1) do
+                redis.call('lpush', KEYS[2], 1)
+            end
+            redis.call('pexpire', KEYS[2], ARGV[2])
+            return 1
+        end
+        return 0
+    """
+    RENEW_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('pexpire', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+
+    def __init__(self):
+        import redis
+        self.client = redis.StrictRedis.from_url(settings.GOOGLEADWORDS_LOCK_REDIS_URL)
+        self.release_script = self.client.register_script(self.RELEASE_SCRIPT)
+        self.renew_script = self.client.register_script(self.RENEW_SCRIPT)
+
+    def wakeup_key(self, key):
+        return '%s-wakeup' % key
+
+    def waiters_key(self, key):
+        return '%s-waiters' % key
+
+    def acquire(self, key, timeout, blocking=True):
+        token = uuid4().hex
+        wait = max(1, int(settings.GOOGLEADWORDS_LOCK_WAIT))
+        while not self.client.set(key, token, nx=True, px=int(timeout * 1000)):
+            if not blocking:
+                return None
+            # The count expires incase a waiter dies without decrementing it
+            self.client.pipeline().incr(self.waiters_key(key)).expire(self.waiters_key(key), wait * 2).execute()
+            try:
+                # Wait for the holder to hand off the lock, recheck at least every LOCK_WAIT incase it expired
+                self.client.blpop([self.wakeup_key(key)], timeout=wait)
+            finally:
+                self.client.decr(self.waiters_key(key))
+        return token
+
+    def renew(self, key, token, timeout):
+        return bool(self.renew_script(keys=[key], args=[token, int(timeout * 1000)]))
+
+    def release(self, key, token):
+        self.release_script(keys=[key, self.wakeup_key(key), self.waiters_key(key)],
+                            args=[token, max(1000, int(settings.GOOGLEADWORDS_LOCK_WAIT * 1000))])
+
+
+class PostgresAdvisoryLockBackend(BaseLockBackend):
+    """
+    Locks using PostgreSQL session level advisory locks on GOOGLEADWORDS_LOCK_DATABASE.
+
+    Waiters block inside PostgreSQL and are granted the lock as soon as it's released. Locks
+    don't expire so the timeout is ignored, they're held until released or the database session
+    ends (ie.. the connection is closed or the worker dies), renew reports whether the session
+    still holds the lock.
+    """
+
+    def __init__(self):
+        self.using = settings.GOOGLEADWORDS_LOCK_DATABASE
+
+    def lock_id(self, key):
+        # Advisory locks are identified by a signed 64 bit integer
+        return struct.unpack('>q', hashlib.sha1(key.encode('utf-8')).digest()[:8])[0]
+
+    def acquire(self, key, timeout, blocking=True):
+        cursor = connections[self.using].cursor()
+        try:
+            if blocking:
+                cursor.execute('SELECT pg_advisory_lock(%s)', [self.lock_id(key)])
+                return key
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [self.lock_id(key)])
+            return key if cursor.fetchone()[0] else None
+        finally:
+            cursor.close()
+
+    def renew(self, key, token, timeout):
+        lock_id = self.lock_id(key)
+        cursor = connections[self.using].cursor()
+        try:
+            # A bigint key is stored as its high and low 32 bits
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND granted "
+                           "AND pid = pg_backend_pid() AND classid::bigint = %s AND objid::bigint = %s AND objsubid = 1)",
+                           [(lock_id >> 32) & 0xffffffff, lock_id & 0xffffffff])
+            return cursor.fetchone()[0]
+        finally:
+            cursor.close()
+
+    def release(self, key, token):
+        cursor = connections[self.using].cursor()
+        try:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [self.lock_id(key)])
+        finally:
+            cursor.close()
+
+
+class LocalLockBackend(BaseLockBackend):
+    """
+    In process locks, intended for tests - waiters are woken as soon as a lock is released.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.locks = {}
+
+    def held(self, key):
+        lock = self.locks.get(key)
+        return lock is not None and lock[1] > time.time()
+
+    def acquire(self, key, timeout, blocking=True):
+        with self.condition:
+            while self.held(key):
+                if not blocking:
+                    return None
+                self.condition.wait(settings.GOOGLEADWORDS_LOCK_WAIT)
+            token = uuid4().hex
+            self.locks[key] = (token, time.time() + timeout)
+            return token
+
+    def renew(self, key, token, timeout):
+        with self.condition:
+            if not self.held(key) or self.locks[key][0] != token:
+                return False
+            self.locks[key] = (token, time.time() + timeout)
+            return True
+
+    def release(self, key, token):
+        with self.condition:
+            if self.locks.get(key, (None,))[0] == token:
+                del self.locks[key]
+                self.condition.notify_all()
+
+
+_lock_backends = {}
+
+
+def get_lock_backend():
+    """
+    Return the (shared) instance of GOOGLEADWORDS_LOCK_BACKEND.
+    """
+    path = settings.GOOGLEADWORDS_LOCK_BACKEND
+    if path not in _lock_backends:
+        _lock_backends[path] = import_string(path)()
+    return _lock_backends[path]
+
+
+@contextmanager
+def googleadwords_lock(model, identifier):
+    """
+    Hold the lock for model and identifier, a no-op unless GOOGLEADWORDS_ROW_LOCKS is enabled.
+    """
+    if not settings.GOOGLEADWORDS_ROW_LOCKS:
+        yield
+        return
+
+    backend = get_lock_backend()
+    lock_id = get_googleadwords_lock_id(model, identifier)
+    locking_logger.debug("Acquiring lock: %s", lock_id)
+    token = backend.acquire(lock_id, settings.GOOGLEADWORDS_LOCK_TIMEOUT)
+
+    try:
+        locking_logger.debug("Acquired lock: %s", lock_id)
+        yield
+    finally:
+        locking_logger.debug("Releasing lock: %s", lock_id)
+        backend.release(lock_id, token)
+
+
+class ImportLease(object):
+    """
+    A coarse grained lock held for the duration of an import.
+
+    The lease expires after GOOGLEADWORDS_IMPORT_LEASE_TIMEOUT seconds unless it's renewed,
+    so long running imports should call renew() periodically (ie.. after each batch).
+
+    Used as a context manager the lease is acquired without blocking, a LeaseBusyError is raised
+    if it's held by another import so the task can retry rather than tie up a worker waiting.
+    """
+
+    def __init__(self, name, timeout=None):
+        self.key = '%s-lease-%s' % (settings.GOOGLEADWORDS_LOCK_ID, slugify(name))
+        self.timeout = timeout or settings.GOOGLEADWORDS_IMPORT_LEASE_TIMEOUT
+        self.backend = get_lock_backend()
+        self.token = None
+        self.renewed = None
+
+    def acquire(self, blocking=True):
+        self.token = self.backend.acquire(self.key, self.timeout, blocking)
+        if self.token is None:
+            return False
+        self.renewed = time.time()
+        locking_logger.debug("Acquired lease: %s", self.key)
+        return True
+
+    def renew(self, force=False):
+        """
+        Extend the lease, this only hits the backend once half of the timeout has elapsed unless forced.
+        """
+        if not force and time.time() - self.renewed < self.timeout / 2.0:
+            return
+        if not self.backend.renew(self.key, self.token, self.timeout):
+            raise LeaseLostError(self.key)
+        self.renewed = time.time()
+        locking_logger.debug("Renewed lease: %s", self.key)
+
+    def release(self):
+        self.backend.release(self.key, self.token)
+        locking_logger.debug("Released lease: %s", self.key)
+
+    def busy(self):
+        return LeaseBusyError(self.key, settings.GOOGLEADWORDS_IMPORT_LEASE_RETRY)
+
+    def __enter__(self):
+        if not self.acquire(blocking=False):
+            raise self.busy()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class ImportLeases(object):
+    """
+    ImportLeases acquired, renewed and released together.
+
+    Used as a context manager either every lease is acquired or a LeaseBusyError is raised (and
+    none are held), so an import that writes several models finds out before it starts.
+    """
+
+    def __init__(self, *leases):
+        self.leases = leases
+
+    def renew(self, force=False):
+        for lease in self.leases:
+            lease.renew(force=force)
+
+    def release(self):
+        for lease in self.leases:
+            lease.release()
+
+    def __enter__(self):
+        for index, lease in enumerate(self.leases):
+            if not lease.acquire(blocking=False):
+                for acquired in self.leases[:index]:
+                    acquired.release()
+                raise lease.busy()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,24 @@
+from __future__ import print_function
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ...helper import delete_duplicates
+from ...models import DailyAccountMetrics, DailyCampaignMetrics, DailyAdGroupMetrics, DailyAdMetrics
+
+
+class Command(BaseCommand):
+    help = "Delete duplicate Daily*Metrics rows keeping the most recent row for each account/campaign/ad group/ad and day."
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run',
+                    action='store_true',
+                    dest='dry_run',
+                    default=False,
+                    help='Only report the number of duplicate rows.'),
+    )
+
+    def handle(self, *args, **options):
+        for model in (DailyAccountMetrics, DailyCampaignMetrics, DailyAdGroupMetrics, DailyAdMetrics):
+            fields = model._meta.unique_together[0]
+            deleted = delete_duplicates(model.objects.all(), fields, dry_run=options['dry_run'])
+            print('%s: %s %d duplicate rows' % (model.__name__, 'found' if options['dry_run'] else 'deleted', deleted))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count, Max
+
+
+METRICS_NATURAL_KEYS = (
+    ('DailyAccountMetrics', ('account', 'device', 'day')),
+    ('DailyCampaignMetrics', ('campaign', 'day')),
+    ('DailyAdGroupMetrics', ('ad_group', 'day')),
+    ('DailyAdMetrics', ('ad', 'day')),
+)
+
+
+def delete_duplicate_metrics(apps, schema_editor):
+    """
+    Delete all but the most recently created row (highest id) for each natural key.
+
+    This is a frozen copy of helper.delete_duplicates, migrations mustn't depend on code that
+    may change.
+    """
+    for model_name, fields in METRICS_NATURAL_KEYS:
+        model_cls = apps.get_model('django_google_adwords', model_name)
+        duplicates = model_cls.objects.values(*fields) \
+            .annotate(dga_count=Count('id'), dga_max_id=Max('id')) \
+            .filter(dga_count__gt=1)
+        for duplicate in list(duplicates):
+            del duplicate['dga_count']
+            keep = duplicate.pop('dga_max_id')
+            model_cls.objects.filter(**duplicate).exclude(id=keep).delete()
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_google_adwords', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_metrics, noop),
+        migrations.AlterUniqueTogether(
+            name='dailyaccountmetrics',
+            unique_together=set([('account', 'device', 'day')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='dailyaccountmetrics',
+            index_together=set([('account', 'day')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailycampaignmetrics',
+            unique_together=set([('campaign', 'day')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyadgroupmetrics',
+            unique_together=set([('ad_group', 'day')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailyadmetrics',
+            unique_together=set([('ad', 'day')]),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_google_adwords', '0002_metrics_natural_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailyaccountmetrics',
+            name='fingerprint',
+            field=models.CharField(help_text='Hash of the report values this row was populated from', max_length=32, null=True, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='dailycampaignmetrics',
+            name='fingerprint',
+            field=models.CharField(help_text='Hash of the report values this row was populated from', max_length=32, null=True, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='dailyadgroupmetrics',
+            name='fingerprint',
+            field=models.CharField(help_text='Hash of the report values this row was populated from', max_length=32, null=True, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='dailyadmetrics',
+            name='fingerprint',
+            field=models.CharField(help_text='Hash of the report values this row was populated from', max_length=32, null=True, editable=False, blank=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_google_adwords', '0003_metrics_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportfile',
+            name='definition_hash',
+            field=models.CharField(help_text='Hash of the client customer id and report definition downloaded', max_length=40, null=True, editable=False, blank=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_google_adwords', '0004_reportfile_definition_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='sync_token',
+            field=models.CharField(max_length=32, null=True, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='sync_started',
+            field=models.DateTimeField(null=True, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='sync_levels',
+            field=models.CharField(default='', help_text='Levels being synced', max_length=255, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='sync_task_id',
+            field=models.CharField(default='', max_length=255, editable=False, blank=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_google_adwords', '0005_account_sync_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='account_report_rows',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='campaign_report_rows',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='ad_group_report_rows',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='ad_report_rows',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import F
+
+
+def renew_sync_claims(apps, schema_editor):
+    """
+    Until now renewing a claim moved sync_started, so it's when the claims in flight were last renewed.
+    """
+    Account = apps.get_model('django_google_adwords', 'Account')
+    Account.objects.filter(sync_token__isnull=False).update(sync_renewed=F('sync_started'))
+
+
+def noop(apps, schema_editor):
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_google_adwords', '0006_account_report_rows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='sync_renewed',
+            field=models.DateTimeField(blank=True, null=True, editable=False),
+        ),
+        migrations.RunPython(renew_sync_claims, noop),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_google_adwords', '0007_account_sync_renewed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailycampaignmetrics',
+            name='derived_fingerprint',
+            field=models.CharField(help_text='Hash of the values rolled up from the ad report this row was populated from', max_length=32, null=True, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='dailyadgroupmetrics',
+            name='derived_fingerprint',
+            field=models.CharField(help_text='Hash of the values rolled up from the ad report this row was populated from', max_length=32, null=True, editable=False, blank=True),
+        ),
+    ]
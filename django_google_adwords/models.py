@@ -1,41 +1,58 @@
+from collections import OrderedDict
 from contextlib import contextmanager
 from datetime import date, timedelta
 from decimal import Decimal
+from functools import reduce
+from uuid import uuid4
 import errno
+import glob
 import gzip
+import hashlib
+import io
+import json
 import logging
+import operator
 import os
 import re
-import time
 
-from celery.canvas import group
+from celery.app import shared_task
+from celery.result import AsyncResult
+from celery.canvas import chord, group
 from celery.contrib.methods import task
+from celery.exceptions import Retry
 from django.conf import settings
 from django.core.exceptions import ValidationError as DjangoValidationError
 from django.core.files.base import File
-from django.db import models
-from django.db.models import Max
+from django.db import connections, models, router, transaction
+from django.db.models import F, Max
 from django.db.models.aggregates import Sum, Min, Avg
 from django.db.models.fields import FieldDoesNotExist, DecimalField
 from django.db.models.query import QuerySet as _QuerySet
 from django.db.models.signals import post_delete
 from django.template.defaultfilters import truncatechars
+from django.utils import six, timezone
 from django_cereal.pickle import DJANGO_CEREAL_PICKLE
 from django_google_adwords.errors import *
-from django_google_adwords.helper import adwords_service
-from django_google_adwords.lock import release_googleadwords_lock
+from django_google_adwords.helper import adwords_service, chunked, date_windows, gunzip_lines, retry_after_seconds
+from django_google_adwords.loaders import PostgresCopyLoader
+from django_google_adwords.lock import get_lock_backend, googleadwords_lock, ImportLease, ImportLeases
+from django_google_adwords.ratelimit import api_rate_limiter
+from django_google_adwords.selectors import REPORT_FIELDS
 from django_toolkit.celery.decorators import ensure_self
-from django_toolkit.csv.unicode import UnicodeReader
 from django_toolkit.db.models import QuerySetManager
 from djmoney.models.fields import MoneyField
 from googleads.errors import GoogleAdsError
 
-from .lock import acquire_googleadwords_lock
 from .settings import GoogleAdwordsConf  # import AppConf settings
 
 
+if six.PY2:
+    from django_toolkit.csv.unicode import UnicodeReader as csv_reader, UnicodeWriter as csv_writer
+else:
+    from csv import reader as csv_reader, writer as csv_writer
+
+
 logger = logging.getLogger(__name__)
-locking_logger = logging.getLogger('%s.locker' % __name__)
 
 remove_non_letters = re.compile('[^a-z|0-9|_]')
 
@@ -44,72 +61,250 @@ def attribute_to_field_name(attribute):
     return remove_non_letters.sub(r'', attribute.lower().replace(' ', '_')).replace('__', '_')
 
 
-class PopulatingGoogleAdwordsQuerySet(_QuerySet):
-    IGNORE_FIELDS = ['created', 'updated']
-
-    def populate_model_from_dict(self, model, data, ignore_fields=[]):
-        update_fields = []
-        currency = None
+def report_fields(report_type, model_classes, required=[], exclude_columns=()):
+    """
+    Return the fields to request in a report of report_type which populates model_classes.
+
+    A field is requested if the column it's returned as populates a concrete field of one of
+    model_classes (and isn't one of exclude_columns) or it's required. The fields in
+    GOOGLEADWORDS_SELECTOR_INCLUDE[report_type] are added and those in
+    GOOGLEADWORDS_SELECTOR_EXCLUDE[report_type] (unless required) removed. Each field is requested once.
+    """
+    stored = set(field.name for model_cls in model_classes for field in model_cls._meta.concrete_fields)
+    include = settings.GOOGLEADWORDS_SELECTOR_INCLUDE.get(report_type, [])
+    exclude = set(settings.GOOGLEADWORDS_SELECTOR_EXCLUDE.get(report_type, [])) - set(required)
+
+    fields = []
+    for field, column in REPORT_FIELDS[report_type].items():
+        if field in required or (attribute_to_field_name(column) in stored and column not in exclude_columns):
+            fields.append(field)
+    for field in include:
+        if field not in fields:
+            fields.append(field)
+    return [field for field in fields if field not in exclude]
+
+
+class ReportRow(dict):
+    """
+    A row of a report keyed by column, fields holds the (shared) header of the report.
+    """
+    __slots__ = ('fields',)
+
+    def __init__(self, fields, row):
+        dict.__init__(self, zip(fields, row))
+        self.fields = fields
+
+
+class ReportRecord(tuple):
+    """
+    A row of a report as a tuple.
+
+    Use ReportRecord.for_header to create a class per report, all records of a report then
+    share the header (fields) and the column to position index.
+    """
+    __slots__ = ()
+    fields = ()
+    index = {}
+
+    @classmethod
+    def for_header(cls, fields):
+        fields = tuple(fields)
+        index = dict((column, position) for position, column in enumerate(fields))
+        return type(cls.__name__, (cls,), {'__slots__': (), 'fields': fields, 'index': index})
+
+    def get(self, column, default=None):
+        position = self.index.get(column)
+        if position is None:
+            return default
+        return self[position]
+
+
+class RowPlan(object):
+    """
+    The mapping of report columns onto model fields, compiled once per report header.
+
+    For each column the plan holds its position, the target field name, a converter specialised for the
+    field type and whether the field is a MoneyField, the currency column is also noted.
+
+    Plans are cached (see compile), the cache_size most recently used are kept.
+
+    The fingerprint of the populating data is kept in fingerprint_field, if the model has it. Rows
+    populated from more than one source (ie.. the columns of a campaign report and those rolled
+    up from the ad report) keep a fingerprint per source so one doesn't overwrite the other.
+    """
+    cache_size = 64
+    _cache = OrderedDict()
+
+    def __init__(self, model_cls, columns, ignore_fields=[], fingerprint_field='fingerprint'):
+        self.model_cls = model_cls
+        self.columns = []
+        self.currency_column = None
+        self.currency_position = None
+        if fingerprint_field not in [field.name for field in model_cls._meta.fields]:
+            fingerprint_field = None
+        self.fingerprint_field = fingerprint_field
+        self.fingerprinted = fingerprint_field is not None
+
+        for position, column in enumerate(columns):
+            field_name = attribute_to_field_name(column)
+            if field_name in ignore_fields:
+                continue
+            if field_name == 'currency':
+                self.currency_column = column
+                self.currency_position = position
+            try:
+                field = model_cls._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                # Skip fields that dont exist in the model
+                continue
+            self.columns.append((column, position, field_name, self.converter(field), isinstance(field, MoneyField)))
 
-        def to_field_name(key):
-            return attribute_to_field_name(key)
+    @classmethod
+    def compile(cls, model_cls, columns, ignore_fields=[], fingerprint_field='fingerprint'):
+        """
+        Return the (cached) plan for model_cls and the report header columns.
+        """
+        key = (model_cls, tuple(columns), tuple(ignore_fields), fingerprint_field)
+        # Reinserted so the least recently used plans are first
+        plan = cls._cache.pop(key, None)
+        if plan is None:
+            plan = cls(model_cls, columns, ignore_fields, fingerprint_field)
+        cls._cache[key] = plan
+        while len(cls._cache) > cls.cache_size:
+            try:
+                cls._cache.popitem(last=False)
+            except KeyError:
+                break  # Emptied by another thread
+        return plan
 
-        def clean(value, field):
-            # If the adwords api returns "--" regardless of the field we want to return None
-            if value == ' --':
-                return None
+    @staticmethod
+    def converter(field):
+        """
+        Return a function that converts an Adwords API value into a python value for field.
+        """
+        field_name = field.name
+        to_python = field.to_python
 
-            # If money divide by 1,000,000 to get dollars/cents
-            elif isinstance(field, MoneyField):
+        # If money divide by 1,000,000 to get dollars/cents
+        if isinstance(field, MoneyField):
+            def clean(value):
                 if int(value) > 0:
                     return Decimal(value) / 1000000
                 return Decimal(value)
 
-            # The adwords api returns "1.87%" or "< 10%" for percentage fields we need to remove the % < > signs
-            elif isinstance(field, DecimalField):
-                mapping = [('%', ''), ('<', ''), ('>', ''), (',', ''), (' ', '')]
-                for k, v in mapping:
-                    value = value.replace(k, v)
-                return value
+        # The adwords api returns "1.87%" or "< 10%" for percentage fields we need to remove the % < > signs
+        elif isinstance(field, DecimalField):
+            def clean(value):
+                return value.replace('%', '').replace('<', '').replace('>', '').replace(',', '').replace(' ', '')
 
-            # The api returns data in a way we can handle
-            else:
-                return value
-
-        for key, _value in data.items():
-            field_name = to_field_name(key)
-            if field_name in self.IGNORE_FIELDS or field_name in ignore_fields:
-                continue
-            if field_name == 'currency':
-                currency = _value
-            try:
-                field = model._meta.get_field(field_name)
-            except FieldDoesNotExist:
-                # Skip fields that dont exist in the model
-                continue
+        # The api returns data in a way we can handle
+        else:
+            clean = None
 
-            value = clean(_value, field)
+        def convert(value):
+            # If the adwords api returns "--" regardless of the field we want to return None
+            if value == ' --':
+                value = None
+            elif clean is not None:
+                value = clean(value)
             try:
-                value = field.to_python(value)
+                return to_python(value)
             except DjangoValidationError as e:
                 raise ValidationError(field_name, e.messages)
 
+        return convert
+
+    def fingerprint(self, data):
+        """
+        Return a hash of the raw values in data that the plan populates (including the currency).
+        """
+        if isinstance(data, ReportRecord):
+            values = [data[position] for column, position, field_name, convert, is_money in self.columns]
+            if self.currency_position is not None:
+                values.append(data[self.currency_position])
+        else:
+            values = [data[column] for column, position, field_name, convert, is_money in self.columns]
+            if self.currency_column is not None:
+                values.append(data[self.currency_column])
+        return hashlib.md5(u'\x1f'.join(six.text_type(value) for value in values).encode('utf-8')).hexdigest()
+
+    def values(self, data):
+        """
+        Return a dict of the converted values in data keyed by field name.
+
+        The currency of each MoneyField in the plan and the fingerprint of data are included.
+        """
+        by_position = isinstance(data, ReportRecord)
+        values = {}
+        money_fields = []
+
+        for column, position, field_name, convert, is_money in self.columns:
+            values[field_name] = convert(data[position] if by_position else data[column])
+            if is_money:
+                money_fields.append(field_name)
+
+        if money_fields:
+            if self.currency_column is None:
+                raise NoAccountCurrencyCodeError("AccountCurrencyCode must be included in %s.get_selector" % self.model_cls)
+            currency = data[self.currency_position if by_position else self.currency_column]
+            for field_name in money_fields:
+                values['%s_currency' % field_name] = currency
+
+        if self.fingerprinted:
+            values[self.fingerprint_field] = self.fingerprint(data)
+
+        return values
+
+    def populate(self, model, data):
+        """
+        Populate model with data returning the names of the fields that changed.
+
+        :param data: A ReportRecord or a dict keyed by column.
+        """
+        update_fields = []
+        money_fields = []
+        by_position = isinstance(data, ReportRecord)
+
+        for column, position, field_name, convert, is_money in self.columns:
+            value = convert(data[position] if by_position else data[column])
             if value != getattr(model, field_name):
                 update_fields.append(field_name)
                 setattr(model, field_name, value)
+                if is_money:
+                    money_fields.append(field_name)
 
         # Now set all currency fields, do this outside the loop above incase someone redefines the field order
-        for field_name in update_fields:
-            field = model._meta.get_field(field_name)
-            if isinstance(field, MoneyField):
-                if currency is None:
-                    raise NoAccountCurrencyCodeError("AccountCurrencyCode must be included in %s.get_selector" % model.__class__)
+        if money_fields:
+            if self.currency_column is None:
+                raise NoAccountCurrencyCodeError("AccountCurrencyCode must be included in %s.get_selector" % self.model_cls)
+            currency = data[self.currency_position if by_position else self.currency_column]
+            for field_name in money_fields:
                 currency_field_name = '%s_currency' % field_name
                 update_fields.append(currency_field_name)
                 setattr(model, currency_field_name, currency)
 
+        if self.fingerprinted:
+            fingerprint = self.fingerprint(data)
+            if fingerprint != getattr(model, self.fingerprint_field):
+                update_fields.append(self.fingerprint_field)
+                setattr(model, self.fingerprint_field, fingerprint)
+
         return update_fields
 
+
+class PopulatingGoogleAdwordsQuerySet(_QuerySet):
+    IGNORE_FIELDS = ['created', 'updated']
+
+    def row_plan(self, data, ignore_fields=[], fingerprint_field='fingerprint'):
+        """
+        Return the RowPlan for populating this queryset's model with data.
+        """
+        columns = data.fields if isinstance(data, (ReportRow, ReportRecord)) else list(data)
+        return RowPlan.compile(self.model, columns, list(self.IGNORE_FIELDS) + list(ignore_fields), fingerprint_field)
+
+    def populate_model_from_dict(self, model, data, ignore_fields=[], fingerprint_field='fingerprint'):
+        return self.row_plan(data, ignore_fields, fingerprint_field).populate(model, data)
+
     def _populate(self, data, ignore_fields=[], **kwargs):
         """
         Low level get or create model which then populates the model with data.
@@ -131,6 +326,167 @@ class PopulatingGoogleAdwordsQuerySet(_QuerySet):
             model.save(update_fields=update_fields)
         return model
 
+    def _natural_key(self, kwargs):
+        """
+        Normalise the keyword args that identify a model instance into a hashable key.
+
+        Related model instances are reduced to their primary key and values are passed through
+        the field's to_python so that, for example, a '2014-07-28' string and a date match.
+        """
+        key = []
+        for name in sorted(kwargs):
+            value = kwargs[name]
+            if isinstance(value, models.Model):
+                value = value.pk
+            key.append(self.model._meta.get_field(name).to_python(value))
+        return tuple(key)
+
+    def _natural_key_lookups(self, names, keys):
+        """
+        Return Q objects that together match the rows identified by keys, and no others.
+
+        The field of names with the most distinct values is looked up with __in for each
+        combination of the values of the other fields, rather than every field with __in which
+        would match the cross product of the keys.
+
+        :param keys: dicts of the keyword args identifying model instances, keyed by names
+        """
+        # Normalised, names are sorted as _natural_key sorts them
+        keys = [dict(zip(names, self._natural_key(key))) for key in keys]
+        in_name = max(names, key=lambda name: len(set(key[name] for key in keys)))
+        others = [name for name in names if name != in_name]
+        values = OrderedDict()
+        for key in keys:
+            values.setdefault(tuple(key[name] for name in others), set()).add(key[in_name])
+        return [models.Q(**dict(zip(others, other_values), **{'%s__in' % in_name: list(in_values)}))
+                for other_values, in_values in values.items()]
+
+    def _bulk_populate(self, items, ignore_fields=[], fingerprint_field='fingerprint'):
+        """
+        Batched equivalent of _populate.
+
+        All existing rows for the natural keys in items are loaded up front (with one query unless
+        the keys need more than 100 lookups, see _natural_key_lookups), new rows are written with
+        bulk_create and changed rows are updated within a single transaction.
+
+        For models with a fingerprint field the stored fingerprints are compared first, rows
+        whose report values haven't changed are skipped without being loaded or written.
+
+        :param items: An iterable of (data, kwargs) tuples where data is a dict of data as
+                      retrieved from the Google Adwords API and kwargs identify the model instance.
+        :param ignore_fields: Fields that are not populated from data.
+        :param fingerprint_field: The field the fingerprint of data is kept in (see RowPlan).
+        :return: tuple of the number of rows (created, updated, skipped)
+        """
+        items = list(items)
+        if not items:
+            return 0, 0, 0
+
+        using = router.db_for_write(self.model)
+        if settings.GOOGLEADWORDS_IMPORT_BACKEND == 'copy' and connections[using].vendor == 'postgresql':
+            return PostgresCopyLoader(self.model, using).load(items, lambda data: self.row_plan(data, ignore_fields, fingerprint_field))
+
+        model_cls = self.model
+        names = sorted(items[0][1])
+        plan = self.row_plan(items[0][0], ignore_fields, fingerprint_field)
+
+        # OR-ed in chunks, SQLite limits the depth of an expression to 1000
+        querysets = [model_cls.objects.filter(reduce(operator.or_, lookups))
+                     for lookups in chunked(self._natural_key_lookups(names, [kwargs for _, kwargs in items]), 100)]
+
+        skipped = 0
+        if plan.fingerprinted:
+            attnames = [model_cls._meta.get_field(name).attname for name in names]
+            stored = {}
+            for queryset in querysets:
+                for values in queryset.values_list('pk', plan.fingerprint_field, *attnames):
+                    stored[self._natural_key(dict(zip(names, values[2:])))] = values[:2]
+
+            changed = []
+            pending = set()
+            for data, kwargs in items:
+                key = self._natural_key(kwargs)
+                pk, fingerprint = stored.get(key, (None, None))
+                # A row is only skipped if an earlier row in the batch hasn't changed it
+                if pk is not None and key not in pending and fingerprint == plan.fingerprint(data):
+                    skipped += 1
+                    continue
+                pending.add(key)
+                changed.append((data, kwargs))
+
+            items = changed
+            querysets = [model_cls.objects.filter(pk__in=[stored[key][0] for key in pending if key in stored])]
+
+        existing = {}
+        for queryset in querysets:
+            for model in queryset:
+                kwargs = dict((name, getattr(model, model._meta.get_field(name).attname)) for name in names)
+                existing[self._natural_key(kwargs)] = model
+
+        to_create = []
+        to_update = OrderedDict()
+        for data, kwargs in items:
+            key = self._natural_key(kwargs)
+            model = existing.get(key)
+            if model is None:
+                # Store the new instance so a repeated key within the batch updates it in place
+                model = existing[key] = model_cls(**kwargs)
+                to_create.append(model)
+            update_fields = self.populate_model_from_dict(model, data, ignore_fields, fingerprint_field)
+            if model.pk is not None and update_fields:
+                to_update.setdefault(key, (model, set()))[1].update(update_fields)
+
+        if to_create or to_update:
+            with transaction.atomic(using=using):
+                model_cls.objects.bulk_create(to_create)
+                for model, update_fields in to_update.values():
+                    model.save(update_fields=update_fields)
+
+        return len(to_create), len(to_update), skipped
+
+
+def import_batches(model_cls, batches, lease, **kwargs):
+    """
+    Populate model_cls with each batch of (data, parent) rows, renewing lease after each batch.
+
+    Any kwargs are passed on to populate_many.
+
+    :return: tuple of the number of rows (created, updated, skipped)
+    """
+    created = updated = skipped = 0
+    for rows in batches:
+        batch_created, batch_updated, batch_skipped = model_cls.objects.populate_many(rows, **kwargs)
+        created += batch_created
+        updated += batch_updated
+        skipped += batch_skipped
+        lease.renew()
+    return created, updated, skipped
+
+
+def retry_throttled(task, exc):
+    """
+    Retry task after exc.retry_after_seconds when it's been throttled by the rate limiter or its
+    import lease is held by another import.
+
+    Unlike task.retry this doesn't count towards the task's max_retries, waiting on the rate
+    limiter or another import isn't a failure so the task is sent again with the number of
+    retries it has. Called directly (not by a worker) exc is raised.
+
+    :param exc: ThrottledError or LeaseBusyError
+    :return: Retry to raise.
+    """
+    request = task.request
+    if request.called_directly:
+        raise exc
+    # The registered task, the arguments of a task method already include the instance
+    task = task.app.tasks[task.name]
+    signature = task.subtask_from_request(request, countdown=exc.retry_after_seconds, retries=request.retries)
+    if request.is_eager:
+        signature.apply().get()
+    else:
+        signature.apply_async()
+    return Retry(exc=exc, when=exc.retry_after_seconds)
+
 
 class Account(models.Model):
     STATUS_ACTIVE = 'active'
@@ -151,11 +507,26 @@ class Account(models.Model):
     campaign_last_synced = models.DateField(blank=True, null=True)
     ad_group_last_synced = models.DateField(blank=True, null=True)
     ad_last_synced = models.DateField(blank=True, null=True)
+    # The rows imported by the last sync of each level (ie.. the size of its reports), the
+    # scheduler weighs accounts by these
+    account_report_rows = models.PositiveIntegerField(default=0, editable=False)
+    campaign_report_rows = models.PositiveIntegerField(default=0, editable=False)
+    ad_group_report_rows = models.PositiveIntegerField(default=0, editable=False)
+    ad_report_rows = models.PositiveIntegerField(default=0, editable=False)
+    # The claim held by the sync in flight, see claim_sync
+    sync_token = models.CharField(max_length=32, blank=True, null=True, editable=False)
+    sync_started = models.DateTimeField(blank=True, null=True, editable=False)
+    # When the claim was last renewed (ie.. levels joined it), it expires from here
+    sync_renewed = models.DateTimeField(blank=True, null=True, editable=False)
+    sync_levels = models.CharField(max_length=255, blank=True, default='', editable=False, help_text='Levels being synced')
+    sync_task_id = models.CharField(max_length=255, blank=True, default='', editable=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
 
     objects = QuerySetManager()
 
+    SYNC_LEVELS = ('account', 'campaign', 'ad_group', 'ad')
+
     def __unicode__(self):
         return '%s' % (self.account_id)
 
@@ -170,25 +541,28 @@ class Account(models.Model):
         def considered_active(self):
             return Account.objects.filter(status__in=Account.STATUS_CONSIDERED_ACTIVE)
 
+        def syncing(self):
+            """
+            Accounts with a sync in flight, those closest to their claim expiring first.
+            """
+            return self.filter(sync_token__isnull=False, sync_renewed__gte=Account.sync_claim_expiry()).order_by('sync_renewed')
+
+        def sync_expired(self):
+            """
+            Accounts whose sync claim expired before the sync finished (ie.. the sync failed).
+            """
+            return self.filter(sync_token__isnull=False, sync_renewed__lt=Account.sync_claim_expiry())
+
         def populate(self, data, account):
             """
             A locking get_or_create - note only the account_id is used in the 'get'.
             """
             # Get a lock based upon the campaign id
-            while not acquire_googleadwords_lock(Account, account.account_id):
-                locking_logger.debug("Waiting for acquire_googleadwords_lock: %s:%s", Account.__name__, account.account_id)
-                time.sleep(settings.GOOGLEADWORDS_LOCK_WAIT)
-
-            try:
-                locking_logger.debug("Success acquire_googleadwords_lock: %s:%s", Account.__name__, account.account_id)
+            with googleadwords_lock(Account, account.account_id):
                 return self._populate(data,
                                       ignore_fields=['status', 'account_id', 'account_last_synced'],
                                       account_id=account.account_id)
 
-            finally:
-                locking_logger.debug("Releasing acquire_googleadwords_lock: %s:%s", Account.__name__, account.account_id)
-                release_googleadwords_lock(Account, account.account_id)
-
     @task(name='Account.sync',
           queue=settings.GOOGLEADWORDS_HOUSEKEEPING_CELERY_QUEUE)
     def sync(self, start=None, force=False, sync_account=True, sync_campaign=False, sync_adgroup=False, sync_ad=False):
@@ -201,10 +575,42 @@ class Account(models.Model):
         - Campaign Performance Report
         - Ad Group Performance Report
         - Ad Performance Report
+
+        With GOOGLEADWORDS_DERIVE_METRICS the campaign and ad group metrics are rolled up from
+        the Ad Performance Report (when it's synced), their reports are only downloaded for the
+        columns that can't be derived (see MetricsRollup).
+
+        Only one sync runs for an account at a time (see claim_sync), a request to sync levels
+        that are already being synced is coalesced into that sync and its result returned.
         """
+        requested = [level for level, enabled in zip(self.SYNC_LEVELS, (sync_account, sync_campaign, sync_adgroup, sync_ad)) if enabled]
+        claim = self.claim_sync(requested)
+        if claim is None:
+            logger.info("Account '%s' is already syncing '%s' - coalescing the sync.", self.pk, self.sync_levels)
+            return AsyncResult(self.sync_task_id) if self.sync_task_id else None
+        token, levels = claim
+        try:
+            canvas = self.sync_canvas(token, levels, start=start, force=force)
+            result = canvas.apply_async()
+        except Exception:
+            # Don't leave the levels claimed by a sync that never started
+            self.release_sync(token, levels)
+            raise
+        # Duplicate syncs are coalesced into the first pipeline of the claim
+        Account.objects.filter(pk=self.pk, sync_token=token, sync_task_id='').update(sync_task_id=result.id)
+        return result
+
+    def sync_canvas(self, token, levels, start=None, force=False):
+        """
+        Return the canvas that syncs levels of this account and releases them from the claim
+        identified by token, see sync.
+        """
+        sync_account, sync_campaign, sync_adgroup, sync_ad = [level in levels for level in self.SYNC_LEVELS]
 
-        self.start_sync()
         tasks = []
+        derive = []
+        if settings.GOOGLEADWORDS_DERIVE_METRICS and sync_ad:
+            derive = [level for level, enabled in (('campaign', sync_campaign), ('ad_group', sync_adgroup)) if enabled]
 
         """
         Account
@@ -216,7 +622,7 @@ class Account(models.Model):
                 account_start = self.account_last_synced - timedelta(days=settings.GOOGLEADWORDS_EXISTING_ACCOUNT_SYNC_DAYS)
             elif force and start:
                 account_start = start
-            tasks.append(self.create_report_file.si(Account.get_selector(start=account_start)) | self.sync_account.s(this=self) | self.finish_account_sync.si(this=self))
+            tasks.append(self.report_imports(Account, account_start, 'sync_account', backfill=not self.account_last_synced) | self.task_signature('finish_account_sync', immutable=True))
 
         """
         Campaign
@@ -228,7 +634,9 @@ class Account(models.Model):
                 campaign_start = self.campaign_last_synced - timedelta(days=settings.GOOGLEADWORDS_EXISTING_CAMPAIGN_SYNC_DAYS)
             elif force and start:
                 campaign_start = start
-            tasks.append(self.create_report_file.si(Campaign.get_selector(start=campaign_start)) | self.sync_campaign.s(this=self) | self.finish_campaign_sync.si(this=self))
+            campaign_import = self.report_imports(Campaign, campaign_start, 'sync_campaign', backfill=not self.campaign_last_synced, derived='campaign' in derive)
+            if 'campaign' not in derive:
+                tasks.append(campaign_import | self.task_signature('finish_campaign_sync', immutable=True))
 
         """
         Ad Group
@@ -240,7 +648,9 @@ class Account(models.Model):
                 ad_group_start = self.ad_group_last_synced - timedelta(days=settings.GOOGLEADWORDS_EXISTING_ADGROUP_SYNC_DAYS)
             elif force and start:
                 ad_group_start = start
-            tasks.append(self.create_report_file.si(AdGroup.get_selector(start=ad_group_start)) | self.sync_ad_group.s(this=self) | self.finish_ad_group_sync.si(this=self))
+            ad_group_import = self.report_imports(AdGroup, ad_group_start, 'sync_ad_group', backfill=not self.ad_group_last_synced, derived='ad_group' in derive)
+            if 'ad_group' not in derive:
+                tasks.append(ad_group_import | self.task_signature('finish_ad_group_sync', immutable=True))
 
         """
         Ad
@@ -252,10 +662,189 @@ class Account(models.Model):
                 ad_start = self.ad_last_synced - timedelta(days=settings.GOOGLEADWORDS_EXISTING_AD_SYNC_DAYS)
             elif force and start:
                 ad_start = start
-            tasks.append(self.create_report_file.si(Ad.get_selector(start=ad_start)) | self.sync_ad.s(this=self) | self.finish_ad_sync.si(this=self))
+            # The ad data report also covers the period of the metrics derived from it
+            if 'campaign' in derive:
+                ad_start = min(ad_start, campaign_start)
+            if 'ad_group' in derive:
+                ad_start = min(ad_start, ad_group_start)
+            finish_ad_sync = self.task_signature('finish_ad_sync', immutable=True)
+            if settings.GOOGLEADWORDS_IMPORT_CHUNKS > 1:
+                chunks = settings.GOOGLEADWORDS_IMPORT_CHUNKS
+                import_chunks = chord([self.task_signature('import_ad_chunk', (index, chunks)) for index in range(chunks)], finish_ad_sync)
+                ad_import = self.task_signature('create_report_file', (Ad.get_selector(start=ad_start),), immutable=True) | \
+                            self.task_signature('prepare_ad_sync', kwargs={'derive': derive, 'chunks': chunks}) | \
+                            import_chunks
+            else:
+                ad_import = self.report_imports(Ad, ad_start, 'sync_ad', backfill=not self.ad_last_synced, derive=derive) | finish_ad_sync
+
+            if derive:
+                # The derived levels are synced once both their rollup and the columns that
+                # can't be derived have been imported
+                derived_imports = [ad_import]
+                finish_derived = []
+                if 'campaign' in derive:
+                    derived_imports.append(campaign_import)
+                    finish_derived.append(self.task_signature('finish_campaign_sync', immutable=True))
+                if 'ad_group' in derive:
+                    derived_imports.append(ad_group_import)
+                    finish_derived.append(self.task_signature('finish_ad_group_sync', immutable=True))
+                finish = finish_derived[0]
+                for signature in finish_derived[1:]:
+                    finish |= signature
+                ad_import = chord(derived_imports, finish)
+            tasks.append(ad_import)
+
+        return group(*tasks) | self.task_signature('finish_sync', kwargs={'token': token, 'levels': levels}, immutable=True)
+
+    @staticmethod
+    def sync_claim_expiry():
+        """
+        Syncs claimed (or last renewed) before this time have expired, see GOOGLEADWORDS_SYNC_CLAIM_TIMEOUT.
+        """
+        return timezone.now() - timedelta(seconds=settings.GOOGLEADWORDS_SYNC_CLAIM_TIMEOUT)
+
+    def claim_sync(self, levels):
+        """
+        Atomically claim the sync of levels of this account.
+
+        The claim is a compare-and-set of the status and sync token, so only one sync runs at a
+        time. Levels requested while a sync is in flight join its claim rather than starting a
+        new one (which renews the claim, restarting its timeout), and a claim that's not released within
+        GOOGLEADWORDS_SYNC_CLAIM_TIMEOUT seconds expires so a failed sync doesn't block the account.
+
+        The report rows of the claimed levels are reset, the sync's imports then record them
+        (see record_report_rows).
+
+        :param levels: The levels to sync, see SYNC_LEVELS.
+        :return: tuple (token, levels to sync) or None if levels are all being synced already.
+        """
+        accounts = Account.objects.filter(pk=self.pk)
+        while True:
+            now = timezone.now()
+            token = uuid4().hex
+            claimed = accounts.filter(models.Q(sync_token__isnull=True) | models.Q(sync_renewed__lt=self.sync_claim_expiry())) \
+                              .update(status=self.STATUS_SYNC, sync_token=token, sync_started=now, sync_renewed=now, sync_levels=','.join(levels),
+                                      sync_task_id='', **self.report_rows_reset(levels))
+            if claimed:
+                self.status, self.sync_token, self.sync_levels, self.sync_task_id = self.STATUS_SYNC, token, ','.join(levels), ''
+                self.sync_started = self.sync_renewed = now
+                return token, list(levels)
+
+            try:
+                self.sync_token, self.sync_started, self.sync_renewed, self.sync_levels, self.sync_task_id = \
+                    accounts.values_list('sync_token', 'sync_started', 'sync_renewed', 'sync_levels', 'sync_task_id').get()
+            except Account.DoesNotExist:
+                return None
+            if self.sync_token is None:
+                continue  # Released in the meantime
+            syncing = self.sync_levels.split(',') if self.sync_levels else []
+            missing = [level for level in levels if level not in syncing]
+            if not missing:
+                return None
+            sync_levels = ','.join(syncing + missing)
+            # The joined levels get the full timeout before the claim expires, the sync keeps its start
+            if accounts.filter(sync_token=self.sync_token, sync_levels=self.sync_levels).update(sync_levels=sync_levels, sync_renewed=now,
+                                                                                                 **self.report_rows_reset(missing)):
+                self.sync_levels, self.sync_renewed = sync_levels, now
+                return self.sync_token, missing
 
-        canvas = group(*tasks) | self.finish_sync.si(this=self)
-        return canvas.apply_async()
+    @staticmethod
+    def report_rows_reset(levels):
+        """
+        The update resetting the report rows of levels as their sync is claimed.
+        """
+        return dict(('%s_report_rows' % level, 0) for level in levels)
+
+    def record_report_rows(self, level, counts):
+        """
+        Add the rows imported from a report (or a window or chunk of it) to the report rows of level.
+
+        :param counts: tuple of the number of rows (created, updated, skipped)
+        """
+        field = '%s_report_rows' % level
+        Account.objects.filter(pk=self.pk).update(**{field: F(field) + sum(counts)})
+
+    def release_sync(self, token, levels):
+        """
+        Release levels from the claim identified by token, the claim is released with its last level.
+
+        :return: bool whether the claim was released.
+        """
+        accounts = Account.objects.filter(pk=self.pk, sync_token=token)
+        while True:
+            try:
+                sync_levels = accounts.values_list('sync_levels', flat=True).get()
+            except Account.DoesNotExist:
+                return False  # Expired and claimed by another sync
+            remaining = [level for level in sync_levels.split(',') if level and level not in levels]
+            if remaining:
+                if accounts.filter(sync_levels=sync_levels).update(sync_levels=','.join(remaining)):
+                    return False
+            elif accounts.filter(sync_levels=sync_levels).update(status=self.STATUS_ACTIVE, sync_token=None, sync_started=None, sync_renewed=None,
+                                                                 sync_levels='', sync_task_id='', updated=timezone.now()):
+                self.status, self.sync_token, self.sync_levels, self.sync_task_id = self.STATUS_ACTIVE, None, '', ''
+                self.sync_started = self.sync_renewed = None
+                return True
+
+    @property
+    def sync_running_for(self):
+        """
+        The timedelta the sync in flight has been running for, or None.
+        """
+        if self.sync_token is None or self.sync_started is None:
+            return None
+        return timezone.now() - self.sync_started
+
+    def task_signature(self, method, args=(), kwargs=None, immutable=False):
+        """
+        Return the signature of the task method named method of this account.
+
+        With GOOGLEADWORDS_LIGHT_TASKS it's account_task which only carries the primary key of this
+        account and is serialized as JSON, otherwise it's the task method which is serialized with
+        django-cereal's pickle.
+        """
+        method_task = getattr(self, method)
+        kwargs = dict(kwargs or {})
+        if not settings.GOOGLEADWORDS_LIGHT_TASKS:
+            kwargs['this'] = self
+            return method_task.subtask(args, kwargs, immutable=immutable)
+
+        kwargs.update(account=self.pk, method=method)
+        return account_task.subtask(args, kwargs, immutable=immutable,
+                                    queue=method_task.queue,
+                                    time_limit=method_task.time_limit,
+                                    soft_time_limit=method_task.soft_time_limit)
+
+    def report_imports(self, model, start, sync, backfill=False, derived=False, **kwargs):
+        """
+        Return the signature that imports the report of model from start with the sync_* task named sync.
+
+        If derived only the columns that can't be derived from the ad data report are requested
+        (see MetricsRollup). Any kwargs are passed on to the sync_* task.
+
+        A backfill (the first sync of the report) is split into windows of
+        GOOGLEADWORDS_BACKFILL_WINDOW_DAYS days that are retrieved and imported in parallel, so
+        only the windows that fail are retried.
+        """
+        selector_kwargs = {'derived': True} if derived else {}
+        if not backfill or not settings.GOOGLEADWORDS_BACKFILL_WINDOW_DAYS:
+            return self.report_import(model.get_selector(start=start, **selector_kwargs), sync, **kwargs)
+
+        finish = date.today() - timedelta(days=1)
+        return group([self.report_import(model.get_selector(start=window_start, finish=window_finish, **selector_kwargs), sync, window=window_start.isoformat(), **kwargs)
+                      for window_start, window_finish in date_windows(start, finish, settings.GOOGLEADWORDS_BACKFILL_WINDOW_DAYS)])
+
+    def report_import(self, report_definition, sync, window=None, **kwargs):
+        """
+        Return the signature that retrieves the report and imports it with the sync_* task named sync.
+
+        With GOOGLEADWORDS_STREAM_REPORTS the report is imported as it's downloaded by stream_report,
+        otherwise it's written to a ReportFile by create_report_file and then imported.
+        """
+        kwargs['window'] = window
+        if settings.GOOGLEADWORDS_STREAM_REPORTS:
+            return self.task_signature('stream_report', (report_definition, sync), kwargs, immutable=True)
+        return self.task_signature('create_report_file', (report_definition,), immutable=True) | self.task_signature(sync, kwargs=kwargs)
 
     @task(name='Account.start_sync',
           queue=settings.GOOGLEADWORDS_HOUSEKEEPING_CELERY_QUEUE,
@@ -268,7 +857,13 @@ class Account(models.Model):
           queue=settings.GOOGLEADWORDS_HOUSEKEEPING_CELERY_QUEUE,
           serializer=DJANGO_CEREAL_PICKLE)
     @ensure_self
-    def finish_sync(self):
+    def finish_sync(self, token=None, levels=None):
+        """
+        Finish the sync, releasing levels of the claim identified by token if given (see claim_sync).
+        """
+        if token is not None:
+            self.release_sync(token, levels or self.SYNC_LEVELS)
+            return
         self.status = self.STATUS_ACTIVE
         self.save(update_fields=['updated', 'status'])
 
@@ -319,16 +914,48 @@ class Account(models.Model):
     @task(name='Account.create_report_file',
           queue=settings.GOOGLEADWORDS_REPORT_RETRIEVAL_CELERY_QUEUE,
           serializer=DJANGO_CEREAL_PICKLE)
+    @ensure_self
     def create_report_file(self, report_definition):
         """
         Create a ReportFile that contains the Google Adwords data as specified by report_definition.
         """
         try:
-            return ReportFile.objects.request(report_definition=report_definition,
-                                              client_customer_id=self.account_id)
+            report_file = ReportFile.objects.request(report_definition=report_definition,
+                                                     client_customer_id=self.account_id)
+            # Described by ReportDescriptor
+            report_file.report_definition = report_definition
+            return report_file
+        except ThrottledError as exc:
+            raise retry_throttled(self.create_report_file, exc)
+        except RateExceededError as exc:
+            logger.info("Caught RateExceededError for account '%s' - retrying in '%s' seconds.", self.pk, exc.retry_after_seconds)
+            raise self.create_report_file.retry(exc=exc, countdown=exc.retry_after_seconds)
+        except GoogleAdsError as exc:
+            raise InterceptedGoogleAdsError(exc, account_id=self.account_id)
+
+    @task(name='Account.stream_report',
+          queue=settings.GOOGLEADWORDS_DATA_IMPORT_CELERY_QUEUE,
+          time_limit=settings.GOOGLEADWORDS_CELERY_TIMELIMIT,
+          soft_time_limit=settings.GOOGLEADWORDS_CELERY_SOFTTIMELIMIT,
+          serializer=DJANGO_CEREAL_PICKLE)
+    @ensure_self
+    def stream_report(self, report_definition, sync, window=None, **kwargs):
+        """
+        Import the report with the sync_* task named sync (run in this task) as it's downloaded.
+
+        The compressed report is saved to a ReportFile if GOOGLEADWORDS_STREAM_TEE is enabled.
+        """
+        try:
+            with ReportFile.objects.stream(report_definition=report_definition,
+                                           client_customer_id=self.account_id,
+                                           tee=settings.GOOGLEADWORDS_STREAM_TEE) as report_stream:
+                getattr(self, sync)(report_file=report_stream, window=window, **kwargs)
+        except (ThrottledError, LeaseBusyError) as exc:
+            # A busy lease is found before the import reads the stream, so little is downloaded twice
+            raise retry_throttled(self.stream_report, exc)
         except RateExceededError as exc:
             logger.info("Caught RateExceededError for account '%s' - retrying in '%s' seconds.", self.pk, exc.retry_after_seconds)
-            raise self.get_account_data.retry(exc, countdown=exc.retry_after_seconds)
+            raise self.stream_report.retry(exc=exc, countdown=exc.retry_after_seconds)
         except GoogleAdsError as exc:
             raise InterceptedGoogleAdsError(exc, account_id=self.account_id)
 
@@ -338,20 +965,29 @@ class Account(models.Model):
           soft_time_limit=settings.GOOGLEADWORDS_CELERY_SOFTTIMELIMIT,
           serializer=DJANGO_CEREAL_PICKLE)
     @ensure_self
-    def sync_account(self, report_file):
+    def sync_account(self, report_file, window=None):
         """
         Sync the account data report.
 
         :param report_file: ReportFile
+        :param window: Identifies the date window of the report when a backfill is split up
+        :return: tuple of the number of rows (created, updated, skipped)
         """
         try:
-            for row in report_file.dehydrate():
-                account = Account.objects.populate(row, self)
-                DailyAccountMetrics.objects.populate(row, account=account)
+            with self.import_lease(DailyAccountMetrics, chunk=window) as lease:
+                entities = SyncIdentityMap(self)
+                batches = chunked(report_file.iter_rows(), settings.GOOGLEADWORDS_IMPORT_BATCH_SIZE)
+                counts = import_batches(DailyAccountMetrics, ([(row, entities.account(row)) for row in rows] for rows in batches), lease)
+                logger.info("Synced account data for account '%s' - %s created, %s updated, %s unchanged", self.pk, *counts)
+                self.record_report_rows('account', counts)
 
         except KeyError:
             logger.info("Caught KeyError syncing account '%s', report_file '%s' - Report doesn't have expected rows", self.pk, report_file.pk)
             raise
+        except LeaseBusyError as exc:
+            raise retry_throttled(self.sync_account, exc)
+
+        return counts
 
     @task(name='Account.sync_campaign',
           queue=settings.GOOGLEADWORDS_DATA_IMPORT_CELERY_QUEUE,
@@ -359,21 +995,29 @@ class Account(models.Model):
           soft_time_limit=settings.GOOGLEADWORDS_CELERY_SOFTTIMELIMIT,
           serializer=DJANGO_CEREAL_PICKLE)
     @ensure_self
-    def sync_campaign(self, report_file):
+    def sync_campaign(self, report_file, window=None):
         """
         Sync the campaign data report.
 
         :param report_file: ReportFile
+        :param window: Identifies the date window of the report when a backfill is split up
+        :return: tuple of the number of rows (created, updated, skipped)
         """
         try:
-            for row in report_file.dehydrate():
-                account = Account.objects.populate(row, self)
-                campaign = Campaign.objects.populate(row, account=account)
-                DailyCampaignMetrics.objects.populate(row, campaign=campaign)
+            with self.import_lease(DailyCampaignMetrics, chunk=window) as lease:
+                entities = SyncIdentityMap(self)
+                batches = chunked(report_file.iter_rows(), settings.GOOGLEADWORDS_IMPORT_BATCH_SIZE)
+                counts = import_batches(DailyCampaignMetrics, ([(row, entities.campaign(row)) for row in rows] for rows in batches), lease)
+                logger.info("Synced campaign data for account '%s' - %s created, %s updated, %s unchanged", self.pk, *counts)
+                self.record_report_rows('campaign', counts)
 
         except KeyError:
             logger.info("Caught KeyError syncing campaign for account '%s', report_file '%s' - Report doesn't have expected rows", self.pk, report_file.pk)
             raise
+        except LeaseBusyError as exc:
+            raise retry_throttled(self.sync_campaign, exc)
+
+        return counts
 
     @task(name='Account.sync_ad_group',
           queue=settings.GOOGLEADWORDS_DATA_IMPORT_CELERY_QUEUE,
@@ -381,42 +1025,158 @@ class Account(models.Model):
           soft_time_limit=settings.GOOGLEADWORDS_CELERY_SOFTTIMELIMIT,
           serializer=DJANGO_CEREAL_PICKLE)
     @ensure_self
-    def sync_ad_group(self, report_file):
+    def sync_ad_group(self, report_file, window=None):
         """
         Sync the ad group data report.
 
         :param report_file: ReportFile
+        :param window: Identifies the date window of the report when a backfill is split up
+        :return: tuple of the number of rows (created, updated, skipped)
         """
         try:
-            for row in report_file.dehydrate():
-                account = Account.objects.populate(row, self)
-                campaign = Campaign.objects.populate(row, account=account)
-                ad_group = AdGroup.objects.populate(row, campaign=campaign)
-                DailyAdGroupMetrics.objects.populate(row, ad_group=ad_group)
+            with self.import_lease(DailyAdGroupMetrics, chunk=window) as lease:
+                entities = SyncIdentityMap(self)
+                batches = chunked(report_file.iter_rows(), settings.GOOGLEADWORDS_IMPORT_BATCH_SIZE)
+                counts = import_batches(DailyAdGroupMetrics, ([(row, entities.ad_group(row)) for row in rows] for rows in batches), lease)
+                logger.info("Synced ad group data for account '%s' - %s created, %s updated, %s unchanged", self.pk, *counts)
+                self.record_report_rows('ad_group', counts)
 
         except KeyError:
             logger.info("Caught KeyError syncing ad group for account '%s', report_file '%s' - Report doesn't have expected rows", self.pk, report_file.pk)
             raise
+        except LeaseBusyError as exc:
+            raise retry_throttled(self.sync_ad_group, exc)
+
+        return counts
 
     @task(name='Account.sync_ad', queue=settings.GOOGLEADWORDS_DATA_IMPORT_CELERY_QUEUE, time_limit=settings.GOOGLEADWORDS_CELERY_TIMELIMIT, soft_time_limit=settings.GOOGLEADWORDS_CELERY_SOFTTIMELIMIT, serializer=DJANGO_CEREAL_PICKLE)
     @ensure_self
-    def sync_ad(self, report_file):
+    def sync_ad(self, report_file, window=None, derive=None):
         """
         Sync the ad data report.
 
         :param report_file: ReportFile
+        :param window: Identifies the date window of the report when a backfill is split up
+        :param derive: The levels ('campaign' and/or 'ad_group') whose metrics are rolled up from the report
+        :return: tuple of the number of rows (created, updated, skipped)
         """
         try:
-            for row in report_file.dehydrate():
-                account = Account.objects.populate(row, self)
-                campaign = Campaign.objects.populate(row, account=account)
-                ad_group = AdGroup.objects.populate(row, campaign=campaign)
-                ad = Ad.objects.populate(row, ad_group=ad_group)
-                DailyAdMetrics.objects.populate(row, ad=ad)
+            rollup = MetricsRollup(derive or [])
+            # The derived metrics' leases are taken up front so the report isn't imported only to find them busy
+            with ImportLeases(self.import_lease(DailyAdMetrics, chunk=window), *self.derive_leases(rollup, window=window)) as lease:
+                entities = SyncIdentityMap(self)
+                batches = chunked(rollup.observe(report_file.iter_rows()), settings.GOOGLEADWORDS_IMPORT_BATCH_SIZE)
+                counts = import_batches(DailyAdMetrics, ([(row, entities.ad(row)) for row in rows] for rows in batches), lease)
+                logger.info("Synced ad data for account '%s' - %s created, %s updated, %s unchanged", self.pk, *counts)
+                self.record_report_rows('ad', counts)
+                self.derive_metrics(rollup, entities, lease)
 
         except KeyError:
             logger.info("Caught KeyError syncing ad for account '%s', report_file '%s' - Report doesn't have expected rows", self.pk, report_file.pk)
             raise
+        except LeaseBusyError as exc:
+            raise retry_throttled(self.sync_ad, exc)
+
+        return counts
+
+    @task(name='Account.prepare_ad_sync',
+          queue=settings.GOOGLEADWORDS_DATA_IMPORT_CELERY_QUEUE,
+          time_limit=settings.GOOGLEADWORDS_CELERY_TIMELIMIT,
+          soft_time_limit=settings.GOOGLEADWORDS_CELERY_SOFTTIMELIMIT,
+          serializer=DJANGO_CEREAL_PICKLE)
+    @ensure_self
+    def prepare_ad_sync(self, report_file, derive=None, chunks=None):
+        """
+        Populate the Campaigns, AdGroups and Ads in the ad data report so that the chunks
+        imported in parallel by import_ad_chunk only write DailyAdMetrics.
+
+        The report is split into its chunks in the same pass, so each chunk only parses its rows.
+
+        :param report_file: ReportFile
+        :param derive: The levels ('campaign' and/or 'ad_group') whose metrics are rolled up from the report
+        :param chunks: The number of chunks to split the report into, see ReportFile.split
+        :return: ReportFile
+        """
+        try:
+            rollup = MetricsRollup(derive or [])
+            with ImportLeases(self.import_lease(Ad), *self.derive_leases(rollup)) as lease:
+                entities = SyncIdentityMap(self)
+                rows = report_file.split(chunks, settings.GOOGLEADWORDS_IMPORT_BATCH_SIZE) if chunks else report_file.iter_rows()
+                for row in rollup.observe(rows):
+                    entities.ad(row)
+                    lease.renew()
+                self.derive_metrics(rollup, entities, lease)
+
+        except KeyError:
+            logger.info("Caught KeyError preparing ad sync for account '%s', report_file '%s' - Report doesn't have expected rows", self.pk, report_file.pk)
+            raise
+        except LeaseBusyError as exc:
+            raise retry_throttled(self.prepare_ad_sync, exc)
+
+        return report_file
+
+    @task(name='Account.import_ad_chunk',
+          queue=settings.GOOGLEADWORDS_DATA_IMPORT_CELERY_QUEUE,
+          time_limit=settings.GOOGLEADWORDS_CELERY_TIMELIMIT,
+          soft_time_limit=settings.GOOGLEADWORDS_CELERY_SOFTTIMELIMIT,
+          serializer=DJANGO_CEREAL_PICKLE)
+    @ensure_self
+    def import_ad_chunk(self, report_file, index, count):
+        """
+        Sync one of count chunks of the ad data report, prepare_ad_sync must have run first.
+
+        prepare_ad_sync split the report into count chunk files (see ReportFile.split), this
+        imports the chunk index and then removes its file.
+
+        :param report_file: ReportFile
+        :param index: The index of this chunk
+        :param count: The number of chunks
+        """
+        try:
+            with self.import_lease(DailyAdMetrics, chunk=index) as lease:
+                entities = SyncIdentityMap(self).load_ads()
+                batches = chunked(report_file.iter_chunk_rows(index), settings.GOOGLEADWORDS_IMPORT_BATCH_SIZE)
+                counts = import_batches(DailyAdMetrics, ([(row, entities.ad(row)) for row in rows] for rows in batches), lease)
+                logger.info("Imported ad data chunk %s/%s for account '%s' - %s created, %s updated, %s unchanged", index, count, self.pk, *counts)
+                self.record_report_rows('ad', counts)
+            os.remove(report_file.chunk_path(index))
+
+        except KeyError:
+            logger.info("Caught KeyError importing ad chunk %s/%s for account '%s', report_file '%s' - Report doesn't have expected rows", index, count, self.pk, report_file.pk)
+            raise
+        except LeaseBusyError as exc:
+            raise retry_throttled(self.import_ad_chunk, exc)
+
+    def derive_leases(self, rollup, window=None):
+        """
+        Return the ImportLeases derive_metrics must be called with (held) for rollup.
+
+        :param window: Identifies the date window of the report when a backfill is split up
+        """
+        return [self.import_lease(DailyCampaignMetrics if level == 'campaign' else DailyAdGroupMetrics, chunk=window)
+                for level in rollup.levels]
+
+    def derive_metrics(self, rollup, entities, lease):
+        """
+        Populate the campaign and/or ad group metrics rolled up from the ad data report.
+
+        :param rollup: MetricsRollup
+        :param entities: The SyncIdentityMap the ad data report was imported with.
+        :param lease: ImportLeases holding derive_leases, renewed as the metrics are populated
+        """
+        for level in rollup.levels:
+            model_cls = DailyCampaignMetrics if level == 'campaign' else DailyAdGroupMetrics
+            batches = chunked(rollup.rows(level, entities), settings.GOOGLEADWORDS_IMPORT_BATCH_SIZE)
+            counts = import_batches(model_cls, batches, lease, fingerprint_field='derived_fingerprint')
+            logger.info("Derived %s data for account '%s' - %s created, %s updated, %s unchanged", level.replace('_', ' '), self.pk, *counts)
+
+    def import_lease(self, model, chunk=None):
+        """
+        Return the ImportLease for importing the report (or a chunk of it) that populates model for this account.
+        """
+        if chunk is not None:
+            return ImportLease('%s-%s-%s' % (self.account_id, model.__name__, chunk))
+        return ImportLease('%s-%s' % (self.account_id, model.__name__))
 
     @staticmethod
     def get_selector(start=None, finish=None):
@@ -434,42 +1194,9 @@ class Account(models.Model):
             'reportType': 'ACCOUNT_PERFORMANCE_REPORT',
             'downloadFormat': 'GZIPPED_CSV',
             'selector': {
-                'fields': [
-                    'AccountCurrencyCode',
-                    'AccountDescriptiveName',
-                    'AverageCpc',
-                    'AverageCpm',
-                    'AveragePosition',
-                    'Clicks',
-                    'ContentBudgetLostImpressionShare',
-                    'ContentImpressionShare',
-                    'ContentRankLostImpressionShare',
-                    'ClickConversionRate',
-                    'ConversionRateManyPerClick',
-                    'ConversionValue',
-                    'ConvertedClicks',
-                    'ConversionsManyPerClick',
-                    'Cost',
-                    'CostPerConvertedClick',
-                    'CostPerConversionManyPerClick',
-                    'CostPerEstimatedTotalConversion',
-                    'Ctr',
-                    'Device',
-                    'EstimatedCrossDeviceConversions',
-                    'EstimatedTotalConversionRate',
-                    'EstimatedTotalConversionValue',
-                    'EstimatedTotalConversionValuePerClick',
-                    'EstimatedTotalConversionValuePerCost',
-                    'EstimatedTotalConversions',
-                    'Impressions',
-                    'InvalidClickRate',
-                    'InvalidClicks',
-                    'SearchBudgetLostImpressionShare',
-                    'SearchExactMatchImpressionShare',
-                    'SearchImpressionShare',
-                    'SearchRankLostImpressionShare',
-                    'Date',
-                ],
+                'fields': report_fields('ACCOUNT_PERFORMANCE_REPORT',
+                                        [Account, DailyAccountMetrics],
+                                        required=['AccountCurrencyCode', 'Device', 'Date']),
                 'dateRange': {
                     'min': start.strftime("%Y%m%d"),
                     'max': finish.strftime("%Y%m%d")
@@ -625,6 +1352,7 @@ class DailyAccountMetrics(models.Model):
     day = models.DateField(help_text='When this metric occurred')
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False, help_text='Hash of the report values this row was populated from')
     content_impr_share = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, help_text='Content Impr. share')
     content_lost_is_rank = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, help_text='Content Lost IS (rank)')
     cost_est_total_conv = MoneyField(max_digits=12, decimal_places=2, default=0, help_text='Cost / est. total conv.', null=True, blank=True)
@@ -644,6 +1372,10 @@ class DailyAccountMetrics(models.Model):
 
     objects = QuerySetManager()
 
+    class Meta:
+        unique_together = (('account', 'device', 'day'),)
+        index_together = (('account', 'day'),)
+
     def __unicode__(self):
         return '%s' % (self.day)
 
@@ -654,21 +1386,20 @@ class DailyAccountMetrics(models.Model):
             day = data.get('Day')
             identifier = '%s-%s-%s' % (account.pk, device, day)
 
-            while not acquire_googleadwords_lock(DailyAccountMetrics, identifier):
-                locking_logger.debug("Waiting for acquire_googleadwords_lock: %s:%s", DailyAccountMetrics.__name__, identifier)
-                time.sleep(settings.GOOGLEADWORDS_LOCK_WAIT)
-
-            try:
-                locking_logger.debug("Success acquire_googleadwords_lock: %s:%s", DailyAccountMetrics.__name__, identifier)
+            with googleadwords_lock(DailyAccountMetrics, identifier):
                 return self._populate(data,
                                       ignore_fields=['account', 'account_id'],
                                       device=device,
                                       day=day,
                                       account=account)
 
-            finally:
-                locking_logger.debug("Releasing acquire_googleadwords_lock: %s:%s", DailyAccountMetrics.__name__, identifier)
-                release_googleadwords_lock(DailyAccountMetrics, identifier)
+        def populate_many(self, rows):
+            """
+            Batched populate - rows is an iterable of (data, account) tuples.
+            """
+            return self._bulk_populate([(data, dict(device=data.get('Device'), day=data.get('Day'), account=account))
+                                        for data, account in rows],
+                                       ignore_fields=['account', 'account_id'])
 
         def desktop(self):
             return self.filter(device=DailyAccountMetrics.DEVICE_DESKTOP)
@@ -779,21 +1510,12 @@ class Campaign(models.Model):
             campaign_id = int(data.get('Campaign ID'))
 
             # Get a lock based upon the campaign id
-            while not acquire_googleadwords_lock(Campaign, campaign_id):
-                locking_logger.debug("Waiting for acquire_googleadwords_lock: %s:%s", Campaign.__name__, campaign_id)
-                time.sleep(settings.GOOGLEADWORDS_LOCK_WAIT)
-
-            try:
-                locking_logger.debug("Success acquire_googleadwords_lock: %s:%s", Campaign.__name__, campaign_id)
+            with googleadwords_lock(Campaign, campaign_id):
                 return self._populate(data,
                                       ignore_fields=['account', 'account_id'],
                                       campaign_id=campaign_id,
                                       account=account)
 
-            finally:
-                locking_logger.debug("Releasing acquire_googleadwords_lock: %s:%s", Campaign.__name__, campaign_id)
-                release_googleadwords_lock(Campaign, campaign_id)
-
         def enabled(self):
             return self.filter(campaign_state=Campaign.STATE_ENABLED)
 
@@ -804,9 +1526,11 @@ class Campaign(models.Model):
             return self.filter(campaign_state=Campaign.STATE_REMOVED)
 
     @staticmethod
-    def get_selector(start=None, finish=None):
+    def get_selector(start=None, finish=None, derived=False):
         """
         Returns the selector to pass to the api to get the data.
+
+        If derived only the columns that can't be derived from the ad data report are requested.
         """
         if not start:
             start = date.today() - timedelta(days=6)
@@ -819,58 +1543,10 @@ class Campaign(models.Model):
             'reportType': 'CAMPAIGN_PERFORMANCE_REPORT',
             'downloadFormat': 'GZIPPED_CSV',
             'selector': {
-                'fields': ['AccountCurrencyCode',
-                           'AccountDescriptiveName',
-                           'Amount',
-                           'AverageCpc',
-                           'AverageCpm',
-                           'AveragePosition',
-                           'BiddingStrategyId',
-                           'BiddingStrategyName',
-                           'BiddingStrategyType',
-                           'CampaignId',
-                           'CampaignName',
-                           'CampaignStatus',
-                           'Clicks',
-                           'ContentBudgetLostImpressionShare',
-                           'ContentImpressionShare',
-                           'ContentImpressionShare',
-                           'ContentRankLostImpressionShare',
-                           'ContentRankLostImpressionShare',
-                           'ClickConversionRate',
-                           'ConversionRateManyPerClick',
-                           'ConversionValue',
-                           'ConvertedClicks',
-                           'ConversionsManyPerClick',
-                           'Cost',
-                           'CostPerConvertedClick',
-                           'CostPerConversionManyPerClick',
-                           'CostPerEstimatedTotalConversion',
-                           'CostPerEstimatedTotalConversion',
-                           'Ctr',
-                           'EstimatedCrossDeviceConversions',
-                           'EstimatedCrossDeviceConversions',
-                           'EstimatedTotalConversionRate',
-                           'EstimatedTotalConversionRate',
-                           'EstimatedTotalConversions',
-                           'EstimatedTotalConversions',
-                           'EstimatedTotalConversionValue',
-                           'EstimatedTotalConversionValue',
-                           'EstimatedTotalConversionValuePerClick',
-                           'EstimatedTotalConversionValuePerClick',
-                           'EstimatedTotalConversionValuePerCost',
-                           'EstimatedTotalConversionValuePerCost',
-                           'Impressions',
-                           'InvalidClickRate',
-                           'InvalidClicks',
-                           'SearchBudgetLostImpressionShare',
-                           'SearchExactMatchImpressionShare',
-                           'SearchExactMatchImpressionShare',
-                           'SearchImpressionShare',
-                           'SearchImpressionShare',
-                           'SearchRankLostImpressionShare',
-                           'SearchRankLostImpressionShare',
-                           'Date'],
+                'fields': report_fields('CAMPAIGN_PERFORMANCE_REPORT',
+                                        [Account, Campaign, DailyCampaignMetrics],
+                                        required=['AccountCurrencyCode', 'CampaignId', 'Date'],
+                                        exclude_columns=MetricsRollup.DERIVED if derived else ()),
                 'dateRange': {'min': start.strftime("%Y%m%d"),
                               'max': finish.strftime("%Y%m%d")},
             },
@@ -933,6 +1609,9 @@ class DailyCampaignMetrics(models.Model):
     day = models.DateField(help_text='When this metric occurred')
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False, help_text='Hash of the report values this row was populated from')
+    derived_fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False,
+                                           help_text='Hash of the values rolled up from the ad report this row was populated from')
     content_impr_share = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, help_text='Content Impr. share')
     content_lost_is_rank = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, help_text='Content Lost IS (rank)')
     cost_est_total_conv = MoneyField(max_digits=12, decimal_places=2, default=0, help_text='Cost / est. total conv.', null=True, blank=True)
@@ -958,6 +1637,9 @@ class DailyCampaignMetrics(models.Model):
 
     objects = QuerySetManager()
 
+    class Meta:
+        unique_together = (('campaign', 'day'),)
+
     def __unicode__(self):
         return '%s' % (self.day)
 
@@ -968,20 +1650,23 @@ class DailyCampaignMetrics(models.Model):
             day = date(year, month, day)
             identifier = '%s-%s' % (campaign.pk, day)
 
-            while not acquire_googleadwords_lock(DailyCampaignMetrics, identifier):
-                locking_logger.debug("Waiting for acquire_googleadwords_lock: %s:%s", DailyCampaignMetrics.__name__, identifier)
-                time.sleep(settings.GOOGLEADWORDS_LOCK_WAIT)
-
-            try:
-                locking_logger.debug("Success acquire_googleadwords_lock: %s:%s", DailyCampaignMetrics.__name__, identifier)
+            with googleadwords_lock(DailyCampaignMetrics, identifier):
                 return self._populate(data,
                                       ignore_fields=['campaign', 'campaign_id'],
                                       day=day,
                                       campaign=campaign)
 
-            finally:
-                locking_logger.debug("Releasing acquire_googleadwords_lock: %s:%s", DailyCampaignMetrics.__name__, identifier)
-                release_googleadwords_lock(DailyCampaignMetrics, identifier)
+        def populate_many(self, rows, fingerprint_field='fingerprint'):
+            """
+            Batched populate - rows is an iterable of (data, campaign) tuples.
+
+            :param fingerprint_field: fingerprint for rows from the report, derived_fingerprint for
+                                      those rolled up from the ad report (see MetricsRollup).
+            """
+            return self._bulk_populate([(data, dict(day=data.get('Day'), campaign=campaign))
+                                        for data, campaign in rows],
+                                       ignore_fields=['campaign', 'campaign_id'],
+                                       fingerprint_field=fingerprint_field)
 
         def within_period(self, start, finish):
             return self.filter(day__gte=start, day__lte=finish)
@@ -1024,21 +1709,12 @@ class AdGroup(models.Model):
             ad_group_id = int(data.get('Ad group ID'))
 
             # Get a lock based upon the ad_group_id
-            while not acquire_googleadwords_lock(AdGroup, ad_group_id):
-                locking_logger.debug("Waiting for acquire_googleadwords_lock: %s:%s", AdGroup.__name__, ad_group_id)
-                time.sleep(settings.GOOGLEADWORDS_LOCK_WAIT)
-
-            try:
-                locking_logger.debug("Success acquire_googleadwords_lock: %s:%s", AdGroup.__name__, ad_group_id)
+            with googleadwords_lock(AdGroup, ad_group_id):
                 return self._populate(data,
                                       ignore_fields=['campaign', 'campaign_id'],
                                       ad_group_id=ad_group_id,
                                       campaign=campaign)
 
-            finally:
-                locking_logger.debug("Releasing acquire_googleadwords_lock: %s:%s", AdGroup.__name__, ad_group_id)
-                release_googleadwords_lock(AdGroup, ad_group_id)
-
         def top_by_clicks(self, start, finish):
             return self.filter(metrics__day__gte=start, metrics__day__lte=finish) \
                 .annotate(clicks=Sum('metrics__clicks'),
@@ -1073,9 +1749,11 @@ class AdGroup(models.Model):
             return self.filter(ad_group_state=AdGroup.STATE_REMOVED)
 
     @staticmethod
-    def get_selector(start=None, finish=None):
+    def get_selector(start=None, finish=None, derived=False):
         """
         Returns the selector to pass to the api to get the data.
+
+        If derived only the columns that can't be derived from the ad data report are requested.
         """
         if not start:
             start = date.today() - timedelta(days=6)
@@ -1088,49 +1766,10 @@ class AdGroup(models.Model):
             'reportType': 'ADGROUP_PERFORMANCE_REPORT',
             'downloadFormat': 'GZIPPED_CSV',
             'selector': {
-                'fields': ['AccountCurrencyCode',
-                           'AccountDescriptiveName',
-                           'AdGroupId',
-                           'AdGroupName',
-                           'AdGroupStatus',
-                           'CampaignId',
-                           'CampaignName',
-                           'CampaignStatus',
-                           'TargetCpa',
-                           'ValuePerEstimatedTotalConversion',
-                           'BiddingStrategyId',
-                           'BiddingStrategyName',
-                           'BiddingStrategyType',
-                           'ContentImpressionShare',
-                           'ContentRankLostImpressionShare',
-                           'CostPerEstimatedTotalConversion',
-                           'EstimatedCrossDeviceConversions',
-                           'EstimatedTotalConversionRate',
-                           'EstimatedTotalConversionValue',
-                           'EstimatedTotalConversionValuePerClick',
-                           'EstimatedTotalConversionValuePerCost',
-                           'EstimatedTotalConversions',
-                           'SearchExactMatchImpressionShare',
-                           'SearchImpressionShare',
-                           'SearchRankLostImpressionShare',
-                           'ValuePerConvertedClick',
-                           'ValuePerConversionManyPerClick',
-                           'ViewThroughConversions',
-                           'AverageCpc',
-                           'AverageCpm',
-                           'AveragePosition',
-                           'Clicks',
-                           'ClickConversionRate',
-                           'ConversionRateManyPerClick',
-                           'ConversionValue',
-                           'ConvertedClicks',
-                           'ConversionsManyPerClick',
-                           'Cost',
-                           'CostPerConvertedClick',
-                           'CostPerConversionManyPerClick',
-                           'Ctr',
-                           'Impressions',
-                           'Date'],
+                'fields': report_fields('ADGROUP_PERFORMANCE_REPORT',
+                                        [Account, Campaign, AdGroup, DailyAdGroupMetrics],
+                                        required=['AccountCurrencyCode', 'CampaignId', 'AdGroupId', 'Date'],
+                                        exclude_columns=MetricsRollup.DERIVED if derived else ()),
                 'dateRange': {'min': start.strftime("%Y%m%d"),
                               'max': finish.strftime("%Y%m%d")},
             },
@@ -1186,6 +1825,9 @@ class DailyAdGroupMetrics(models.Model):
     day = models.DateField(help_text='When this metric occurred')
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False, help_text='Hash of the report values this row was populated from')
+    derived_fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False,
+                                           help_text='Hash of the values rolled up from the ad report this row was populated from')
     content_impr_share = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, help_text='Content Impr. share')
     content_lost_is_rank = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, help_text='Content Lost IS (rank)')
     cost_est_total_conv = MoneyField(max_digits=12, decimal_places=2, default=0, help_text='Cost / est. total conv.', null=True, blank=True)
@@ -1209,6 +1851,9 @@ class DailyAdGroupMetrics(models.Model):
 
     objects = QuerySetManager()
 
+    class Meta:
+        unique_together = (('ad_group', 'day'),)
+
     def __unicode__(self):
         return '%s' % (self.day)
 
@@ -1218,20 +1863,23 @@ class DailyAdGroupMetrics(models.Model):
             day = data.get('Day')
             identifier = '%s-%s' % (ad_group.pk, day)
 
-            while not acquire_googleadwords_lock(DailyAdGroupMetrics, identifier):
-                locking_logger.debug("Waiting for acquire_googleadwords_lock: %s:%s", DailyAdGroupMetrics.__name__, identifier)
-                time.sleep(settings.GOOGLEADWORDS_LOCK_WAIT)
-
-            try:
-                locking_logger.debug("Success acquire_googleadwords_lock: %s:%s", DailyAdGroupMetrics.__name__, identifier)
+            with googleadwords_lock(DailyAdGroupMetrics, identifier):
                 return self._populate(data,
                                       ignore_fields=['ad_group', 'ad_group_id'],
                                       day=day,
                                       ad_group=ad_group)
 
-            finally:
-                locking_logger.debug("Releasing acquire_googleadwords_lock: %s:%s", DailyAdGroupMetrics.__name__, identifier)
-                release_googleadwords_lock(DailyAdGroupMetrics, identifier)
+        def populate_many(self, rows, fingerprint_field='fingerprint'):
+            """
+            Batched populate - rows is an iterable of (data, ad_group) tuples.
+
+            :param fingerprint_field: fingerprint for rows from the report, derived_fingerprint for
+                                      those rolled up from the ad report (see MetricsRollup).
+            """
+            return self._bulk_populate([(data, dict(day=data.get('Day'), ad_group=ad_group))
+                                        for data, ad_group in rows],
+                                       ignore_fields=['ad_group', 'ad_group_id'],
+                                       fingerprint_field=fingerprint_field)
 
         def within_period(self, start, finish):
             return self.filter(day__gte=start, day__lte=finish)
@@ -1312,21 +1960,12 @@ class Ad(models.Model):
             ad_id = int(data.get('Ad ID'))
 
             # Get a lock based upon the campaign id
-            while not acquire_googleadwords_lock(Ad, ad_id):
-                locking_logger.debug("Waiting for acquire_googleadwords_lock: %s:%s", Ad.__name__, ad_id)
-                time.sleep(settings.GOOGLEADWORDS_LOCK_WAIT)
-
-            try:
-                locking_logger.debug("Success acquire_googleadwords_lock: %s:%s", Ad.__name__, ad_id)
+            with googleadwords_lock(Ad, ad_id):
                 return self._populate(data,
                                       ignore_fields=['ad_group', 'ad_group_id'],
                                       ad_id=ad_id,
                                       ad_group=ad_group)
 
-            finally:
-                locking_logger.debug("Releasing acquire_googleadwords_lock: %s:%s", Ad.__name__, ad_id)
-                release_googleadwords_lock(Ad, ad_id)
-
         def top_by_clicks(self, start, finish):
             return self.filter(metrics__day__gte=start, metrics__day__lte=finish) \
                        .annotate(clicks=Sum('metrics__clicks'),
@@ -1379,41 +2018,9 @@ class Ad(models.Model):
             'reportType': 'AD_PERFORMANCE_REPORT',
             'downloadFormat': 'GZIPPED_CSV',
             'selector': {
-                'fields': ['AccountCurrencyCode',
-                           'AccountDescriptiveName',
-                           'AdGroupId',
-                           'AdGroupName',
-                           'AdGroupStatus',
-                           'AdType',
-                           'AverageCpc',
-                           'AverageCpm',
-                           'AveragePosition',
-                           'CampaignId',
-                           'CampaignName',
-                           'CampaignStatus',
-                           'Clicks',
-                           'ClickConversionRate',
-                           'ConversionRateManyPerClick',
-                           'ConversionValue',
-                           'ConvertedClicks',
-                           'ConversionsManyPerClick',
-                           'Cost',
-                           'CostPerConvertedClick',
-                           'CostPerConversionManyPerClick',
-                           'CreativeApprovalStatus',
-                           'CreativeDestinationUrl',
-                           'Ctr',
-                           'Description1',
-                           'Description2',
-                           'DisplayUrl',
-                           'Headline',
-                           'Id',
-                           'Impressions',
-                           'Status',
-                           'ValuePerConvertedClick',
-                           'ValuePerConversionManyPerClick',
-                           'ViewThroughConversions',
-                           'Date'],
+                'fields': report_fields('AD_PERFORMANCE_REPORT',
+                                        [Account, Campaign, AdGroup, Ad, DailyAdMetrics],
+                                        required=['AccountCurrencyCode', 'CampaignId', 'AdGroupId', 'Id', 'Date']),
                 'dateRange': {'min': start.strftime("%Y%m%d"),
                               'max': finish.strftime("%Y%m%d")},
             },
@@ -1442,12 +2049,16 @@ class DailyAdMetrics(models.Model):
     day = models.DateField(help_text='When this metric occurred')
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False, help_text='Hash of the report values this row was populated from')
     value_converted_click = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, help_text='Value / converted click')
     value_conv = models.DecimalField(max_digits=12, decimal_places=2, null=True, blank=True, help_text='Value / conv.')
     view_through_conv = models.BigIntegerField(help_text='View-through conv.', null=True, blank=True)
 
     objects = QuerySetManager()
 
+    class Meta:
+        unique_together = (('ad', 'day'),)
+
     def __unicode__(self):
         return '%s' % self.day
 
@@ -1457,20 +2068,195 @@ class DailyAdMetrics(models.Model):
             day = data.get('Day')
             identifier = '%s-%s' % (ad.pk, day)
 
-            while not acquire_googleadwords_lock(DailyAdMetrics, identifier):
-                locking_logger.debug("Waiting for acquire_googleadwords_lock: %s:%s", DailyAdMetrics.__name__, identifier)
-                time.sleep(settings.GOOGLEADWORDS_LOCK_WAIT)
-
-            try:
-                locking_logger.debug("Success acquire_googleadwords_lock: %s:%s", DailyAdMetrics.__name__, identifier)
+            with googleadwords_lock(DailyAdMetrics, identifier):
                 return self._populate(data,
                                       ignore_fields=['ad', 'ad_id'],
                                       day=day,
                                       ad=ad)
 
-            finally:
-                locking_logger.debug("Releasing acquire_googleadwords_lock: %s:%s", DailyAdMetrics.__name__, identifier)
-                release_googleadwords_lock(DailyAdMetrics, identifier)
+        def populate_many(self, rows):
+            """
+            Batched populate - rows is an iterable of (data, ad) tuples.
+            """
+            return self._bulk_populate([(data, dict(day=data.get('Day'), ad=ad))
+                                        for data, ad in rows],
+                                       ignore_fields=['ad', 'ad_id'])
+
+
+class SyncIdentityMap(object):
+    """
+    Sync scoped identity map for the entities referenced by the rows of a report.
+
+    Each Account, Campaign, AdGroup and Ad is populated (and thus written) the first time
+    it's seen in a report, subsequent rows reuse the in-memory instance. A subsequent row for a
+    day at least as recent updates the instance, so an entity whose attributes changed within
+    the report (ie.. a renamed campaign) ends up with those of its most recent day. Only a
+    change is written.
+    """
+
+    def __init__(self, account):
+        self.account_instance = account
+        self._account = None
+        self._campaigns = {}
+        self._ad_groups = {}
+        self._ads = {}
+        # The day of the row each entity was last populated from, keyed by the entity's key
+        self._days = {}
+
+    def _refresh(self, key, instance, row, ignore_fields):
+        """
+        Update instance from row if it's for a day at least as recent as the last row it was populated from.
+        """
+        day = row.get('Day')
+        if day is not None and self._days[key] is not None and day < self._days[key]:
+            return
+        self._days[key] = day
+        update_fields = type(instance).objects.populate_model_from_dict(instance, row, ignore_fields)
+        if update_fields:
+            instance.save(update_fields=update_fields)
+
+    def account(self, row):
+        if self._account is None:
+            self._account = Account.objects.populate(row, self.account_instance)
+            self._days['account'] = row.get('Day')
+        else:
+            self._refresh('account', self._account, row, ['status', 'account_id', 'account_last_synced'])
+        return self._account
+
+    def campaign(self, row):
+        campaign_id = int(row.get('Campaign ID'))
+        key = ('campaign', campaign_id)
+        if campaign_id not in self._campaigns:
+            self._campaigns[campaign_id] = Campaign.objects.populate(row, account=self.account(row))
+            self._days[key] = row.get('Day')
+        else:
+            self.account(row)
+            self._refresh(key, self._campaigns[campaign_id], row, ['account', 'account_id'])
+        return self._campaigns[campaign_id]
+
+    def ad_group(self, row):
+        ad_group_id = int(row.get('Ad group ID'))
+        key = ('ad_group', ad_group_id)
+        if ad_group_id not in self._ad_groups:
+            self._ad_groups[ad_group_id] = AdGroup.objects.populate(row, campaign=self.campaign(row))
+            self._days[key] = row.get('Day')
+        else:
+            self.campaign(row)
+            self._refresh(key, self._ad_groups[ad_group_id], row, ['campaign', 'campaign_id'])
+        return self._ad_groups[ad_group_id]
+
+    def load_ads(self):
+        """
+        Load every Ad of the account from the database (ie.. after they've been populated).
+        """
+        for ad in Ad.objects.filter(ad_group__campaign__account=self.account_instance).select_related('ad_group'):
+            self._ads[(ad.ad_group.ad_group_id, ad.ad_id)] = ad
+        return self
+
+    def ad(self, row):
+        # Ad ids are only unique within an ad group
+        key = (int(row.get('Ad group ID')), int(row.get('Ad ID')))
+        if key not in self._ads:
+            self._ads[key] = Ad.objects.populate(row, ad_group=self.ad_group(row))
+            self._days[('ad',) + key] = row.get('Day')
+        elif ('ad',) + key in self._days:
+            self.ad_group(row)
+            self._refresh(('ad',) + key, self._ads[key], row, ['ad_group', 'ad_group_id'])
+        # else loaded rather than populated (see load_ads), the ad and its parents are up to date
+        return self._ads[key]
+
+
+class MetricsRollup(object):
+    """
+    Rolls the rows of the ad data report up into DailyAdGroupMetrics and DailyCampaignMetrics rows.
+
+    Only the additive columns and the ratios between them (ie.. CTR and Avg. CPC) can be
+    derived, the columns that can't (ie.. impression share and bid strategy) are left as they are
+    to be populated from a campaign or ad group report of just those (see Campaign.get_selector).
+    """
+    LEVELS = OrderedDict([
+        ('campaign', 'Campaign ID'),
+        ('ad_group', 'Ad group ID'),
+    ])
+    SUMMED = ('Clicks', 'Impressions', 'Cost', 'Converted clicks', 'Conversions', 'Total conv. value')
+    RATIOS = ('Avg. position', 'CTR', 'Avg. CPC', 'Avg. CPM', 'Conv. rate', 'Click conversion rate',
+              'Cost / conv.', 'Cost / converted click', 'Value / conv.', 'Value / converted click')
+    # The columns populated by rows
+    DERIVED = SUMMED + RATIOS
+
+    def __init__(self, levels):
+        """
+        :param levels: The levels to derive, 'campaign' and/or 'ad_group'.
+        """
+        self.levels = [level for level in self.LEVELS if level in levels]
+        self._totals = dict((level, OrderedDict()) for level in self.levels)
+
+    @staticmethod
+    def number(value):
+        if value is None or value == ' --':
+            return Decimal(0)
+        return Decimal(value.replace(',', ''))
+
+    def add(self, row):
+        """
+        Add the values of a row of the ad data report to the totals of its campaign and ad group.
+        """
+        values = [self.number(row.get(column)) for column in self.SUMMED]
+        position = self.number(row.get('Avg. position')) * values[1]
+        for level in self.levels:
+            key = (int(row.get(self.LEVELS[level])), row.get('Day'))
+            totals = self._totals[level].get(key)
+            if totals is None:
+                # The first row is kept to resolve the campaign or ad group through the SyncIdentityMap
+                self._totals[level][key] = [row, position] + values
+            else:
+                totals[1] += position
+                for i, value in enumerate(values, 2):
+                    totals[i] += value
+
+    def observe(self, rows):
+        """
+        Yield each row of rows after adding it.
+        """
+        for row in rows:
+            self.add(row)
+            yield row
+
+    def rows(self, level, entities):
+        """
+        Yield a (data, parent) tuple for each day of each campaign or ad group, as accepted by populate_many.
+
+        :param entities: The SyncIdentityMap the ad data report was imported with.
+        """
+        fields = ('Currency', self.LEVELS[level], 'Day') + self.DERIVED
+
+        def ratio(numerator, denominator, scale=1):
+            return numerator * scale / denominator if denominator else Decimal(0)
+
+        for (identifier, day), totals in self._totals[level].items():
+            row, position, clicks, impressions, cost, converted_clicks, conversions, value = totals
+            data = ReportRow(fields, [
+                row.get('Currency'),
+                six.text_type(identifier),
+                day,
+                '%d' % clicks,
+                '%d' % impressions,
+                '%d' % cost,
+                '%d' % converted_clicks,
+                '%d' % conversions,
+                '%.2f' % value,
+                '%.2f' % ratio(position, impressions),
+                '%.2f%%' % ratio(clicks, impressions, 100),
+                '%d' % ratio(cost, clicks),
+                '%d' % ratio(cost, impressions, 1000),
+                '%.2f%%' % ratio(conversions, clicks, 100),
+                '%.2f%%' % ratio(converted_clicks, clicks, 100),
+                '%d' % ratio(cost, conversions),
+                '%d' % ratio(cost, converted_clicks),
+                '%.2f' % ratio(value, conversions),
+                '%.2f' % ratio(value, converted_clicks),
+            ])
+            yield data, getattr(entities, level)(row)
 
 
 def reportfile_file_upload_to(instance, filename):
@@ -1483,9 +2269,20 @@ def reportfile_file_upload_to(instance, filename):
                         filename)
 
 
+def report_definition_hash(report_definition, client_customer_id):
+    """
+    A canonical hash of the report definition requested for client_customer_id, identical
+    definitions hash the same regardless of the order of their keys.
+    """
+    canonical = json.dumps([client_customer_id, report_definition], sort_keys=True, separators=(',', ':'), default=six.text_type)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
 class ReportFile(models.Model):
     file = models.FileField(max_length=255, upload_to=reportfile_file_upload_to, null=True, blank=True)
     processed = models.BooleanField(default=False)
+    definition_hash = models.CharField(max_length=40, null=True, blank=True, db_index=True, editable=False,
+                                       help_text='Hash of the client customer id and report definition downloaded')
     created = models.DateTimeField(auto_now_add=True)
 
     objects = QuerySetManager()
@@ -1526,31 +2323,116 @@ class ReportFile(models.Model):
             for metric, value in r['report']['table']['row'].iteritems():
                 print metric, value
 
+            An identical report (the same report_definition and client_customer_id) downloaded
+            within GOOGLEADWORDS_REPORT_FILE_REUSE_TTL seconds is returned rather than downloaded
+            again, if it's being downloaded by another process that download is waited for.
+
             @param report_definition: A dict of values used to specify a report to get from the API.
             @param client_customer_id: A string containing the Adwords Customer Client ID.
             @return OrderedDict containing report
             """
+            ttl = settings.GOOGLEADWORDS_REPORT_FILE_REUSE_TTL
+            if not ttl:
+                return self.download(report_definition, client_customer_id)
+
+            definition_hash = report_definition_hash(report_definition, client_customer_id)
+            # Blocks while another process downloads the same report, the lease is renewed as the
+            # report is downloaded so it doesn't expire during a long download
+            lease = ImportLease('report-%s' % definition_hash, timeout=settings.GOOGLEADWORDS_LOCK_TIMEOUT)
+            lease.acquire()
+            try:
+                report_file = self.fresh(definition_hash, ttl)
+                if report_file is not None:
+                    logger.info("Reusing ReportFile '%s' for client customer id '%s'.", report_file.pk, client_customer_id)
+                    return report_file
+                return self.download(report_definition, client_customer_id, definition_hash=definition_hash, lease=lease)
+            finally:
+                lease.release()
+
+        def fresh(self, definition_hash, ttl):
+            """
+            The most recent ReportFile downloaded for definition_hash within ttl seconds, or None.
+            """
+            return self.filter(definition_hash=definition_hash,
+                               created__gte=timezone.now() - timedelta(seconds=ttl)) \
+                       .exclude(file='') \
+                       .exclude(file__isnull=True) \
+                       .order_by('-created') \
+                       .first()
+
+        def download(self, report_definition, client_customer_id, definition_hash=None, lease=None):
+            """
+            Download the report to a new ReportFile, see request for the arguments.
+
+            The report is copied to the file a chunk at a time, renewing lease (an ImportLease) if
+            it's given.
+            """
             client = adwords_service(client_customer_id)
             report_downloader = client.GetReportDownloader(version=settings.GOOGLEADWORDS_CLIENT_VERSION)
+            rate_limiter = api_rate_limiter()
+
+            seconds = rate_limiter.take()
+            if seconds:
+                raise ThrottledError(seconds)
 
             try:
-                report_file = ReportFile.objects.create()
-                with report_file.file_manager('%s.gz' % report_file.pk) as f:
-                    report_downloader.DownloadReport(report_definition, output=f)
+                report_file = ReportFile.objects.create(definition_hash=definition_hash)
+                response = report_downloader.DownloadReportAsStream(report_definition)
+                try:
+                    with report_file.file_manager('%s.gz' % report_file.pk) as f:
+                        for chunk in iter(lambda: response.read(64 * 1024), b''):
+                            f.write(chunk)
+                            if lease is not None:
+                                lease.renew()
+                finally:
+                    response.close()
                 return report_file
             except GoogleAdsError as e:
                 report_file.delete()  # cleanup
-                if not hasattr(e, 'fault') or not hasattr(e.fault, 'detail') or not hasattr(e.fault.detail, 'ApiExceptionFault') or not hasattr(e.fault.detail.ApiExceptionFault, 'errors'):
-                    # If they aren't telling us to retryAfterSeconds - raise
-                    raise
-                retryAfterSeconds = sum([int(fault.retryAfterSeconds) for fault in e.fault.detail.ApiExceptionFault.errors if getattr(fault, 'ApiError.Type') == 'RateExceededError'])
+                retryAfterSeconds = retry_after_seconds(e)
                 if retryAfterSeconds > 0:
-                    # We've hit a RateExceededError - raise
+                    # We've hit a RateExceededError - back off everywhere and raise
+                    rate_limiter.pause(retryAfterSeconds)
                     raise RateExceededError(retryAfterSeconds)
                 else:
                     # We haven't hit an error we care about, raise it.
                     raise
 
+        @contextmanager
+        def stream(self, report_definition, client_customer_id, tee=False):
+            """
+            Yields a ReportStream of the report as it's downloaded, see request for the arguments.
+
+            Rows are parsed as the compressed bytes arrive rather than after the report has been
+            written to disk. If tee is True the compressed report is also saved to a ReportFile.
+            """
+            client = adwords_service(client_customer_id)
+            report_downloader = client.GetReportDownloader(version=settings.GOOGLEADWORDS_CLIENT_VERSION)
+            rate_limiter = api_rate_limiter()
+
+            seconds = rate_limiter.take()
+            if seconds:
+                raise ThrottledError(seconds)
+
+            try:
+                response = report_downloader.DownloadReportAsStream(report_definition)
+            except GoogleAdsError as e:
+                retryAfterSeconds = retry_after_seconds(e)
+                if retryAfterSeconds > 0:
+                    rate_limiter.pause(retryAfterSeconds)
+                    raise RateExceededError(retryAfterSeconds)
+                raise
+
+            report_file = ReportFile.objects.create() if tee else None
+            try:
+                yield ReportStream(response, report_file)
+            except:
+                if report_file is not None:
+                    report_file.delete()  # cleanup
+                raise
+            finally:
+                response.close()
+
     @contextmanager
     def file_manager(self, filename):
         """
@@ -1587,25 +2469,209 @@ class ReportFile(models.Model):
         """
         self.file.save(os.path.basename(f.name), File(f))
 
+    @staticmethod
+    def parse(lines):
+        """
+        Yield each row of the report in lines as a ReportRecord.
+
+        The first line of a report is its name, the second its header and the last is the
+        report summary (totals) - only the rows between them are yielded.
+
+        :param lines: An iterable of the lines of the decompressed report.
+        """
+        reader = csv_reader(lines)
+        name = next(reader, None)
+        fields = next(reader, None)
+        if name is None or fields is None:
+            return
+
+        record_cls = ReportRecord.for_header(fields)
+        # The summary is detected by its position, hold each row back until the next is read
+        previous = None
+        for row in reader:
+            if previous is not None:
+                yield previous
+            previous = record_cls(row)
+
+    @staticmethod
+    def open_csv(path, mode='r'):
+        """
+        Open the gzipped CSV at path for the csv_reader or csv_writer.
+        """
+        if six.PY2:
+            # The UnicodeReader and UnicodeWriter encode the bytes themselves
+            return gzip.open(path, mode + 'b')
+        # The csv module needs untranslated newlines to read quoted fields that span lines
+        return io.TextIOWrapper(gzip.open(path, mode + 'b'), encoding='utf-8', newline='')
+
+    def iter_rows(self):
+        """
+        Yield each row in the report as a ReportRecord.
+        """
+        with self.open_csv(self.file.path) as csv_file:
+            for record in self.parse(csv_file):
+                yield record
+
+    def chunk_path(self, index):
+        """
+        The path of the chunk index of the report, see split.
+        """
+        root, ext = os.path.splitext(self.file.path)
+        return '%s-chunk%s%s' % (root, index, ext)
+
+    def split(self, count, batch_size):
+        """
+        Yield each row in the report as a ReportRecord, writing the rows to count chunk files as
+        they're read.
+
+        The rows are split into batches of batch_size and batch i is written to chunk i % count,
+        read a chunk with iter_chunk_rows.
+        """
+        chunk_files = [self.open_csv(self.chunk_path(index), 'w') for index in range(count)]
+        try:
+            writers = [csv_writer(chunk_file) for chunk_file in chunk_files]
+            fields = None
+            for position, rows in enumerate(chunked(self.iter_rows(), batch_size)):
+                if fields is None:
+                    fields = rows[0].fields
+                    for index, writer in enumerate(writers):
+                        writer.writerow([u'Chunk %s of %s' % (index + 1, count)])
+                        writer.writerow(fields)
+                writers[position % count].writerows(rows)
+                for row in rows:
+                    yield row
+            if fields is not None:
+                # parse drops the last row as the summary
+                for writer in writers:
+                    writer.writerow([u'Total'] + [u'--'] * (len(fields) - 1))
+        finally:
+            for chunk_file in chunk_files:
+                chunk_file.close()
+
+    def iter_chunk_rows(self, index):
+        """
+        Yield each row in the chunk index of the report as a ReportRecord, see split.
+        """
+        with self.open_csv(self.chunk_path(index)) as csv_file:
+            for record in self.parse(csv_file):
+                yield record
+
+    def delete_chunks(self):
+        """
+        Remove the chunk files split from the report that haven't been imported.
+        """
+        root, ext = os.path.splitext(self.file.path)
+        for path in glob.glob('%s-chunk*%s' % (root, ext)):
+            os.remove(path)
+
     def dehydrate(self):
         """
         Yield each row in the report as a dict.
         """
-        name = None
-        fields = None
-        with gzip.open(self.file.path, 'rt') as csv_file:
-            csv_reader = UnicodeReader(csv_file)
-            for row in csv_reader:
-                if name is None:
-                    name = row
-                elif fields is None:
-                    fields = row
-                # @hack - dirty but it will work for now!
-                elif row[0] != 'Total':
-                    yield dict(zip(fields, row))
+        for record in self.iter_rows():
+            yield ReportRow(record.fields, record)
+
+
+class ReportStream(object):
+    """
+    A report that's parsed as it's downloaded, see ReportFile.objects.stream.
+
+    Can be passed to the sync_* tasks in place of a ReportFile, the rows can only be iterated once.
+    """
+
+    def __init__(self, stream, report_file=None):
+        """
+        :param stream: A file like object of the gzipped report.
+        :param report_file: An optional ReportFile the gzipped report is saved to as it's read.
+        """
+        self.stream = stream
+        self.report_file = report_file
+
+    @property
+    def pk(self):
+        return self.report_file.pk if self.report_file is not None else None
+
+    def _iter_lines(self, tee=None):
+        for line in gunzip_lines(self.stream, tee=tee):
+            yield line if six.PY2 else line.decode('utf-8')
+
+    def iter_rows(self):
+        """
+        Yield each row in the report as a ReportRecord.
+        """
+        if self.report_file is None:
+            for record in ReportFile.parse(self._iter_lines()):
+                yield record
+        else:
+            with self.report_file.file_manager('%s.gz' % self.report_file.pk) as f:
+                for record in ReportFile.parse(self._iter_lines(tee=f)):
+                    yield record
+
+
+class ReportDescriptor(dict):
+    """
+    A JSON serializable reference to a ReportFile passed between tasks in place of the instance,
+    see GOOGLEADWORDS_LIGHT_TASKS.
+
+        {'type': 'report_file', 'pk': 1, 'path': '...', 'report_type': 'AD_PERFORMANCE_REPORT', 'date_range': ['20140501', '20140601']}
+    """
+    TYPE = 'report_file'
+
+    @classmethod
+    def for_report_file(cls, report_file):
+        """
+        Return the descriptor of report_file, the report type and date range are included if
+        the report definition it was downloaded with is known (see Account.create_report_file).
+        """
+        descriptor = getattr(report_file, 'descriptor', None)
+        if descriptor is not None:
+            return descriptor
+        descriptor = cls(type=cls.TYPE, pk=report_file.pk, path=report_file.file.name)
+        report_definition = getattr(report_file, 'report_definition', None)
+        if report_definition is not None:
+            date_range = report_definition.get('selector', {}).get('dateRange', {})
+            descriptor.update(report_type=report_definition.get('reportType'),
+                              date_range=[date_range.get('min'), date_range.get('max')])
+        return descriptor
+
+    @classmethod
+    def is_descriptor(cls, value):
+        return isinstance(value, dict) and value.get('type') == cls.TYPE
+
+    def report_file(self):
+        """
+        Return the ReportFile described, it's not retrieved from the database as only its file is read.
+        """
+        report_file = ReportFile(pk=self['pk'], file=self['path'])
+        report_file.descriptor = self
+        return report_file
+
+
+@shared_task(name='django_google_adwords.account_task', bind=True, serializer='json')
+def account_task(task, *args, **kwargs):
+    """
+    Run the task method named method of the Account with the primary key account, see Account.task_signature.
+
+    ReportFiles are passed in and returned as ReportDescriptors so the arguments and result can
+    be serialized as JSON.
+    """
+    account = Account.objects.get(pk=kwargs.pop('account'))
+    method = kwargs.pop('method')
+    args = [ReportDescriptor(arg).report_file() if ReportDescriptor.is_descriptor(arg) else arg for arg in args]
+    try:
+        result = getattr(account, method)(*args, **kwargs)
+    except (ThrottledError, LeaseBusyError) as exc:
+        # The task methods can only retry themselves when they're run by a worker
+        raise retry_throttled(task, exc)
+    except RateExceededError as exc:
+        raise task.retry(exc=exc, countdown=exc.retry_after_seconds)
+    if isinstance(result, ReportFile):
+        return ReportDescriptor.for_report_file(result)
+    return result
 
 
 def receiver_delete_reportfile(sender, instance, **kwargs):
     if instance.file:
+        instance.delete_chunks()
         instance.file.delete(save=False)
 post_delete.connect(receiver_delete_reportfile, ReportFile)
@@ -0,0 +1,113 @@
+from time import sleep, time
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    A token bucket shared by every process through the GOOGLEADWORDS_RATE_LIMIT_CACHE cache.
+
+    The bucket holds capacity tokens and is refilled every capacity / rate seconds, each API call
+    takes a token. Tokens are counted with the cache's atomic add and incr (one counter per
+    refill) so taking a token doesn't need a lock. When the API responds with a RateExceededError
+    the bucket is paused for retryAfterSeconds so every process backs off, not just the one that
+    was told to.
+    """
+
+    def __init__(self, name, rate, capacity):
+        self.key = '%s-ratelimit-%s' % (settings.GOOGLEADWORDS_LOCK_ID, name)
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.interval = self.capacity / self.rate
+
+    @property
+    def cache(self):
+        return caches[settings.GOOGLEADWORDS_RATE_LIMIT_CACHE]
+
+    def paused_key(self):
+        return '%s-paused' % self.key
+
+    def take(self, tokens=1):
+        """
+        Take tokens from the bucket if they're available.
+
+        :return: 0 if the tokens were taken, otherwise the number of seconds until they'll be available.
+        """
+        now = time()
+        paused_until = self.cache.get(self.paused_key())
+        if paused_until is not None and paused_until > now:
+            return paused_until - now + tokens / self.rate
+
+        refill = int(now / self.interval)
+        key = '%s-%s' % (self.key, refill)
+        # The counter outlives its interval so a slow incr doesn't recreate it
+        self.cache.add(key, 0, int(self.interval) + 2)
+        try:
+            taken = self.cache.incr(key, tokens)
+        except ValueError:
+            # Evicted between the add and incr
+            taken = tokens
+            self.cache.add(key, tokens, int(self.interval) + 2)
+        if taken <= self.capacity:
+            return 0
+        return (refill + 1) * self.interval - now
+
+    def wait(self, tokens=1):
+        """
+        Take tokens from the bucket, sleeping until they're available.
+        """
+        while True:
+            seconds = self.take(tokens)
+            if not seconds:
+                return
+            sleep(seconds)
+
+    def pause(self, seconds):
+        """
+        Stop the bucket handing out tokens for seconds, ie.. after a RateExceededError.
+        """
+        logger.info("Pausing '%s' for '%s' seconds due to 'RateExceededError'.", self.key, seconds)
+        paused_until = time() + seconds
+        # Concurrent pauses can race, the last wins which is close enough
+        if paused_until > (self.cache.get(self.paused_key()) or 0):
+            self.cache.set(self.paused_key(), paused_until, int(seconds) + 1)
+
+
+class UnlimitedBucket(object):
+    """
+    Stands in for a TokenBucket when GOOGLEADWORDS_RATE_LIMIT isn't set, it never runs out.
+
+    A pause (ie.. after a RateExceededError) is still honoured by the callers sharing the bucket,
+    so a retry waits out retryAfterSeconds rather than calling the API again at once.
+    """
+
+    def __init__(self):
+        self.paused_until = 0
+
+    def take(self, tokens=1):
+        return max(0, self.paused_until - time())
+
+    def wait(self, tokens=1):
+        seconds = self.take(tokens)
+        if seconds:
+            sleep(seconds)
+
+    def pause(self, seconds):
+        logger.info("Pausing for '%s' seconds due to 'RateExceededError'.", seconds)
+        self.paused_until = max(self.paused_until, time() + seconds)
+
+
+def api_rate_limiter():
+    """
+    Return the TokenBucket consulted before each API call (report download or service page), an
+    UnlimitedBucket unless GOOGLEADWORDS_RATE_LIMIT is set.
+    """
+    if not settings.GOOGLEADWORDS_RATE_LIMIT:
+        return UnlimitedBucket()
+    return TokenBucket('api', settings.GOOGLEADWORDS_RATE_LIMIT,
+                       settings.GOOGLEADWORDS_RATE_LIMIT_BURST or settings.GOOGLEADWORDS_RATE_LIMIT)
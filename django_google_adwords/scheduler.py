@@ -0,0 +1,74 @@
+from collections import OrderedDict
+import random
+
+from django.conf import settings
+
+from django_google_adwords.helper import chunked
+from django_google_adwords.models import Account
+
+
+# Each Account.sync argument, the field noting when it was last synced and the field recording the
+# rows its last sync imported
+LEVELS = OrderedDict([
+    ('sync_account', ('account_last_synced', 'account_report_rows')),
+    ('sync_campaign', ('campaign_last_synced', 'campaign_report_rows')),
+    ('sync_adgroup', ('ad_group_last_synced', 'ad_group_report_rows')),
+    ('sync_ad', ('ad_last_synced', 'ad_report_rows')),
+])
+
+
+def sync_levels(**kwargs):
+    """
+    Return the levels synced by Account.sync(**kwargs).
+    """
+    return [level for level in LEVELS if kwargs.get(level, level == 'sync_account')]
+
+
+def schedule(levels, window=None, jitter=None, batch_size=None):
+    """
+    Return the considered active accounts as a list of (countdown, account pks) batches to sync.
+
+    The most stale accounts (those never synced first) are scheduled first and, of those equally
+    stale, the biggest first so they don't hold up the end of the window. Batches are spread over
+    window seconds in proportion to the size of their accounts' reports (the rows imported by their
+    last sync) so the load is flat across it, each is delayed by up to jitter seconds more.
+
+    The batches are dispatched with a countdown of up to window + jitter seconds. Brokers that
+    redeliver unacknowledged messages after a visibility timeout (Redis, SQS) redeliver messages
+    with a longer countdown, so keep window + jitter below BROKER_TRANSPORT_OPTIONS['visibility_timeout']
+    (an hour by default), dispatch_sync logs a warning if it isn't.
+
+    :param levels: The levels being synced, see sync_levels.
+    :param window: Seconds to spread the syncs over, defaults to GOOGLEADWORDS_SCHEDULE_WINDOW.
+    :param jitter: Defaults to GOOGLEADWORDS_SCHEDULE_JITTER.
+    :param batch_size: Accounts per batch, defaults to GOOGLEADWORDS_SYNC_BATCH_SIZE.
+    """
+    window = settings.GOOGLEADWORDS_SCHEDULE_WINDOW if window is None else window
+    jitter = settings.GOOGLEADWORDS_SCHEDULE_JITTER if jitter is None else jitter
+    batch_size = batch_size or settings.GOOGLEADWORDS_SYNC_BATCH_SIZE
+
+    last_synced = [LEVELS[level][0] for level in levels]
+    report_rows = [LEVELS[level][1] for level in levels]
+    accounts = list(Account.objects.considered_active().values_list('pk', *(last_synced + report_rows)).iterator())
+
+    def weight(account):
+        # Accounts without any rows still take some time to sync
+        return sum(account[1 + len(levels):]) + 1
+
+    def stalest(account):
+        synced = account[1:1 + len(levels)]
+        never_synced = not synced or None in synced
+        return (not never_synced, None if never_synced else min(synced), -weight(account))
+
+    accounts.sort(key=stalest)
+    total = sum(weight(account) for account in accounts)
+
+    batches = []
+    elapsed = 0
+    for batch in chunked(accounts, batch_size):
+        countdown = float(window) * elapsed / total if window else 0
+        if jitter:
+            countdown += random.uniform(0, jitter)
+        batches.append((countdown, [account[0] for account in batch]))
+        elapsed += sum(weight(account) for account in batch)
+    return batches
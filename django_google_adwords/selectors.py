@@ -0,0 +1,170 @@
+"""
+The fields that can be requested in each report synced and the report column each is returned as.
+
+The fields actually requested are compiled from these by models.report_fields.
+"""
+from collections import OrderedDict
+
+
+REPORT_FIELDS = OrderedDict([
+    ('ACCOUNT_PERFORMANCE_REPORT', OrderedDict([
+        ('AccountCurrencyCode', 'Currency'),
+        ('AccountDescriptiveName', 'Account'),
+        ('AverageCpc', 'Avg. CPC'),
+        ('AverageCpm', 'Avg. CPM'),
+        ('AveragePosition', 'Avg. position'),
+        ('Clicks', 'Clicks'),
+        ('ContentBudgetLostImpressionShare', 'Content Lost IS (budget)'),
+        ('ContentImpressionShare', 'Content Impr. share'),
+        ('ContentRankLostImpressionShare', 'Content Lost IS (rank)'),
+        ('ClickConversionRate', 'Click conversion rate'),
+        ('ConversionRateManyPerClick', 'Conv. rate'),
+        ('ConversionValue', 'Total conv. value'),
+        ('ConvertedClicks', 'Converted clicks'),
+        ('ConversionsManyPerClick', 'Conversions'),
+        ('Cost', 'Cost'),
+        ('CostPerConvertedClick', 'Cost / converted click'),
+        ('CostPerConversionManyPerClick', 'Cost / conv.'),
+        ('CostPerEstimatedTotalConversion', 'Cost / est. total conv.'),
+        ('Ctr', 'CTR'),
+        ('Device', 'Device'),
+        ('EstimatedCrossDeviceConversions', 'Est. cross-device conv.'),
+        ('EstimatedTotalConversionRate', 'Est. total conv. rate'),
+        ('EstimatedTotalConversionValue', 'Est. total conv. value'),
+        ('EstimatedTotalConversionValuePerClick', 'Est. total conv. value / click'),
+        ('EstimatedTotalConversionValuePerCost', 'Est. total conv. value / cost'),
+        ('EstimatedTotalConversions', 'Est. total conv.'),
+        ('Impressions', 'Impressions'),
+        ('InvalidClickRate', 'Invalid click rate'),
+        ('InvalidClicks', 'Invalid clicks'),
+        ('SearchBudgetLostImpressionShare', 'Search Lost IS (budget)'),
+        ('SearchExactMatchImpressionShare', 'Search Exact match IS'),
+        ('SearchImpressionShare', 'Search Impr. share'),
+        ('SearchRankLostImpressionShare', 'Search Lost IS (rank)'),
+        ('Date', 'Day'),
+    ])),
+    ('CAMPAIGN_PERFORMANCE_REPORT', OrderedDict([
+        ('AccountCurrencyCode', 'Currency'),
+        ('AccountDescriptiveName', 'Account'),
+        ('Amount', 'Budget'),
+        ('AverageCpc', 'Avg. CPC'),
+        ('AverageCpm', 'Avg. CPM'),
+        ('AveragePosition', 'Avg. position'),
+        ('BiddingStrategyId', 'Bid Strategy ID'),
+        ('BiddingStrategyName', 'Bid Strategy Name'),
+        ('BiddingStrategyType', 'Bid Strategy Type'),
+        ('CampaignId', 'Campaign ID'),
+        ('CampaignName', 'Campaign'),
+        ('CampaignStatus', 'Campaign state'),
+        ('Clicks', 'Clicks'),
+        ('ContentBudgetLostImpressionShare', 'Content Lost IS (budget)'),
+        ('ContentImpressionShare', 'Content Impr. share'),
+        ('ContentRankLostImpressionShare', 'Content Lost IS (rank)'),
+        ('ClickConversionRate', 'Click conversion rate'),
+        ('ConversionRateManyPerClick', 'Conv. rate'),
+        ('ConversionValue', 'Total conv. value'),
+        ('ConvertedClicks', 'Converted clicks'),
+        ('ConversionsManyPerClick', 'Conversions'),
+        ('Cost', 'Cost'),
+        ('CostPerConvertedClick', 'Cost / converted click'),
+        ('CostPerConversionManyPerClick', 'Cost / conv.'),
+        ('CostPerEstimatedTotalConversion', 'Cost / est. total conv.'),
+        ('Ctr', 'CTR'),
+        ('EstimatedCrossDeviceConversions', 'Est. cross-device conv.'),
+        ('EstimatedTotalConversionRate', 'Est. total conv. rate'),
+        ('EstimatedTotalConversions', 'Est. total conv.'),
+        ('EstimatedTotalConversionValue', 'Est. total conv. value'),
+        ('EstimatedTotalConversionValuePerClick', 'Est. total conv. value / click'),
+        ('EstimatedTotalConversionValuePerCost', 'Est. total conv. value / cost'),
+        ('Impressions', 'Impressions'),
+        ('InvalidClickRate', 'Invalid click rate'),
+        ('InvalidClicks', 'Invalid clicks'),
+        ('SearchBudgetLostImpressionShare', 'Search Lost IS (budget)'),
+        ('SearchExactMatchImpressionShare', 'Search Exact match IS'),
+        ('SearchImpressionShare', 'Search Impr. share'),
+        ('SearchRankLostImpressionShare', 'Search Lost IS (rank)'),
+        ('Date', 'Day'),
+    ])),
+    ('ADGROUP_PERFORMANCE_REPORT', OrderedDict([
+        ('AccountCurrencyCode', 'Currency'),
+        ('AccountDescriptiveName', 'Account'),
+        ('AdGroupId', 'Ad group ID'),
+        ('AdGroupName', 'Ad group'),
+        ('AdGroupStatus', 'Ad group state'),
+        ('CampaignId', 'Campaign ID'),
+        ('CampaignName', 'Campaign'),
+        ('CampaignStatus', 'Campaign state'),
+        ('TargetCpa', 'Max. CPA (converted clicks)'),
+        ('ValuePerEstimatedTotalConversion', 'Value / est. total conv.'),
+        ('BiddingStrategyId', 'Bid Strategy ID'),
+        ('BiddingStrategyName', 'Bid Strategy Name'),
+        ('BiddingStrategyType', 'Bid Strategy Type'),
+        ('ContentImpressionShare', 'Content Impr. share'),
+        ('ContentRankLostImpressionShare', 'Content Lost IS (rank)'),
+        ('CostPerEstimatedTotalConversion', 'Cost / est. total conv.'),
+        ('EstimatedCrossDeviceConversions', 'Est. cross-device conv.'),
+        ('EstimatedTotalConversionRate', 'Est. total conv. rate'),
+        ('EstimatedTotalConversionValue', 'Est. total conv. value'),
+        ('EstimatedTotalConversionValuePerClick', 'Est. total conv. value / click'),
+        ('EstimatedTotalConversionValuePerCost', 'Est. total conv. value / cost'),
+        ('EstimatedTotalConversions', 'Est. total conv.'),
+        ('SearchExactMatchImpressionShare', 'Search Exact match IS'),
+        ('SearchImpressionShare', 'Search Impr. share'),
+        ('SearchRankLostImpressionShare', 'Search Lost IS (rank)'),
+        ('ValuePerConvertedClick', 'Value / converted click'),
+        ('ValuePerConversionManyPerClick', 'Value / conv.'),
+        ('ViewThroughConversions', 'View-through conv.'),
+        ('AverageCpc', 'Avg. CPC'),
+        ('AverageCpm', 'Avg. CPM'),
+        ('AveragePosition', 'Avg. position'),
+        ('Clicks', 'Clicks'),
+        ('ClickConversionRate', 'Click conversion rate'),
+        ('ConversionRateManyPerClick', 'Conv. rate'),
+        ('ConversionValue', 'Total conv. value'),
+        ('ConvertedClicks', 'Converted clicks'),
+        ('ConversionsManyPerClick', 'Conversions'),
+        ('Cost', 'Cost'),
+        ('CostPerConvertedClick', 'Cost / converted click'),
+        ('CostPerConversionManyPerClick', 'Cost / conv.'),
+        ('Ctr', 'CTR'),
+        ('Impressions', 'Impressions'),
+        ('Date', 'Day'),
+    ])),
+    ('AD_PERFORMANCE_REPORT', OrderedDict([
+        ('AccountCurrencyCode', 'Currency'),
+        ('AccountDescriptiveName', 'Account'),
+        ('AdGroupId', 'Ad group ID'),
+        ('AdGroupName', 'Ad group'),
+        ('AdGroupStatus', 'Ad group state'),
+        ('AdType', 'Ad type'),
+        ('AverageCpc', 'Avg. CPC'),
+        ('AverageCpm', 'Avg. CPM'),
+        ('AveragePosition', 'Avg. position'),
+        ('CampaignId', 'Campaign ID'),
+        ('CampaignName', 'Campaign'),
+        ('CampaignStatus', 'Campaign state'),
+        ('Clicks', 'Clicks'),
+        ('ClickConversionRate', 'Click conversion rate'),
+        ('ConversionRateManyPerClick', 'Conv. rate'),
+        ('ConversionValue', 'Total conv. value'),
+        ('ConvertedClicks', 'Converted clicks'),
+        ('ConversionsManyPerClick', 'Conversions'),
+        ('Cost', 'Cost'),
+        ('CostPerConvertedClick', 'Cost / converted click'),
+        ('CostPerConversionManyPerClick', 'Cost / conv.'),
+        ('CreativeApprovalStatus', 'Ad Approval Status'),
+        ('CreativeDestinationUrl', 'Destination URL'),
+        ('Ctr', 'CTR'),
+        ('Description1', 'Description line 1'),
+        ('Description2', 'Description line 2'),
+        ('DisplayUrl', 'Display URL'),
+        ('Headline', 'Ad'),
+        ('Id', 'Ad ID'),
+        ('Impressions', 'Impressions'),
+        ('Status', 'Ad state'),
+        ('ValuePerConvertedClick', 'Value / converted click'),
+        ('ValuePerConversionManyPerClick', 'Value / conv.'),
+        ('ViewThroughConversions', 'View-through conv.'),
+        ('Date', 'Day'),
+    ])),
+])
@@ -13,13 +13,36 @@ class GoogleAdwordsConf(AppConf):
     SYNC_CAMPAIGN = False
     SYNC_ADGROUP = False
     SYNC_AD = False
+    # Number of accounts each task dispatched by the sync_* tasks syncs
+    SYNC_BATCH_SIZE = 100
+    # Seconds the sync_* tasks spread the account syncs over (0 to start them all at once) and the
+    # random delay added to each batch. Together they should be less than the broker's
+    # visibility_timeout (Redis and SQS redeliver messages delayed beyond it), see scheduler.schedule
+    SCHEDULE_WINDOW = 0
+    SCHEDULE_JITTER = 0
 
     # Defaults - probably don't need to be changed
     CLIENT_VERSION = 'v201506'
     USER_AGENT = 'django-google-adwords'
+    CLIENT_POOL_TTL = 60 * 60  # 1 hour, how long AdWordsClients are reused within a process
+    TOKEN_REFRESH_MARGIN = 10 * 60  # 10 minutes, access tokens expiring sooner are refreshed up front
+    # The cache access tokens are shared through and how long one process may hold the lock to refresh them
+    TOKEN_CACHE = 'default'
+    TOKEN_REFRESH_LOCK_TIMEOUT = 60
     LOCK_TIMEOUT = 10 * 60  # 10 minutes
     LOCK_ID = "googleadwords-lock"
     LOCK_WAIT = 1
+    # Lock each Account, Campaign, AdGroup, Ad and Daily*Metrics row when it's populated -
+    # the sync_* tasks instead hold one lease per account and report for the whole import
+    ROW_LOCKS = True
+    IMPORT_LEASE_TIMEOUT = 5 * 60  # 5 minutes, renewed as the import progresses
+    # Seconds before an import whose lease is held by another import is retried
+    IMPORT_LEASE_RETRY = 30
+    # Backend holding locks and leases, one of CacheLockBackend, RedisLockBackend,
+    # PostgresAdvisoryLockBackend or LocalLockBackend (single process, for tests)
+    LOCK_BACKEND = 'django_google_adwords.lock.CacheLockBackend'
+    LOCK_REDIS_URL = 'redis://localhost:6379/0'
+    LOCK_DATABASE = 'default'
 
     # Days ago to start syncing the data from
     NEW_ACCOUNT_ACCOUNT_SYNC_DAYS = 150
@@ -27,18 +50,66 @@ class GoogleAdwordsConf(AppConf):
     NEW_ACCOUNT_ADGROUP_SYNC_DAYS = 31
     NEW_ACCOUNT_AD_SYNC_DAYS = 5
 
+    # Split the first sync of each report into windows of this many days imported in parallel (None to disable)
+    BACKFILL_WINDOW_DAYS = None
+
+    # Roll the campaign and ad group metrics up from the ad data report when they're synced with
+    # the ads. Only the additive columns and the ratios between them are derived, the rest (ie..
+    # impression share, bid strategy) are downloaded in a campaign or ad group report of just those.
+    DERIVE_METRICS = False
+
+    # API fields (by report type, ie.. 'CAMPAIGN_PERFORMANCE_REPORT') to request in addition to those
+    # the models store, or not to request, see django_google_adwords.selectors
+    SELECTOR_INCLUDE = {}
+    SELECTOR_EXCLUDE = {}
+
     EXISTING_ACCOUNT_SYNC_DAYS = 3
     EXISTING_CAMPAIGN_SYNC_DAYS = 3
     EXISTING_ADGROUP_SYNC_DAYS = 3
     EXISTING_AD_SYNC_DAYS = 3
 
+    # Number of report rows written to the Daily*Metrics tables per batch
+    IMPORT_BATCH_SIZE = 1000
+    # How batches are written to the Daily*Metrics tables, either 'orm' or 'copy' which
+    # uses COPY FROM STDIN on PostgreSQL (other databases fall back to 'orm')
+    IMPORT_BACKEND = 'orm'
+    # Number of tasks the ad data report import is split across, when greater than 1 the
+    # chunks are imported in parallel (as a chord) once the ads have been populated. The ad
+    # data report is then downloaded in one piece to a ReportFile that's split into a file per
+    # chunk, so BACKFILL_WINDOW_DAYS and STREAM_REPORTS don't apply to it
+    IMPORT_CHUNKS = 1
+
+    # Import reports as they're downloaded rather than from a ReportFile written to disk first,
+    # STREAM_TEE also saves the compressed report to a ReportFile (ie.. for auditing)
+    STREAM_REPORTS = False
+    STREAM_TEE = False
+
+    # Proactive limit on API calls (report downloads and service pages) across every process,
+    # calls per second (None for no limit) and the burst allowed (defaults to the rate)
+    RATE_LIMIT = None
+    RATE_LIMIT_BURST = None
+    RATE_LIMIT_CACHE = 'default'
+
+    # Concurrent googleads calls per event loop made by the asyncio API (django_google_adwords.aio)
+    ASYNC_CONCURRENCY = 50
+
+    # Sync with account_task, which passes primary keys and ReportDescriptors serialized as JSON,
+    # rather than the Account task methods which pass the instances with django-cereal's pickle
+    LIGHT_TASKS = False
+
     REPORT_FILE_ROOT = 'googleadwords-reportfile'
+    # Seconds an identical report download is reused for rather than downloaded again (0 disables
+    # reuse). Downloads of the same report are then serialized by a lease that expires after
+    # GOOGLEADWORDS_LOCK_TIMEOUT seconds unless renewed, which it is as the report is downloaded.
+    REPORT_FILE_REUSE_TTL = 0
     REPORT_RETRIEVAL_CELERY_QUEUE = 'celery'
     DATA_IMPORT_CELERY_QUEUE = 'celery'
     HOUSEKEEPING_CELERY_QUEUE = 'celery'
 
     CELERY_TIMELIMIT = 60 * 60 * 3  # 3 HOURS
     CELERY_SOFTTIMELIMIT = CELERY_TIMELIMIT
+    # Seconds before the claim of a sync that didn't finish (ie.. failed) expires
+    SYNC_CLAIM_TIMEOUT = CELERY_TIMELIMIT
 
     class Meta:
         prefix = 'GOOGLEADWORDS'
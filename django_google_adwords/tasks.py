@@ -1,14 +1,51 @@
 from __future__ import absolute_import
+import logging
+
 from django.conf import settings
 from django_google_adwords.models import Account, Alert
+from django_google_adwords.scheduler import schedule, sync_levels
 from celery.app import shared_task
-from celery.canvas import chain
+from celery.canvas import chain, group
+
+
+logger = logging.getLogger(__name__)
+
+
+def dispatch_sync(**kwargs):
+    """
+    Fan the sync of every considered active account out to sync_account_batch tasks of
+    GOOGLEADWORDS_SYNC_BATCH_SIZE accounts, kwargs are passed on to Account.sync.
+
+    The batches are ordered and spread over GOOGLEADWORDS_SCHEDULE_WINDOW seconds by
+    scheduler.schedule. Only the primary keys (and when they were last synced) are read so
+    dispatching is quick however many accounts there are.
+    """
+    visibility_timeout = getattr(settings, 'BROKER_TRANSPORT_OPTIONS', {}).get('visibility_timeout')
+    spread = settings.GOOGLEADWORDS_SCHEDULE_WINDOW + settings.GOOGLEADWORDS_SCHEDULE_JITTER
+    if visibility_timeout and spread > visibility_timeout:
+        logger.warning("The sync schedule spans '%s' seconds which exceeds the broker's visibility_timeout "
+                       "('%s' seconds), batches scheduled after it may be delivered more than once.", spread, visibility_timeout)
+
+    batches = [sync_account_batch.si(pks, **kwargs).set(countdown=countdown)
+               for countdown, pks in schedule(sync_levels(**kwargs))]
+    if batches:
+        group(batches).apply_async()
+
+
+@shared_task(queue=settings.GOOGLEADWORDS_HOUSEKEEPING_CELERY_QUEUE)
+def sync_account_batch(account_pks, **kwargs):
+    """
+    Sync the accounts in account_pks in that order (the order they were scheduled in).
+    """
+    accounts = Account.objects.considered_active().in_bulk(account_pks)
+    for pk in account_pks:
+        if pk in accounts:
+            accounts[pk].sync(**kwargs)
 
 
 @shared_task(queue=settings.GOOGLEADWORDS_HOUSEKEEPING_CELERY_QUEUE)
 def sync_all():
-    for account in Account.objects.considered_active():
-        account.sync(sync_account=True, sync_campaign=True, sync_adgroup=True, sync_ad=True)
+    dispatch_sync(sync_account=True, sync_campaign=True, sync_adgroup=True, sync_ad=True)
 
 
 @shared_task(queue=settings.GOOGLEADWORDS_HOUSEKEEPING_CELERY_QUEUE)
@@ -28,23 +65,19 @@ def sync_chain():
 
 @shared_task(queue=settings.GOOGLEADWORDS_HOUSEKEEPING_CELERY_QUEUE)
 def sync_accounts():
-    for account in Account.objects.considered_active():
-        account.sync(sync_account=True, sync_campaign=False, sync_adgroup=False, sync_ad=False)
+    dispatch_sync(sync_account=True, sync_campaign=False, sync_adgroup=False, sync_ad=False)
 
 
 @shared_task(queue=settings.GOOGLEADWORDS_HOUSEKEEPING_CELERY_QUEUE)
 def sync_campaigns():
-    for account in Account.objects.considered_active():
-        account.sync(sync_account=False, sync_campaign=True, sync_adgroup=False, sync_ad=False)
+    dispatch_sync(sync_account=False, sync_campaign=True, sync_adgroup=False, sync_ad=False)
 
 
 @shared_task(queue=settings.GOOGLEADWORDS_HOUSEKEEPING_CELERY_QUEUE)
 def sync_adgroups():
-    for account in Account.objects.considered_active():
-        account.sync(sync_account=False, sync_campaign=False, sync_adgroup=True, sync_ad=False)
+    dispatch_sync(sync_account=False, sync_campaign=False, sync_adgroup=True, sync_ad=False)
 
 
 @shared_task(queue=settings.GOOGLEADWORDS_HOUSEKEEPING_CELERY_QUEUE)
 def sync_ads():
-    for account in Account.objects.considered_active():
-        account.sync(sync_account=False, sync_campaign=False, sync_adgroup=False, sync_ad=True)
+    dispatch_sync(sync_account=False, sync_campaign=False, sync_adgroup=False, sync_ad=True)
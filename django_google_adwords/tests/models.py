@@ -1,13 +1,40 @@
 from __future__ import absolute_import
 
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from functools import reduce
+import gzip
+import json
+import operator
 import os
-
-from django_google_adwords.models import ReportFile, Account, Campaign, AdGroup, \
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from django_google_adwords.errors import LeaseBusyError, LeaseLostError, PagedRequestCheckpoint, RateExceededError, ThrottledError
+from django_google_adwords.helper import ClientPool, SharedRefreshTokenClient, date_windows, delete_duplicates, \
+    gunzip_lines, paged_request, refresh_access_token
+from django_google_adwords.lock import ImportLease, ImportLeases, googleadwords_lock, get_googleadwords_lock_id, get_lock_backend
+from django_google_adwords.loaders import PostgresCopyLoader, NULL
+from django_google_adwords.ratelimit import TokenBucket, api_rate_limiter
+from django_google_adwords.scheduler import schedule, sync_levels
+from django_google_adwords.tasks import dispatch_sync, sync_account_batch
+from django_google_adwords import helper, models as adwords_models
+from django_google_adwords.models import ReportFile, ReportDescriptor, ReportStream, account_task, report_definition_hash, report_fields, Account, Campaign, AdGroup, SyncIdentityMap, RowPlan, ReportRecord, ReportRow, \
     DailyAccountMetrics, DailyCampaignMetrics, DailyAdGroupMetrics, Ad, \
     DailyAdMetrics
 from django.test.testcases import TestCase, TransactionTestCase
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Sum
+from celery.canvas import Signature, chain, chord, group
+from celery.result import AsyncResult
+from django.test.utils import override_settings
+from googleads.errors import GoogleAdsError
+from unittest import skipIf
 
 
 def _get_test_media_file_path(name):
@@ -20,6 +47,17 @@ def _get_report_file(name):
     return report_file
 
 
+def _leaves(signature):
+    """
+    The task signatures of a canvas.
+    """
+    if isinstance(signature, (chain, group)):
+        return sum([_leaves(task) for task in signature.tasks], [])
+    if isinstance(signature, chord):
+        return sum([_leaves(task) for task in signature.tasks], _leaves(signature.body))
+    return [signature]
+
+
 class DjangoGoogleAdwordsTestCase(TransactionTestCase):
     fixtures = [
         'django_google_adwords.yaml'
@@ -616,3 +654,1008 @@ class DjangoGoogleAdwordsTestCase(TransactionTestCase):
         account.save()
         self.assertEqual(account.created, created)
         self.assertNotEqual(account.updated, updated)
+
+    def test_daily_account_metrics_populate_many(self):
+        report_file = _get_report_file('account_report.gz')
+        account = Account.objects.get(pk=1)
+        rows = [(row, account) for row in report_file.dehydrate()]
+
+        created, updated, skipped = DailyAccountMetrics.objects.populate_many(rows)
+        self.assertEqual(created, 30)
+        self.assertEqual(updated, 0)
+        self.assertEqual(DailyAccountMetrics.objects.filter(account=account).count(), 30)
+
+        # Populating the same rows again (including repeated keys) must not duplicate them
+        created, updated, skipped = DailyAccountMetrics.objects.populate_many(rows + rows)
+        self.assertEqual(created, 0)
+        self.assertEqual(DailyAccountMetrics.objects.filter(account=account).count(), 30)
+
+        account_metric = DailyAccountMetrics.objects.get(account=account, device=DailyAccountMetrics.DEVICE_DESKTOP, day=date(2014, 7, 28))
+        self.assertEqual(account_metric.cost.amount, Decimal('9.57'))
+        self.assertEqual(account_metric.clicks, 5)
+
+        # Existing rows are looked up by their whole natural key, not the cross product of the keys' values
+        keys = [dict(device=DailyAccountMetrics.DEVICE_DESKTOP, day='2014-07-28', account=account),
+                dict(device=DailyAccountMetrics.DEVICE_TABLET, day=date(2014, 7, 29), account=account)]
+        lookups = DailyAccountMetrics.objects.all()._natural_key_lookups(sorted(keys[0]), keys)
+        matched = DailyAccountMetrics.objects.filter(reduce(operator.or_, lookups))
+        self.assertEqual(sorted(matched.values_list('device', 'day')),
+                         [(DailyAccountMetrics.DEVICE_DESKTOP, date(2014, 7, 28)), (DailyAccountMetrics.DEVICE_TABLET, date(2014, 7, 29))])
+
+    @override_settings(GOOGLEADWORDS_IMPORT_BACKEND='orm')
+    def test_daily_account_metrics_fingerprint(self):
+        report_file = _get_report_file('account_report.gz')
+        account = Account.objects.get(pk=1)
+        records = list(report_file.iter_rows())
+        rows = [(record, account) for record in records]
+        DailyAccountMetrics.objects.populate_many(rows)
+
+        # Records and dicts of the same row share a fingerprint
+        plan = DailyAccountMetrics.objects.row_plan(records[0], ['account', 'account_id'])
+        self.assertEqual(plan.fingerprint(records[0]), plan.fingerprint(ReportRow(records[0].fields, records[0])))
+        self.assertEqual(DailyAccountMetrics.objects.filter(fingerprint=plan.fingerprint(records[0])).count(), 1)
+
+        # Unchanged rows are neither loaded nor written
+        with self.assertNumQueries(1):
+            self.assertEqual(DailyAccountMetrics.objects.populate_many(rows), (0, 0, 30))
+
+        changed = list(records[0])
+        changed[records[0].index['Clicks']] = '500'
+        rows[0] = (records[0].__class__(changed), account)
+        self.assertEqual(DailyAccountMetrics.objects.populate_many(rows), (0, 1, 29))
+        account_metric = DailyAccountMetrics.objects.get(account=account, device=records[0].get('Device'), day=records[0].get('Day'))
+        self.assertEqual(account_metric.clicks, 500)
+
+    def test_sync_identity_map(self):
+        report_file = _get_report_file('ad_report.gz')
+        account = Account.objects.get(pk=1)
+        rows = list(report_file.dehydrate())
+        entities = SyncIdentityMap(account)
+
+        ad = entities.ad(rows[0])
+        self.assertEqual(ad.ad_id, int(rows[0]['Ad ID']))
+        self.assertEqual(ad.ad_group.campaign.account, account)
+
+        # Rows for entities already seen are resolved without hitting the database
+        repeated = [row for row in rows[1:] if row['Campaign ID'] == rows[0]['Campaign ID']]
+        self.assertTrue(repeated)
+        with self.assertNumQueries(0):
+            self.assertIs(entities.ad(rows[0]), ad)
+            self.assertIs(entities.ad_group(rows[0]), ad.ad_group)
+            self.assertIs(entities.campaign(repeated[0]), ad.ad_group.campaign)
+
+        # An entity whose attributes differ between days gets those of its most recent day
+        first, second = dict(rows[0]), dict(rows[0])
+        first.update({'Day': '2014-05-02', 'Campaign': 'Winter sale', 'Ad group': 'Boots'})
+        second.update({'Day': '2014-05-03', 'Campaign': 'Spring sale', 'Ad group': 'Sandals'})
+        for order in ([first, second], [second, first]):
+            entities = SyncIdentityMap(account)
+            for row in order:
+                entities.ad(row)
+            campaign = Campaign.objects.get(campaign_id=int(rows[0]['Campaign ID']))
+            self.assertEqual(campaign.campaign, 'Spring sale')
+            self.assertEqual(entities.campaign(second).campaign, 'Spring sale')
+            self.assertEqual(AdGroup.objects.get(pk=ad.ad_group.pk).ad_group, 'Sandals')
+
+    @override_settings(GOOGLEADWORDS_IMPORT_BATCH_SIZE=5)
+    def test_import_ad_chunks(self):
+        report_file = _get_report_file('ad_report.gz')
+        account = Account.objects.get(pk=1)
+        number_rows = len(list(report_file.iter_rows()))
+
+        self.assertEqual(account.prepare_ad_sync(report_file=report_file, chunks=3), report_file)
+        self.assertEqual(Ad.objects.filter(ad_group__campaign__account=account).count(), 44)
+        self.assertEqual(DailyAdMetrics.objects.count(), 0)
+
+        # The report is split once, each chunk has every third batch of rows
+        records = list(report_file.iter_rows())
+        for index in range(3):
+            batches = [records[start:start + 5] for start in range(index * 5, len(records), 15)]
+            self.assertEqual(list(report_file.iter_chunk_rows(index)), sum(batches, []))
+
+        # The ads are resolved up front so chunks only query for them once
+        entities = SyncIdentityMap(account).load_ads()
+        with self.assertNumQueries(0):
+            for row in report_file.iter_rows():
+                entities.ad(row)
+
+        for index in range(3):
+            account.import_ad_chunk(report_file, index, 3)
+        self.assertEqual(DailyAdMetrics.objects.count(), number_rows)
+        # Each chunk's file is removed once it's imported
+        self.assertFalse([index for index in range(3) if os.path.exists(report_file.chunk_path(index))])
+
+        # and any that weren't are removed with the report
+        list(report_file.split(2, 5))
+        chunk_path = report_file.chunk_path(1)
+        self.assertTrue(os.path.exists(chunk_path))
+        report_file.delete()
+        self.assertFalse(os.path.exists(chunk_path))
+
+    def test_derive_metrics(self):
+        report_file = _get_report_file('ad_report.gz')
+        account = Account.objects.get(pk=1)
+        account.sync_ad(report_file=report_file, derive=['campaign', 'ad_group'])
+
+        # Each day of each ad group and campaign is the sum of its ads
+        for level, metrics_cls in (('ad_group', DailyAdGroupMetrics), ('campaign', DailyCampaignMetrics)):
+            ad_metrics = DailyAdMetrics.objects.filter(ad__ad_group__campaign__account=account)
+            lookup = 'ad__ad_group' if level == 'ad_group' else 'ad__ad_group__campaign'
+            totals = ad_metrics.values(lookup, 'day').annotate(Sum('clicks'), Sum('impressions'), Sum('cost'))
+            self.assertEqual(metrics_cls.objects.count(), len(totals))
+            for total in totals:
+                metrics = metrics_cls.objects.get(day=total['day'], **{level: total[lookup]})
+                self.assertEqual(metrics.clicks, total['clicks__sum'])
+                self.assertEqual(metrics.impressions, total['impressions__sum'])
+                self.assertEqual(metrics.cost.amount, total['cost__sum'])
+                if metrics.clicks:
+                    self.assertEqual(metrics.avg_cpc.amount, (metrics.cost.amount / metrics.clicks).quantize(Decimal('0.01')))
+                    self.assertEqual(metrics.ctr, (Decimal(metrics.clicks) * 100 / metrics.impressions).quantize(Decimal('0.01')))
+
+        # Columns that can't be derived are left alone
+        self.assertFalse(DailyCampaignMetrics.objects.exclude(search_impr_share=None).exists())
+
+        # and are downloaded in a report of just those, which is merged with the derived rows
+        fields = Campaign.get_selector(derived=True)['selector']['fields']
+        self.assertIn('SearchImpressionShare', fields)
+        self.assertIn('BiddingStrategyType', fields)
+        self.assertNotIn('Clicks', fields)
+        self.assertNotIn('AverageCpc', fields)
+        self.assertNotIn('Ctr', AdGroup.get_selector(derived=True)['selector']['fields'])
+
+        derived = DailyCampaignMetrics.objects.select_related('campaign')[0]
+        record_cls = ReportRecord.for_header(['Currency', 'Campaign ID', 'Day', 'Search Impr. share'])
+        record = record_cls(['AUD', str(derived.campaign.campaign_id), derived.day.isoformat(), '45.50%'])
+        DailyCampaignMetrics.objects.populate_many([(record, derived.campaign)])
+        merged = DailyCampaignMetrics.objects.get(pk=derived.pk)
+        self.assertEqual(merged.search_impr_share, Decimal('45.50'))
+        self.assertEqual((merged.clicks, merged.impressions, merged.cost), (derived.clicks, derived.impressions, derived.cost))
+
+        # Each source keeps its own fingerprint, so neither undoes the other's skipping
+        self.assertEqual(merged.derived_fingerprint, derived.derived_fingerprint)
+        self.assertNotEqual(merged.fingerprint, merged.derived_fingerprint)
+        self.assertEqual(DailyCampaignMetrics.objects.populate_many([(record, derived.campaign)]), (0, 0, 1))
+        report_file = _get_report_file('ad_report.gz')
+        account.sync_ad(report_file=report_file, derive=['campaign', 'ad_group'])
+        self.assertEqual(DailyCampaignMetrics.objects.get(pk=derived.pk).fingerprint, merged.fingerprint)
+        self.assertEqual(DailyCampaignMetrics.objects.populate_many([(record, derived.campaign)]), (0, 0, 1))
+
+        dispatched = []
+        originals = [(cls, cls.apply_async) for cls in (Signature, chain, chord)]
+        for cls, apply_async in originals:
+            cls.apply_async = lambda self, *args, **kwargs: dispatched.append(self) or AsyncResult('dispatched')
+        try:
+            with override_settings(GOOGLEADWORDS_DERIVE_METRICS=True):
+                Account.objects.get(pk=1).sync(sync_account=False, sync_campaign=True, sync_ad=True)
+        finally:
+            for cls, apply_async in originals:
+                cls.apply_async = apply_async
+        reports = [signature.args[0]['reportType'] for signature in _leaves(dispatched[0]) if signature.task == 'Account.create_report_file']
+        self.assertEqual(sorted(reports), ['AD_PERFORMANCE_REPORT', 'CAMPAIGN_PERFORMANCE_REPORT'])
+
+    def test_report_fields(self):
+        fields = Campaign.get_selector()['selector']['fields']
+        self.assertEqual(len(fields), len(set(fields)))
+        self.assertIn('CampaignId', fields)
+        self.assertIn('SearchImpressionShare', fields)
+        # Fields whose column doesn't populate a model field aren't requested
+        self.assertNotIn('EstimatedCrossDeviceConversions', fields)
+
+        with override_settings(GOOGLEADWORDS_SELECTOR_INCLUDE={'CAMPAIGN_PERFORMANCE_REPORT': ['Labels', 'Clicks']},
+                               GOOGLEADWORDS_SELECTOR_EXCLUDE={'CAMPAIGN_PERFORMANCE_REPORT': ['BiddingStrategyName', 'CampaignId']}):
+            projected = report_fields('CAMPAIGN_PERFORMANCE_REPORT', [Account, Campaign, DailyCampaignMetrics], required=['CampaignId'])
+        self.assertEqual(projected.count('Clicks'), 1)
+        self.assertEqual(projected[-1], 'Labels')
+        self.assertNotIn('BiddingStrategyName', projected)
+        self.assertIn('CampaignId', projected)
+
+    @override_settings(GOOGLEADWORDS_SYNC_BATCH_SIZE=2)
+    def test_dispatch_sync(self):
+        for account_id in range(5):
+            Account.objects.create(account_id=account_id)
+        Account.objects.create(account_id=5, status=Account.STATUS_INACTIVE)
+
+        dispatched = []
+        apply_async = group.apply_async
+        group.apply_async = lambda self, *args, **kwargs: dispatched.append(self)
+        try:
+            with self.assertNumQueries(1):
+                dispatch_sync(sync_ad=True)
+        finally:
+            group.apply_async = apply_async
+
+        batches = [signature.args[0] for signature in dispatched[0].tasks]
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 2])
+        self.assertEqual(sorted(sum(batches, [])), sorted(Account.objects.considered_active().values_list('pk', flat=True)))
+        self.assertEqual(dispatched[0].tasks[0].kwargs, {'sync_ad': True})
+
+    def test_schedule(self):
+        today = date.today()
+        stale = Account.objects.create(account_id=10, ad_last_synced=today - timedelta(days=5))
+        fresh_small = Account.objects.create(account_id=11, ad_last_synced=today - timedelta(days=1))
+        fresh_big = Account.objects.create(account_id=12, ad_last_synced=today - timedelta(days=1))
+        Account.objects.filter(pk=1).update(ad_last_synced=today - timedelta(days=1))
+        report_file = _get_report_file('ad_report.gz')
+        fresh_big.sync_ad(report_file=report_file)
+        # The rows imported are recorded so the scheduler doesn't need to count them
+        self.assertEqual(Account.objects.get(pk=fresh_big.pk).ad_report_rows, 44)
+
+        self.assertEqual(sync_levels(sync_account=False, sync_ad=True), ['sync_ad'])
+        self.assertEqual(sync_levels(), ['sync_account'])
+
+        # Never synced, then the most stale and, of those equally stale, the biggest first
+        batches = schedule(['sync_ad'], window=3600, jitter=0, batch_size=1)
+        never_synced = list(Account.objects.considered_active().filter(ad_last_synced=None).values_list('pk', flat=True))
+        order = [pks[0] for countdown, pks in batches]
+        self.assertEqual(order[len(never_synced):], [stale.pk, fresh_big.pk, 1, fresh_small.pk])
+
+        # Spread over the window in proportion to the size of each account
+        countdowns = [countdown for countdown, pks in batches]
+        self.assertEqual(countdowns, sorted(countdowns))
+        self.assertTrue(0 <= countdowns[-1] < 3600)
+        big = order.index(fresh_big.pk)
+        self.assertGreater(countdowns[big + 1] - countdowns[big], 3600 / 2)
+
+        jittered = schedule(['sync_ad'], window=0, jitter=60)
+        self.assertTrue(all(0 <= countdown <= 60 for countdown, pks in jittered))
+
+        # Batches sync their accounts in the order they were scheduled
+        synced = []
+        original = Account.__dict__['sync']  # the task method's descriptor
+        Account.sync = lambda account, **kwargs: synced.append(account.pk)
+        try:
+            sync_account_batch([fresh_small.pk, stale.pk, fresh_big.pk], sync_ad=True)
+        finally:
+            Account.sync = original
+        self.assertEqual(synced, [fresh_small.pk, stale.pk, fresh_big.pk])
+
+        # Claiming a level's sync resets its rows
+        token, levels = fresh_big.claim_sync(['ad'])
+        self.assertEqual(Account.objects.get(pk=fresh_big.pk).ad_report_rows, 0)
+
+    @override_settings(GOOGLEADWORDS_LIGHT_TASKS=True, GOOGLEADWORDS_IMPORT_CHUNKS=2)
+    def test_light_tasks(self):
+        account = Account.objects.get(pk=1)
+
+        dispatched = []
+        originals = [(cls, cls.apply_async) for cls in (Signature, chain, chord)]
+        for cls, apply_async in originals:
+            cls.apply_async = lambda self, *args, **kwargs: dispatched.append(self) or AsyncResult('dispatched')
+        try:
+            account.sync(sync_account=True, sync_ad=True)
+        finally:
+            for cls, apply_async in originals:
+                cls.apply_async = apply_async
+
+        # The tasks only carry primary keys so they can be serialized as JSON
+        signatures = _leaves(dispatched[0])
+        self.assertEqual(set(signature.task for signature in signatures), set(['django_google_adwords.account_task']))
+        payloads = [json.dumps([signature.args, signature.kwargs]) for signature in signatures]
+        self.assertFalse([payload for payload in payloads if 'this' in payload])
+        self.assertEqual(len([payload for payload in payloads if '"import_ad_chunk"' in payload]), 2)
+
+        # A duplicate sync is coalesced into the pipeline in flight
+        self.assertEqual(account.sync(sync_account=True).id, 'dispatched')
+        self.assertEqual(len(dispatched), 1)
+
+        report_file = _get_report_file('account_report.gz')
+        report_file.report_definition = Account.get_selector(start=date(2014, 5, 1), finish=date(2014, 6, 1))
+        descriptor = json.loads(json.dumps(ReportDescriptor.for_report_file(report_file)))
+        self.assertEqual(descriptor['date_range'], ['20140501', '20140601'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(list(ReportDescriptor(descriptor).report_file().iter_rows()), list(report_file.iter_rows()))
+        account_task(descriptor, account=account.pk, method='sync_account', window=None)
+        self.assertEqual(DailyAccountMetrics.objects.filter(account=account).count(), 30)
+
+    def test_sync_claim(self):
+        account = Account.objects.get(pk=1)
+        token, levels = account.claim_sync(['account', 'ad'])
+        self.assertEqual(levels, ['account', 'ad'])
+        self.assertEqual(list(Account.objects.syncing()), [account])
+        self.assertLess(Account.objects.get(pk=1).sync_running_for, timedelta(minutes=1))
+
+        # Levels already in flight are coalesced, others join the claim
+        duplicate = Account.objects.get(pk=1)
+        self.assertIsNone(duplicate.claim_sync(['ad']))
+        started = Account.sync_claim_expiry() + timedelta(seconds=1)
+        Account.objects.filter(pk=1).update(sync_started=started, sync_renewed=started)
+        self.assertEqual(duplicate.claim_sync(['ad', 'campaign']), (token, ['campaign']))
+        # which renews the claim, restarting its timeout, but the sync keeps running from its start
+        account = Account.objects.get(pk=1)
+        self.assertEqual(account.sync_started, started)
+        self.assertGreater(account.sync_running_for, timedelta(minutes=1))
+        self.assertGreater(account.sync_renewed, started)
+        self.assertEqual(list(Account.objects.syncing()), [account])
+        self.assertFalse(Account.objects.sync_expired().exists())
+
+        self.assertFalse(account.release_sync(token, ['account', 'ad']))
+        self.assertEqual(Account.objects.get(pk=1).sync_levels, 'campaign')
+        account.finish_sync(token=token, levels=['campaign'])
+        account = Account.objects.get(pk=1)
+        self.assertIsNone(account.sync_token)
+        self.assertEqual(account.status, Account.STATUS_ACTIVE)
+        self.assertFalse(Account.objects.syncing().exists())
+
+        # A claim that's not released expires
+        token, levels = account.claim_sync(['account'])
+        Account.objects.filter(pk=1).update(sync_renewed=Account.sync_claim_expiry() - timedelta(seconds=1))
+        self.assertEqual(list(Account.objects.sync_expired()), [account])
+        other_token, levels = Account.objects.get(pk=1).claim_sync(['account'])
+        self.assertNotEqual(other_token, token)
+        self.assertFalse(account.release_sync(token, ['account']))
+        self.assertEqual(Account.objects.get(pk=1).sync_token, other_token)
+        account = Account.objects.get(pk=1)
+        self.assertTrue(account.release_sync(other_token, ['account']))
+
+        # A sync that fails to dispatch releases its claim
+        def sync_canvas(*args, **kwargs):
+            raise RuntimeError('broker unavailable')
+        original = Account.sync_canvas
+        Account.sync_canvas = sync_canvas
+        try:
+            self.assertRaises(RuntimeError, account.sync, sync_account=True)
+        finally:
+            Account.sync_canvas = original
+        self.assertIsNone(Account.objects.get(pk=1).sync_token)
+
+    def test_row_plan(self):
+        report_file = _get_report_file('ad_report.gz')
+        row = next(report_file.dehydrate())
+
+        # The plan is compiled once per report header
+        plan = RowPlan.compile(DailyAdMetrics, row.fields, ['created', 'updated', 'ad', 'ad_id'])
+        self.assertIs(plan, RowPlan.compile(DailyAdMetrics, row.fields, ['created', 'updated', 'ad', 'ad_id']))
+
+        # Only the most recently used plans are kept
+        cache_size, RowPlan.cache_size = RowPlan.cache_size, 2
+        try:
+            other = RowPlan.compile(DailyAdMetrics, row.fields[:-1], ['created', 'updated', 'ad', 'ad_id'])
+            self.assertIs(plan, RowPlan.compile(DailyAdMetrics, row.fields, ['created', 'updated', 'ad', 'ad_id']))
+            RowPlan.compile(DailyAdMetrics, row.fields[:-2], ['created', 'updated', 'ad', 'ad_id'])
+            self.assertEqual(len(RowPlan._cache), 2)
+            self.assertIsNot(other, RowPlan.compile(DailyAdMetrics, row.fields[:-1], ['created', 'updated', 'ad', 'ad_id']))
+            self.assertIsNot(plan, RowPlan.compile(DailyAdMetrics, row.fields, ['created', 'updated', 'ad', 'ad_id']))
+        finally:
+            RowPlan.cache_size = cache_size
+        plan = RowPlan.compile(DailyAdMetrics, row.fields, ['created', 'updated', 'ad', 'ad_id'])
+        self.assertEqual(plan.currency_column, 'Currency')
+        self.assertNotIn('ad_id', [column[2] for column in plan.columns])
+
+        ad_metric = DailyAdMetrics()
+        update_fields = plan.populate(ad_metric, row)
+        self.assertIn('avg_position', update_fields)
+        self.assertIn('cost_currency', update_fields)
+        self.assertEqual(ad_metric.avg_position, Decimal('1.2'))
+        self.assertEqual(ad_metric.impressions, 20)
+        self.assertEqual(ad_metric.day, date(2014, 8, 6))
+
+    def test_report_file_iter_rows(self):
+        report_file = _get_report_file('ad_report.gz')
+        records = list(report_file.iter_rows())
+
+        # Neither the report name, header or summary are included
+        self.assertEqual(len(records), 44)
+        self.assertEqual(records[0].fields[0], 'Currency')
+        self.assertTrue(all(isinstance(record, ReportRecord) for record in records))
+        self.assertIs(records[0].index, records[-1].index)
+        self.assertEqual(records[0].get('Ad ID'), '40564055441')
+        self.assertEqual(records[0].get('Missing', 'default'), 'default')
+        self.assertNotEqual(records[-1][0], 'Total')
+
+        # Decoded as UTF-8 whatever the locale, quoted fields can span lines
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'unicode_report.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(u'"REPORT"\r\nAd ID,Headline\r\n1,"Caf\xe9 \u2615"\r\n2,"Two\r\nlines"\r\nTotal,--\r\n'.encode('utf-8'))
+        unicode_records = list(_get_report_file(path).iter_rows())
+        self.assertEqual([record.get('Headline') for record in unicode_records], [u'Caf\xe9 \u2615', u'Two\r\nlines'])
+
+        # Records and dicts populate a model identically
+        plan = RowPlan.compile(DailyAdMetrics, records[0].fields, ['created', 'updated', 'ad', 'ad_id'])
+        from_record = DailyAdMetrics()
+        from_dict = DailyAdMetrics()
+        self.assertEqual(plan.populate(from_record, records[0]), plan.populate(from_dict, next(report_file.dehydrate())))
+        self.assertEqual(from_record.cost, from_dict.cost)
+        self.assertEqual(from_record.clicks, from_dict.clicks)
+        self.assertIsNotNone(from_record.cost)
+
+    def test_report_stream(self):
+        path = _get_test_media_file_path('account_report.gz')
+        with gzip.open(path, 'rb') as f:
+            lines = f.read().splitlines(True)
+        with open(path, 'rb') as f:
+            self.assertEqual(list(gunzip_lines(f, chunk_size=7)), lines)
+
+        records = list(_get_report_file('account_report.gz').iter_rows())
+        with open(path, 'rb') as f:
+            self.assertEqual(list(ReportStream(f).iter_rows()), records)
+
+        # The compressed report can be saved to a ReportFile as it's read
+        report_file = ReportFile.objects.create()
+        with open(path, 'rb') as f:
+            report_stream = ReportStream(f, report_file=report_file)
+            self.assertEqual(report_stream.pk, report_file.pk)
+            account = Account.objects.get(pk=1)
+            account.sync_account(report_file=report_stream)
+        self.assertEqual(DailyAccountMetrics.objects.filter(account=account).count(), 30)
+        self.assertEqual(list(ReportFile.objects.get(pk=report_file.pk).iter_rows()), records)
+
+    def test_report_file_reuse(self):
+        report_definition = {
+            'reportType': 'ACCOUNT_PERFORMANCE_REPORT',
+            'downloadFormat': 'GZIPPED_CSV',
+            'selector': {'fields': ['Clicks', 'Date'], 'dateRange': {'min': '20140501', 'max': '20140601'}},
+        }
+        definition_hash = report_definition_hash(report_definition, '591-877-6172')
+        self.assertEqual(definition_hash, report_definition_hash(dict(reversed(list(report_definition.items()))), '591-877-6172'))
+        self.assertNotEqual(definition_hash, report_definition_hash(report_definition, '591-877-6173'))
+
+        report_file = _get_report_file('account_report.gz')
+        report_file.definition_hash = definition_hash
+        report_file.save()
+
+        # A fresh identical report is returned rather than downloaded
+        with override_settings(GOOGLEADWORDS_REPORT_FILE_REUSE_TTL=15 * 60):
+            self.assertEqual(ReportFile.objects.request(report_definition, '591-877-6172'), report_file)
+
+        ReportFile.objects.filter(pk=report_file.pk).update(created=report_file.created - timedelta(days=1))
+        self.assertIsNone(ReportFile.objects.fresh(definition_hash, 60 * 60))
+
+        # The lease on the download is renewed as the report is copied to the file
+        class ReportDownloader(object):
+            def DownloadReportAsStream(self, report_definition):
+                return open(_get_test_media_file_path('account_report.gz'), 'rb')
+
+        class Client(object):
+            def GetReportDownloader(self, version):
+                return ReportDownloader()
+
+        class Lease(object):
+            renewed = 0
+
+            def renew(self):
+                self.renewed += 1
+
+        lease = Lease()
+        original = adwords_models.adwords_service
+        adwords_models.adwords_service = lambda client_customer_id: Client()
+        try:
+            downloaded = ReportFile.objects.download(report_definition, '591-877-6172', definition_hash=definition_hash, lease=lease)
+        finally:
+            adwords_models.adwords_service = original
+        self.assertEqual(lease.renewed, 1)
+        self.assertEqual(list(downloaded.iter_rows()), list(report_file.iter_rows()))
+        self.assertEqual(ReportFile.objects.fresh(definition_hash, 60 * 60), downloaded)
+
+    @override_settings(GOOGLEADWORDS_IMPORT_BACKEND='copy')
+    def test_daily_account_metrics_copy_backend(self):
+        report_file = _get_report_file('account_report.gz')
+        account = Account.objects.get(pk=1)
+        records = list(report_file.iter_rows())
+
+        # The staging rows are the text form of each field in order
+        loader = PostgresCopyLoader(DailyAccountMetrics)
+        items = [(record, dict(device=record.get('Device'), day=record.get('Day'), account=account)) for record in records]
+        rows = list(loader.rows(items, lambda data: DailyAccountMetrics.objects.row_plan(data, ['account', 'account_id'])))
+        self.assertEqual(len(rows), 30)
+        row = dict(zip([field.attname for field in loader.fields], rows[0]))
+        self.assertEqual(row['account_id'], '1')
+        self.assertEqual(row['cost_currency'], 'AUD')
+        self.assertEqual(row['est_cross_device_conv'], NULL)
+
+        # Databases other than PostgreSQL fall back to the ORM
+        created, updated, skipped = DailyAccountMetrics.objects.populate_many([(record, account) for record in records])
+        self.assertEqual(created, 30)
+        self.assertEqual(DailyAccountMetrics.objects.filter(account=account).count(), 30)
+
+    @skipIf(connection.vendor != 'postgresql', 'COPY requires PostgreSQL')
+    def test_postgres_copy_loader(self):
+        report_file = _get_report_file('account_report.gz')
+        account = Account.objects.get(pk=1)
+        items = [(record, dict(device=record.get('Device'), day=record.get('Day'), account=account)) for record in report_file.iter_rows()]
+        plan_for = lambda data: DailyAccountMetrics.objects.row_plan(data, ['account', 'account_id'])
+
+        # A table named like the staging table outside pg_temp is left alone
+        cursor = connection.cursor()
+        cursor.execute('CREATE TABLE "%s_staging" (id integer)' % DailyAccountMetrics._meta.db_table)
+        try:
+            loader = PostgresCopyLoader(DailyAccountMetrics)
+            self.assertEqual(loader.load(items, plan_for), (30, 0, 0))
+            self.assertEqual(DailyAccountMetrics.objects.filter(account=account).count(), 30)
+
+            # Unchanged rows are skipped, changed rows updated
+            self.assertEqual(loader.load(items, plan_for), (0, 0, 30))
+            DailyAccountMetrics.objects.filter(pk=DailyAccountMetrics.objects.filter(account=account)[0].pk).update(fingerprint='changed')
+            self.assertEqual(loader.load(items, plan_for), (0, 1, 29))
+
+            cursor.execute('SELECT COUNT(*) FROM "%s_staging"' % DailyAccountMetrics._meta.db_table)
+        finally:
+            cursor.execute('DROP TABLE IF EXISTS "%s_staging"' % DailyAccountMetrics._meta.db_table)
+            cursor.close()
+
+    def test_delete_duplicates(self):
+        report_file = _get_report_file('ad_report.gz')
+        account = Account.objects.get(pk=1)
+        account.sync_ad(report_file=report_file)
+
+        ad = Ad.objects.get(ad_id=40564055441)
+        duplicate = Ad.objects.create(ad_group=ad.ad_group, ad_id=ad.ad_id, ad=ad.ad)
+        self.assertEqual(Ad.objects.count(), 45)
+
+        self.assertEqual(delete_duplicates(Ad.objects.all(), ('ad_group', 'ad_id'), dry_run=True), 1)
+        self.assertEqual(Ad.objects.count(), 45)
+
+        # The most recently created row is kept
+        self.assertEqual(delete_duplicates(Ad.objects.all(), ('ad_group', 'ad_id')), 1)
+        self.assertEqual(Ad.objects.count(), 44)
+        self.assertEqual(Ad.objects.get(ad_id=40564055441).pk, duplicate.pk)
+
+    def test_import_lease(self):
+        account = Account.objects.get(pk=1)
+        lease = account.import_lease(DailyAccountMetrics)
+        self.assertTrue(lease.acquire(blocking=False))
+
+        # Another worker can't take the lease until it's released
+        other = account.import_lease(DailyAccountMetrics)
+        self.assertFalse(other.acquire(blocking=False))
+        ad_lease = account.import_lease(DailyAdMetrics)
+        self.assertTrue(ad_lease.acquire(blocking=False))
+        ad_lease.release()
+
+        lease.renew(force=True)
+        lease.release()
+        self.assertTrue(other.acquire(blocking=False))
+
+        # A lease taken by someone else can't be renewed
+        self.assertRaises(LeaseLostError, lease.renew, force=True)
+
+        # Imports don't wait for a lease that's held, they're retried
+        try:
+            with lease:
+                self.fail('The lease is held')
+        except LeaseBusyError as exc:
+            self.assertEqual(exc.retry_after_seconds, 30)
+
+        # Leases taken together are all acquired or none are
+        campaign_lease = account.import_lease(DailyCampaignMetrics)
+        self.assertRaises(LeaseBusyError, ImportLeases(campaign_lease, lease).__enter__)
+        self.assertTrue(campaign_lease.acquire(blocking=False))
+        campaign_lease.release()
+        other.release()
+
+        # The derived metrics' leases are taken before the ad data report is imported
+        campaign_lease.acquire(blocking=False)
+        rows = []
+        report_file = _get_report_file('ad_report.gz')
+        report_file.iter_rows = lambda: rows.append(1) or iter([])
+        self.assertRaises(LeaseBusyError, account.sync_ad, report_file=report_file, derive=['campaign'])
+        self.assertEqual(rows, [])
+        self.assertTrue(ad_lease.acquire(blocking=False))
+        ad_lease.release()
+        campaign_lease.release()
+
+    def test_date_windows(self):
+        self.assertEqual(list(date_windows(date(2014, 7, 1), date(2014, 7, 16), 7)), [
+            (date(2014, 7, 1), date(2014, 7, 7)),
+            (date(2014, 7, 8), date(2014, 7, 14)),
+            (date(2014, 7, 15), date(2014, 7, 16)),
+        ])
+        self.assertEqual(list(date_windows(date(2014, 7, 1), date(2014, 7, 1), 7)), [(date(2014, 7, 1), date(2014, 7, 1))])
+
+    @override_settings(GOOGLEADWORDS_BACKFILL_WINDOW_DAYS=7)
+    def test_backfill_windows(self):
+        account = Account.objects.get(pk=1)
+        start = date.today() - timedelta(days=150)
+        windows = account.report_imports(Account, start, 'sync_account', backfill=True)
+        self.assertEqual(len(windows.tasks), 22)
+
+        # Each window is its own report, imported under its own lease
+        first = windows.tasks[0].tasks
+        self.assertEqual(first[0].args[0]['selector']['dateRange'], {'min': start.strftime('%Y%m%d'),
+                                                                     'max': (start + timedelta(days=6)).strftime('%Y%m%d')})
+        self.assertEqual(first[1].kwargs['window'], start.isoformat())
+
+        report_file = _get_report_file('account_report.gz')
+        with account.import_lease(DailyAccountMetrics, chunk=start.isoformat()):
+            account.sync_account(report_file=report_file, window=(start + timedelta(days=7)).isoformat())
+        self.assertEqual(DailyAccountMetrics.objects.filter(account=account).count(), 30)
+
+        # Syncs that aren't backfills are a single report
+        self.assertEqual(len(account.report_imports(Account, start, 'sync_account').tasks), 2)
+
+    def test_client_pool(self):
+        pool = ClientPool()
+        created = []
+
+        def factory():
+            created.append(object())
+            return created[-1]
+
+        client = pool.get('591-877-6172', factory, 60)
+        self.assertIs(pool.get('591-877-6172', factory, 60), client)
+        self.assertIsNot(pool.get('123-456-7890', factory, 60), client)
+        self.assertEqual(len(created), 2)
+
+        # Expired clients are replaced
+        pool.get('expired', factory, -1)
+        self.assertIsNot(pool.get('expired', factory, 60), created[2])
+        self.assertEqual(len(created), 4)
+
+    def test_refresh_access_token(self):
+        class OAuth2Client(object):
+            refreshed = 0
+
+            def __init__(self, token_expiry):
+                self.oauth2credentials = type('Credentials', (object,), {'token_expiry': token_expiry})
+
+            def Refresh(self):
+                self.refreshed += 1
+
+        fresh = OAuth2Client(datetime.utcnow() + timedelta(hours=1))
+        refresh_access_token(fresh, margin=10 * 60)
+        self.assertEqual(fresh.refreshed, 0)
+
+        expiring = OAuth2Client(datetime.utcnow() + timedelta(minutes=5))
+        refresh_access_token(expiring, margin=10 * 60)
+        self.assertEqual(expiring.refreshed, 1)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket('test-%s' % id(self), rate=1, capacity=2)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+
+        # Empty, the bucket is refilled within capacity / rate seconds
+        seconds = bucket.take()
+        self.assertTrue(0 < seconds <= 2)
+
+        # The bucket shares its state with every other instance of the same name
+        other = TokenBucket('test-%s' % id(self), rate=1, capacity=2)
+        self.assertTrue(other.take() > 0)
+
+        # A RateExceededError pauses the bucket for retryAfterSeconds
+        other.pause(30)
+        self.assertTrue(30 < bucket.take() <= 31)
+
+        # Without GOOGLEADWORDS_RATE_LIMIT calls aren't limited
+        limiter = api_rate_limiter()
+        self.assertEqual([limiter.take() for i in range(100)], [0] * 100)
+        with override_settings(GOOGLEADWORDS_RATE_LIMIT=1, GOOGLEADWORDS_RATE_LIMIT_BURST=None):
+            self.assertEqual(api_rate_limiter().capacity, 1)
+
+    def test_throttled_retries(self):
+        account = Account.objects.get(pk=1)
+        report_file = _get_report_file('account_report.gz')
+        attempts = []
+
+        def request(queryset, report_definition, client_customer_id):
+            attempts.append(client_customer_id)
+            if len(attempts) <= 5:
+                raise ThrottledError(0)
+            return report_file
+
+        original = ReportFile.QuerySet.request
+        ReportFile.QuerySet.request = request
+        try:
+            # Waiting on the rate limiter doesn't count towards max_retries (3)
+            result = Account.create_report_file.apply((Account.get_selector(),), {'this': account})
+            # Eagerly each retry runs within the last, a failed retry would have been raised
+            self.assertEqual(result.state, 'RETRY')
+            self.assertEqual(len(attempts), 6)
+
+            del attempts[:]
+            result = account_task.apply((Account.get_selector(),), {'account': account.pk, 'method': 'create_report_file'})
+            self.assertEqual(result.state, 'RETRY')
+            self.assertEqual(len(attempts), 6)
+        finally:
+            ReportFile.QuerySet.request = original
+
+    @skipIf(sys.version_info < (3, 6), 'django_google_adwords.aio requires Python 3.6+')
+    @override_settings(GOOGLEADWORDS_ASYNC_CONCURRENCY=2)
+    def test_aio_request(self):
+        from django_google_adwords.aio import arequest
+        import asyncio
+
+        lock = threading.Lock()
+        running = []
+        concurrent = []
+        attempts = []
+
+        def request(queryset, report_definition, client_customer_id):
+            with lock:
+                attempts.append(client_customer_id)
+                running.append(client_customer_id)
+                concurrent.append(len(running))
+            time.sleep(0.01 * (3 - int(client_customer_id) % 3))
+            with lock:
+                running.remove(client_customer_id)
+            if client_customer_id == '3' and attempts.count('3') == 1:
+                raise ThrottledError(0)
+            if client_customer_id == '4':
+                raise RateExceededError(0)
+            return client_customer_id
+
+        loop = asyncio.new_event_loop()
+        original = ReportFile.QuerySet.request
+        ReportFile.QuerySet.request = request
+        try:
+            # Results are in order, with at most GOOGLEADWORDS_ASYNC_CONCURRENCY requests at once
+            ids = [str(i) for i in (0, 1, 2, 3, 5, 6)]
+            results = loop.run_until_complete(asyncio.gather(*[arequest({}, i) for i in ids], loop=loop))
+            self.assertEqual(results, ids)
+            self.assertEqual(max(concurrent), 2)
+            # Waiting on the rate limiter isn't a retry
+            self.assertEqual(attempts.count('3'), 2)
+
+            # RateExceededErrors are retried, then raised
+            self.assertRaises(RateExceededError, loop.run_until_complete, arequest({}, '4', retries=2))
+            self.assertEqual(attempts.count('4'), 3)
+        finally:
+            ReportFile.QuerySet.request = original
+            loop.close()
+
+    @skipIf(sys.version_info < (3, 6), 'django_google_adwords.aio requires Python 3.6+')
+    def test_aio_paged_request(self):
+        from django_google_adwords.aio import apaged_request
+        import asyncio
+
+        class Service(object):
+            rate_exceeded_at = None
+
+            def get(self, selector):
+                start_index = int(selector['paging']['startIndex'])
+                if start_index == 6:
+                    raise GoogleAdsError('Internal error')
+                if start_index == self.rate_exceeded_at:
+                    self.rate_exceeded_at = None
+                    error = GoogleAdsError('RateExceededError')
+                    fault = type('Fault', (object,), {'retryAfterSeconds': '1', 'ApiError.Type': 'RateExceededError'})
+                    error.fault = type('Fault', (object,), {'detail': type('Detail', (object,), {'ApiExceptionFault': type('ApiExceptionFault', (object,), {'errors': [fault]})})})
+                    raise error
+                return type('Page', (object,), {'entries': [start_index], 'totalNumEntries': '10'})
+
+        def collect(pages):
+            entries = []
+            while True:
+                try:
+                    data, selector = loop.run_until_complete(pages.__anext__())
+                except StopAsyncIteration:
+                    return entries
+                entries.extend(data)
+
+        loop = asyncio.new_event_loop()
+        try:
+            # Pages are yielded in order
+            self.assertEqual(collect(apaged_request(Service(), number_results=2, number_pages=3)), [0, 2, 4])
+            # A request resumed after being rate limited keeps to number_pages
+            service = Service()
+            service.rate_exceeded_at = 2
+            self.assertEqual(collect(apaged_request(service, number_results=2, number_pages=3)), [0, 2, 4])
+            # Errors other than rate limiting are raised
+            self.assertRaises(GoogleAdsError, collect, apaged_request(Service(), number_results=2))
+        finally:
+            loop.close()
+
+    @override_settings(GOOGLEADWORDS_RATE_LIMIT=1000)
+    def test_paged_request_checkpoint(self):
+        class Service(object):
+            def __init__(self, rate_exceeded_at):
+                self.rate_exceeded_at = rate_exceeded_at
+
+            def get(self, selector):
+                start_index = int(selector['paging']['startIndex'])
+                if start_index == self.rate_exceeded_at:
+                    self.rate_exceeded_at = None
+                    error = GoogleAdsError('RateExceededError')
+                    fault = type('Fault', (object,), {'retryAfterSeconds': '30', 'ApiError.Type': 'RateExceededError'})
+                    error.fault = type('Fault', (object,), {'detail': type('Detail', (object,), {'ApiExceptionFault': type('ApiExceptionFault', (object,), {'errors': [fault]})})})
+                    raise error
+                return type('Page', (object,), {'entries': [start_index], 'totalNumEntries': '5'})
+
+        service = Service(rate_exceeded_at=2)
+        pages = []
+        try:
+            for entries, selector in paged_request(service, {}, number_results=1, checkpoint=True):
+                pages.extend(entries)
+        except PagedRequestCheckpoint as exc:
+            self.assertEqual(exc.retry_after_seconds, 30)
+            checkpoint = pickle.loads(pickle.dumps(exc))
+        self.assertEqual(pages, [0, 1])
+        self.assertEqual(checkpoint.start_index, 2)
+
+        # Resuming continues from the page that was rate limited (once the limiter is unpaused)
+        cache.clear()
+        for entries, selector in paged_request(service, checkpoint.selector, number_results=1, start_index=checkpoint.start_index, checkpoint=True):
+            pages.extend(entries)
+        self.assertEqual(pages, [0, 1, 2, 3, 4])
+        self.assertFalse(checkpoint.number_pages)
+
+        # as does the page budget
+        cache.clear()
+        service = Service(rate_exceeded_at=1)
+        pages = []
+        try:
+            for entries, selector in paged_request(service, {}, number_results=1, number_pages=3, checkpoint=True):
+                pages.extend(entries)
+        except PagedRequestCheckpoint as exc:
+            checkpoint = pickle.loads(pickle.dumps(exc))
+        self.assertEqual((checkpoint.start_index, checkpoint.number_pages), (1, 2))
+        cache.clear()
+        for entries, selector in paged_request(service, checkpoint.selector, number_results=1, start_index=checkpoint.start_index,
+                                               number_pages=checkpoint.number_pages, checkpoint=True):
+            pages.extend(entries)
+        self.assertEqual(pages, [0, 1, 2])
+
+    def test_paged_request_rate_exceeded(self):
+        requested = []
+
+        class Service(object):
+            def get(self, selector):
+                start_index = int(selector['paging']['startIndex'])
+                requested.append((start_index, time.time()))
+                if len(requested) == 2:
+                    error = GoogleAdsError('RateExceededError')
+                    fault = type('Fault', (object,), {'retryAfterSeconds': '1', 'ApiError.Type': 'RateExceededError'})
+                    error.fault = type('Fault', (object,), {'detail': type('Detail', (object,), {'ApiExceptionFault': type('ApiExceptionFault', (object,), {'errors': [fault]})})})
+                    raise error
+                return type('Page', (object,), {'entries': [start_index], 'totalNumEntries': '3'})
+
+        # Without GOOGLEADWORDS_RATE_LIMIT the retry still waits out retryAfterSeconds
+        pages = []
+        for entries, selector in paged_request(Service(), {}, number_results=1):
+            pages.extend(entries)
+        self.assertEqual(pages, [0, 1, 2])
+        self.assertEqual([start_index for start_index, requested_at in requested], [0, 1, 1, 2])
+        self.assertTrue(requested[2][1] - requested[1][1] >= 1)
+
+    @override_settings(GOOGLEADWORDS_RATE_LIMIT=1000)
+    def test_paged_request_concurrency(self):
+        threads = set()
+
+        class Service(object):
+            def get(self, selector):
+                threads.add(threading.current_thread().ident)
+                start_index = int(selector['paging']['startIndex'])
+                time.sleep(0.01 * (start_index % 3))
+                return type('Page', (object,), {'entries': [start_index], 'totalNumEntries': '20'})
+
+        class Client(object):
+            def GetService(self, name, version):
+                return Service()
+
+        def request(service, **kwargs):
+            pages = []
+            for entries, selector in paged_request(service, {}, number_results=2, **kwargs):
+                self.assertEqual(selector['paging']['startIndex'], str(entries[0]))
+                pages.extend(entries)
+            return pages
+
+        original = helper.adwords_service
+        helper.adwords_service = lambda *args, **kwargs: Client()
+        try:
+            # Pages are yielded in order although they're retrieved concurrently
+            self.assertEqual(request('CampaignService', concurrency=4), list(range(0, 20, 2)))
+            self.assertTrue(len(threads) > 1)
+            self.assertEqual(request('CampaignService', concurrency=4, number_pages=3), [0, 2, 4])
+        finally:
+            helper.adwords_service = original
+
+        # A service object isn't shared between threads
+        threads.clear()
+        self.assertEqual(request(Service(), concurrency=4), list(range(0, 20, 2)))
+        self.assertEqual(threads, set([threading.current_thread().ident]))
+        self.assertEqual(request(Service(), number_pages=3), [0, 2, 4])
+
+    def test_concurrent_paged_request_rate_exceeded(self):
+        requested = []
+
+        class Service(object):
+            def get(self, selector):
+                start_index = int(selector['paging']['startIndex'])
+                requested.append((start_index, time.time()))
+                if start_index == 2 and len([i for i, requested_at in requested if i == 2]) == 1:
+                    error = GoogleAdsError('RateExceededError')
+                    fault = type('Fault', (object,), {'retryAfterSeconds': '1', 'ApiError.Type': 'RateExceededError'})
+                    error.fault = type('Fault', (object,), {'detail': type('Detail', (object,), {'ApiExceptionFault': type('ApiExceptionFault', (object,), {'errors': [fault]})})})
+                    raise error
+                return type('Page', (object,), {'entries': [start_index], 'totalNumEntries': '4'})
+
+        class Client(object):
+            def GetService(self, name, version):
+                return Service()
+
+        original = helper.adwords_service
+        helper.adwords_service = lambda *args, **kwargs: Client()
+        try:
+            # Without GOOGLEADWORDS_RATE_LIMIT the retry still waits out retryAfterSeconds
+            pages = []
+            for entries, selector in paged_request('CampaignService', {}, number_results=1, concurrency=2):
+                pages.extend(entries)
+        finally:
+            helper.adwords_service = original
+        self.assertEqual(pages, [0, 1, 2, 3])
+        rate_exceeded_at, retried_at = [requested_at for i, requested_at in requested if i == 2]
+        self.assertTrue(retried_at - rate_exceeded_at >= 1)
+
+    def test_shared_refresh_token_client(self):
+        class RefreshTokenClient(SharedRefreshTokenClient):
+            refreshed = 0
+
+            def refresh_token(self):
+                self.refreshed += 1
+                self.oauth2credentials.access_token = 'token-%s' % id(self)
+                self.oauth2credentials.token_expiry = datetime.utcnow() + timedelta(hours=1)
+
+        worker = RefreshTokenClient('client-id', 'secret', 'refresh-token-%s' % id(self))
+        worker.Refresh()
+        self.assertEqual(worker.refreshed, 1)
+
+        # Other processes with the same credentials reuse the stored token
+        other = RefreshTokenClient('client-id', 'secret', 'refresh-token-%s' % id(self))
+        other.Refresh()
+        self.assertEqual(other.refreshed, 0)
+        self.assertEqual(other.oauth2credentials.access_token, worker.oauth2credentials.access_token)
+
+        different = RefreshTokenClient('client-id', 'secret', 'another-refresh-token-%s' % id(self))
+        different.Refresh()
+        self.assertEqual(different.refreshed, 1)
+
+    @override_settings(GOOGLEADWORDS_LOCK_BACKEND='django_google_adwords.lock.LocalLockBackend',
+                       GOOGLEADWORDS_LOCK_WAIT=10)
+    def test_local_lock_backend(self):
+        backend = get_lock_backend()
+        acquired = []
+
+        def wait():
+            with googleadwords_lock(Campaign, 1):
+                acquired.append(time.time())
+
+        with googleadwords_lock(Campaign, 1):
+            self.assertIsNone(backend.acquire(get_googleadwords_lock_id(Campaign, 1), 60, blocking=False))
+            waiter = threading.Thread(target=wait)
+            waiter.start()
+            time.sleep(0.1)
+            self.assertEqual(acquired, [])
+            released = time.time()
+        waiter.join(5)
+
+        # The waiter is woken on release rather than after LOCK_WAIT
+        self.assertEqual(len(acquired), 1)
+        self.assertLess(acquired[0] - released, 1)
+
+        # Leases use the same backend
+        lease = Account.objects.get(pk=1).import_lease(DailyAccountMetrics)
+        self.assertTrue(lease.acquire(blocking=False))
+        self.assertIs(lease.backend, backend)
+        lease.release()
+
+    @skipIf(connection.vendor != 'postgresql', 'Advisory locks require PostgreSQL')
+    @override_settings(GOOGLEADWORDS_LOCK_BACKEND='django_google_adwords.lock.PostgresAdvisoryLockBackend',
+                       GOOGLEADWORDS_LOCK_DATABASE='default')
+    def test_postgres_advisory_lock_backend(self):
+        backend = get_lock_backend()
+        key = get_googleadwords_lock_id(Campaign, 1)
+        token = backend.acquire(key, 60)
+        self.assertTrue(backend.renew(key, token, 60))
+
+        # Another session can't acquire it
+        def acquire():
+            acquired.append(backend.acquire(key, 60, blocking=False))
+            connection.close()
+        acquired = []
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        thread.join(5)
+        self.assertEqual(acquired, [None])
+
+        # A released lock (or one lost with its session) isn't renewed
+        backend.release(key, token)
+        self.assertFalse(backend.renew(key, token, 60))
+
+    @override_settings(GOOGLEADWORDS_ROW_LOCKS=False)
+    def test_sync_account_without_row_locks(self):
+        report_file = _get_report_file('account_report.gz')
+        account = Account.objects.get(pk=1)
+        account.sync_account(report_file=report_file)
+        self.assertEqual(DailyAccountMetrics.objects.filter(account=account).count(), 30)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for populating DailyAdMetrics instances from report rows.
+
+Compares the per-row field resolution that populate_model_from_dict used to perform
+(attribute_to_field_name, _meta.get_field and the isinstance chain for every column of
+every row) against the RowPlan compiled once from the report header, for both the dict
+rows yielded by ReportFile.dehydrate and the tuple records yielded by ReportFile.iter_rows.
+
+Run from the root of the repository;
+
+    python scripts/benchmark_row_plan.py [number of rows]
+"""
+from __future__ import print_function
+from decimal import Decimal
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import runtests  # noqa - configures settings
+
+import django
+django.setup()
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models.fields import FieldDoesNotExist, DecimalField
+from django_google_adwords.errors import ValidationError
+from django_google_adwords.models import DailyAdMetrics, ReportFile, RowPlan, attribute_to_field_name
+from djmoney.models.fields import MoneyField
+
+IGNORE_FIELDS = ['created', 'updated', 'ad', 'ad_id']
+
+
+def legacy_populate_model_from_dict(model, data, ignore_fields=IGNORE_FIELDS):
+    """
+    The implementation of populate_model_from_dict prior to RowPlan.
+    """
+    update_fields = []
+    currency = None
+
+    def clean(value, field):
+        if value == ' --':
+            return None
+        elif isinstance(field, MoneyField):
+            if int(value) > 0:
+                return Decimal(value) / 1000000
+            return Decimal(value)
+        elif isinstance(field, DecimalField):
+            mapping = [('%', ''), ('<', ''), ('>', ''), (',', ''), (' ', '')]
+            for k, v in mapping:
+                value = value.replace(k, v)
+            return value
+        else:
+            return value
+
+    for key, _value in data.items():
+        field_name = attribute_to_field_name(key)
+        if field_name in ignore_fields:
+            continue
+        if field_name == 'currency':
+            currency = _value
+        try:
+            field = model._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            continue
+
+        value = clean(_value, field)
+        try:
+            value = field.to_python(value)
+        except DjangoValidationError as e:
+            raise ValidationError(field_name, e.messages)
+
+        if value != getattr(model, field_name):
+            update_fields.append(field_name)
+            setattr(model, field_name, value)
+
+    for field_name in update_fields:
+        field = model._meta.get_field(field_name)
+        if isinstance(field, MoneyField):
+            currency_field_name = '%s_currency' % field_name
+            update_fields.append(currency_field_name)
+            setattr(model, currency_field_name, currency)
+
+    return update_fields
+
+
+def planned_populate_model_from_dict(model, data, ignore_fields=IGNORE_FIELDS):
+    return RowPlan.compile(DailyAdMetrics, data.fields, ignore_fields).populate(model, data)
+
+
+def benchmark(populate, rows):
+    # Instances are created up front so only the population of each row is timed
+    models = [DailyAdMetrics() for _ in rows]
+    started = time.time()
+    for model, row in zip(models, rows):
+        populate(model, row)
+    return len(rows) / (time.time() - started)
+
+
+def main(number_rows=5000):
+    report_file = ReportFile(file='ad_report.gz')
+    rows = list(report_file.dehydrate())
+    rows = (rows * (number_rows // len(rows) + 1))[:number_rows]
+
+    records = list(report_file.iter_rows())
+    records = (records * (number_rows // len(records) + 1))[:number_rows]
+
+    before = benchmark(legacy_populate_model_from_dict, rows)
+    after = benchmark(planned_populate_model_from_dict, rows)
+    after_records = benchmark(planned_populate_model_from_dict, records)
+
+    print('Populated %d DailyAdMetrics rows' % len(rows))
+    print('before:           %10.0f rows/sec' % before)
+    print('after (dicts):    %10.0f rows/sec (%.1fx)' % (after, after / before))
+    print('after (records):  %10.0f rows/sec (%.1fx)' % (after_records, after_records / before))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -4,6 +4,7 @@
 try:
     from setuptools import setup, find_packages
     from setuptools.command.test import test
+    from setuptools.command.build_py import build_py
     is_setuptools = True
 except ImportError:
     raise
@@ -11,6 +12,7 @@ except ImportError:
     use_setuptools()
     from setuptools import setup, find_packages           # noqa
     from setuptools.command.test import test              # noqa
+    from setuptools.command.build_py import build_py      # noqa
     is_setuptools = False
 
 import os
@@ -95,6 +97,32 @@ def reqs(*f):
 
 install_requires = reqs('default.txt')
 
+# -*- Python 3.6+ modules -*-
+
+PY36_MODULES = [('django_google_adwords', 'aio')]
+
+
+class BuildPy(build_py):
+    """
+    Leave the modules that require Python 3.6+ (async generators) out of builds for older
+    Pythons, so installing doesn't fail to byte-compile them. Source distributions still
+    include them.
+    """
+    all_modules = False
+
+    def find_package_modules(self, package, package_dir):
+        modules = build_py.find_package_modules(self, package, package_dir)
+        if py_version < (3, 6) and not self.all_modules:
+            modules = [module for module in modules if module[:2] not in PY36_MODULES]
+        return modules
+
+    def get_source_files(self):
+        self.all_modules = True
+        try:
+            return build_py.get_source_files(self)
+        finally:
+            self.all_modules = False
+
 # -*- Tests Requires -*-
 
 tests_require = reqs('test.txt')
@@ -120,6 +148,7 @@ setup(
     packages=find_packages(exclude=['tests', 'tests.*', 'scripts']),
     zip_safe=False,
     install_requires=install_requires,
+    cmdclass={'build_py': BuildPy},
     #tests_require=tests_require,
     #test_suite='nose.collector',
     classifiers=classifiers,